@@ -1,12 +1,22 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import math
+import time
+from fastapi import FastAPI, HTTPException, File, Form, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from constants import ANSWER_BATCH_MAX_ITEMS
 # Import custom modules
-from lib.grammar_check import grammar_check
-from lib.check_answer import validate_answer
-from lib.generate_questions import generate, extract_all_topics, generate_questions
-from config.openai import client
+from lib.grammar_check import grammar_check_async, grammar_check_stream_async, split_english
+from lib.check_answer import validate_answer_async, validate_answers_async
+from lib.question_pipeline import (GenerationRequestError, generate_for_book_async, load_book_async, plan_topics,
+                                   stream_for_targets_async)
+from lib.jobs import get_job_queue, TERMINAL_STATUSES
+from lib.job_kinds import UploadError, save_upload
+from lib.governor import UpstreamError
+from lib import metrics
 
 # Initialize FastAPI app
 app = FastAPI(title="Text Analysis API",
@@ -22,6 +32,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    # For streamed responses this is the time until the response starts
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route,
+                                 status=response.status_code)
+    return response
+
+# An overloaded or failing upstream API is reported as 429/503 with Retry-After, so clients back off
+def _retry_headers(e: UpstreamError) -> Optional[dict]:
+    return {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else None
+
+def _server_error(e: Exception) -> HTTPException:
+    if isinstance(e, UpstreamError):
+        return HTTPException(status_code=e.status_code, detail=str(e), headers=_retry_headers(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+@app.exception_handler(UpstreamError)
+async def upstream_error(request: Request, e: UpstreamError):
+    return JSONResponse(status_code=e.status_code, content={"detail": str(e)}, headers=_retry_headers(e))
+
 # Request/Response Models
 class GrammarCheckRequest(BaseModel):
     text: str
@@ -43,57 +76,162 @@ class AnswerValidationResponse(BaseModel):
     score: float
     incorrect_facts: List[IncorrectFact]
 
+class AnswerBatchRequest(BaseModel):
+    items: List[AnswerValidationRequest]
+
+class AnswerBatchResponse(BaseModel):
+    results: List[dict]
+
 class GenerationRequest(BaseModel):
     book: str
     subject: str
     num_questions: int = 5
     type: str = "text_based"
+    topic: Optional[str] = None
+    subtopic: Optional[str] = None
 
 class GenerationResponse(BaseModel):
-    questions: List[str]
+    questions: List[dict]
+    topics: List[dict] = []
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    params: dict
+    progress: Optional[dict] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    timings: dict
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
-# Endpoints
+# Endpoints (async: LLM and index calls are awaited instead of holding a worker thread)
 @app.post("/grammar/check", response_model=GrammarCheckResponse)
-def check_grammar(request: GrammarCheckRequest):
+async def check_grammar(request: GrammarCheckRequest):
     try:
-        print(request.text)
-        results = grammar_check(request.text)
-        return {"results": [r.dict() for r in results]}
+        results = await grammar_check_async(request.text)
+        with metrics.timed("serialization"):
+            return {"results": [r.model_dump() for r in results]}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _server_error(e)
 
 @app.post("/answer/analyze", response_model=AnswerValidationResponse)
-def analyze_answer(request: AnswerValidationRequest):
+async def analyze_answer(request: AnswerValidationRequest):
     try:
-        return validate_answer(request.question, request.user_answer, request.subject, client)
+        return await validate_answer_async(request.question, request.user_answer, request.subject)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _server_error(e)
+
+@app.post("/answer/analyze/batch", response_model=AnswerBatchResponse)
+async def analyze_answers(request: AnswerBatchRequest):
+    if len(request.items) > ANSWER_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {ANSWER_BATCH_MAX_ITEMS} items per batch.")
+    try:
+        return {"results": await validate_answers_async([item.model_dump() for item in request.items])}
+    except Exception as e:
+        raise _server_error(e)
 
 @app.post("/generate/questions", response_model=GenerationResponse)
-def generate_questions_api(request: GenerationRequest):
+async def generate_questions_api(request: GenerationRequest):
     try:
-        results = generate(book=request.book, subject=request.subject)
-        if not results:
-            raise HTTPException(status_code=400, detail="No text generated.")
-        
-        topics = extract_all_topics(results)
-        combined_texts = "\n".join("\n".join(res["text"]) for res in results)
-        main_topics = [sub.topic for sub in topics.main_topics]
-        
-        if len(main_topics) < 2:
-            raise HTTPException(status_code=400, detail="Not enough topics extracted.")
-        
-        questions_response = generate_questions(
-            main_topic=main_topics[0],
-            subtopic=main_topics[1],
-            context=combined_texts,
-            question_type=request.type,
-            num_questions=request.num_questions
-        )
-        
-        return {"questions": [q.dict() if hasattr(q, "dict") else str(q) for q in questions_response.questions]}
+        return await generate_for_book_async(request.subject, request.book, request.num_questions, request.type,
+                                             request.topic, request.subtopic)
+    except GenerationRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _server_error(e)
+
+# Streaming variants: newline-delimited JSON, one line per result as soon as it is ready
+NDJSON = "application/x-ndjson"
+
+def _ndjson_line(obj: dict) -> str:
+    with metrics.timed("serialization"):
+        return json.dumps(obj) + "\n"
+
+@app.post("/grammar/check/stream")
+async def check_grammar_stream(request: GrammarCheckRequest):
+    """One line per sentence, `{"index": ..., **GrammarModel}`, in completion order."""
+    try:
+        sentences = await asyncio.to_thread(split_english, request.text)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def lines():
+        async for index, result in grammar_check_stream_async(sentences):
+            yield _ndjson_line({"index": index, **result.model_dump()})
+
+    return StreamingResponse(lines(), media_type=NDJSON)
+
+@app.post("/generate/questions/stream")
+async def generate_questions_stream(request: GenerationRequest):
+    """
+    A `topic` line per topic the questions are spread over, then `question` lines as the models write
+    them; `error` for a topic whose generation failed.
+    """
+    try:
+        chunks, topics = await load_book_async(request.subject, request.book)
+        targets = plan_topics(topics, request.num_questions, request.topic, request.subtopic)
+    except GenerationRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def lines():
+        async for event in stream_for_targets_async(request.subject, request.book, chunks, targets, request.type):
+            yield _ndjson_line(event)
+
+    return StreamingResponse(lines(), media_type=NDJSON)
+
+# Background jobs: submit, then poll /jobs/{id} or stream /jobs/{id}/events until the job finishes
+JOB_EVENTS_POLL_INTERVAL = 0.5
+
+@app.post("/jobs/generate/questions", response_model=JobResponse, status_code=202)
+async def submit_generation_job(request: GenerationRequest):
+    return await asyncio.to_thread(get_job_queue().submit, "generate_questions", request.model_dump())
+
+@app.post("/jobs/ingest", response_model=JobResponse, status_code=202)
+async def submit_ingest_job(file: UploadFile = File(...), subject: str = Form(...), build_topics: bool = Form(False)):
+    try:
+        path = await asyncio.to_thread(save_upload, file.file, file.filename)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await asyncio.to_thread(get_job_queue().submit, "ingest",
+                                   {"path": path, "subject": subject, "build_topics": build_topics})
+
+async def _get_job(job_id: str) -> dict:
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    return await _get_job(job_id)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: the job record every time its status or progress changes, ending when it finishes."""
+    job = await _get_job(job_id)
+
+    async def events():
+        nonlocal job
+        last = None
+        while True:
+            state = (job["status"], job["progress"])
+            if state != last:
+                yield f"data: {json.dumps(job)}\n\n"
+                last = state
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+            job = await asyncio.to_thread(get_job_queue().get, job_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type=metrics.CONTENT_TYPE)
 
 # Run the app (only for local testing, use Uvicorn to run in production)
 if __name__ == "__main__":
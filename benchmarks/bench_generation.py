@@ -0,0 +1,53 @@
+"""
+Compares question generation from one (topic, subtopic) pair with the fan-out over all topics.
+
+Both run `lib.question_pipeline` against stub backends whose completion latency grows with the
+number of questions written (`--token-latency` per completion token): `single` pins the request
+to one subtopic, as `/generate/questions` did before fan-out, while `fan-out` spreads it over the
+book's topics.
+
+Usage: python -m benchmarks.bench_generation [--questions 5 20 40] [--latency 0.2] [--token-latency 0.005]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-generation-"))
+# Repeated runs would otherwise be answered from the response cache
+os.environ.setdefault("LLM_CACHE", "off")
+
+from benchmarks.stubs import install_stub_backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--questions", type=int, nargs="+", default=[5, 20, 40])
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per stubbed LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds per generated token")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    sync_client, _, index = install_stub_backends(args.latency, token_latency=args.token_latency)
+    from lib.question_pipeline import generate_for_book
+
+    subject = "physics"
+    index.catalog(subject)
+    generate_for_book(subject, index.title, 1)  # Warm-up: topic extraction is stored in the topic index
+    print(f"{args.latency:.3f}s per call + {args.token_latency * 1000:.1f}ms per generated token")
+    for num_questions in args.questions:
+        for mode, subtopic in (("single", "Subtopic 0.0"), ("fan-out", None)):
+            elapsed, calls_before = 0.0, sync_client.calls
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                result = generate_for_book(subject, index.title, num_questions, topic="Topic 0" if subtopic else None,
+                                           subtopic=subtopic)
+                elapsed += time.perf_counter() - start
+            calls = (sync_client.calls - calls_before) / args.runs
+            print(f"questions={num_questions:<3} {mode:<8} {elapsed / args.runs:6.2f}s  "
+                  f"topics={len(result['topics']):<2} returned={len(result['questions']):<3} calls={calls:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Shows how the upstream governor (lib/governor.py) handles a load spike and an outage.
+
+A simulated upstream serves at most `--capacity` calls at a time and answers 429 to the rest,
+like a rate-limited API. `spike` sends `--requests` calls at once; `outage` sends them while
+the upstream answers every call with 503. Each scenario runs once with plain calls and once
+through a fresh governor, and reports successes, client-visible errors, calls that reached the
+upstream, and latency.
+
+Usage: python -m benchmarks.bench_governor [--scenarios spike outage] [--requests 500] [--capacity 20] [--latency 0.1]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from lib.governor import Governor
+
+
+class UpstreamHTTPError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class SimulatedUpstream:
+    def __init__(self, capacity: int, latency: float, down: bool = False):
+        self.capacity, self.latency, self.down = capacity, latency, down
+        self.in_flight = 0
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.down:
+            await asyncio.sleep(self.latency)
+            raise UpstreamHTTPError(503)
+        if self.in_flight >= self.capacity:
+            raise UpstreamHTTPError(429)
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return "ok"
+
+
+async def run(upstream: SimulatedUpstream, requests: int, governor: Governor = None) -> dict:
+    latencies, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            await (governor.call_async(upstream) if governor else upstream())
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return {"elapsed": time.perf_counter() - start, "ok": len(latencies), "errors": errors,
+            "upstream_calls": upstream.calls, "latencies": sorted(latencies)}
+
+
+def report(scenario: str, mode: str, result: dict):
+    latencies = result["latencies"]
+    p50 = f"{statistics.median(latencies):6.2f}s" if latencies else "     -"
+    p99 = f"{latencies[int(0.99 * (len(latencies) - 1))]:6.2f}s" if latencies else "     -"
+    print(f"{scenario:<7} {mode:<9} ok={result['ok']:<5} errors={result['errors']:<5} "
+          f"upstream calls={result['upstream_calls']:<5} p50={p50} p99={p99} total={result['elapsed']:6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=["spike", "outage"], choices=["spike", "outage"])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--capacity", type=int, default=20, help="Concurrent calls the upstream accepts")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds per upstream call")
+    parser.add_argument("--max-concurrency", type=int, default=100, help="Governor's initial concurrency limit")
+    parser.add_argument("--max-wait", type=float, default=30, help="Governor's UPSTREAM_MAX_WAIT")
+    args = parser.parse_args()
+
+    for scenario in args.scenarios:
+        for mode in ("direct", "governed"):
+            upstream = SimulatedUpstream(args.capacity, args.latency, down=scenario == "outage")
+            governor = Governor(mode, args.max_concurrency, max_wait=args.max_wait) if mode == "governed" else None
+            report(scenario, mode, asyncio.run(run(upstream, args.requests, governor)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Compares serial, concurrent and batched grammar_check against a stubbed OpenAI client.
+
+Usage: python -m benchmarks.bench_grammar [--latency 0.2] [--workers 1 4 8 16] [--modes sentence batch]
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+# Every run checks the same text; cached responses or triage skipping known-clean sentences would hide
+# the request pattern being measured
+os.environ.setdefault("LLM_CACHE", "off")
+os.environ.setdefault("GRAMMAR_TRIAGE", "off")
+
+from benchmarks.stubs import StubOpenAI
+from lib.grammar_check import grammar_check, split_english
+
+
+def load_essay(filepath: str = "test/test-passages.json") -> str:
+    with open(filepath, "r", encoding="utf-8") as file:
+        return " ".join(json.load(file).values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per stubbed LLM call")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--modes", nargs="+", default=["sentence", "batch"], choices=["sentence", "batch"])
+    args = parser.parse_args()
+
+    essay = load_essay()
+    num_sentences = len(split_english(essay))
+    print(f"{num_sentences} sentences, {args.latency:.3f}s simulated latency per call")
+
+    baseline = None
+    for mode in args.modes:
+        for workers in args.workers:
+            stub = StubOpenAI(latency=args.latency)
+            start = time.perf_counter()
+            results = grammar_check(essay, max_workers=workers, openai_client=stub, mode=mode)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            assert [r.sentence for r in results] == split_english(essay), "results out of order"
+            print(f"mode={mode:<8} workers={workers:<3} {elapsed:7.3f}s  calls={stub.calls:<4} "
+                  f"speedup={baseline / elapsed:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
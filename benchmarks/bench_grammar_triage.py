@@ -0,0 +1,76 @@
+"""
+Measures how each grammar triage level trades missed errors for fewer model calls.
+
+The passages in test/test-passages.json are checked twice per level, with a fresh clean-sentence
+store: the first pass shows the rule-based savings, the second adds the sentences the store
+learnt during the first. The stubbed model reports an error exactly for the sentences labelled
+in benchmarks/grammar_labels.json, so recall is the share of labelled errors that triage
+still sent to the model.
+
+Usage: python -m benchmarks.bench_grammar_triage [--latency 0.2] [--levels off conservative balanced aggressive]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("LLM_CACHE", "off")
+# The stub stands in for the large model, whose verdicts are the ones the clean-sentence store keeps
+os.environ.setdefault("LLM_ROUTING", "off")
+
+from benchmarks.stubs import StubOpenAI
+from lib.grammar_check import grammar_check, split_english
+from lib.grammar_triage import CleanSentenceStore, set_clean_store
+from models.schema_models import GrammarModel, GrammarBatchModel
+
+LABELS_PATH = os.path.join(os.path.dirname(__file__), "grammar_labels.json")
+LEVELS = ["off", "conservative", "balanced", "aggressive"]
+
+
+def labelled_stub(errors: set, latency: float) -> StubOpenAI:
+    """Stub answering like a perfect checker: an error for every labelled sentence, none otherwise."""
+    def check(sentence):
+        found = ["labelled error"] if sentence in errors else []
+        return GrammarModel(sentence=sentence, corrected_sentence=sentence, errors=found)
+
+    stub = StubOpenAI(latency=latency)
+    stub.builders[GrammarModel] = lambda messages: check(messages[-1]["content"])
+    stub.builders[GrammarBatchModel] = lambda messages: GrammarBatchModel(
+        results=[check(s) for s in json.loads(messages[-1]["content"])])
+    return stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per stubbed LLM call")
+    parser.add_argument("--levels", nargs="+", default=LEVELS, choices=LEVELS)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with open("test/test-passages.json", "r", encoding="utf-8") as file:
+        passages = list(json.load(file).values())
+    with open(LABELS_PATH, "r", encoding="utf-8") as file:
+        errors = set(json.load(file)["errors"])
+    sentences = sum(len(split_english(passage)) for passage in passages)
+    print(f"{len(passages)} passages, {sentences} sentences, {len(errors)} with errors, "
+          f"{args.latency:.3f}s simulated latency per call")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for level in args.levels:
+            set_clean_store(CleanSentenceStore(os.path.join(tmp, f"{level}.sqlite3")))
+            for run in ("first", "repeat"):
+                stub = labelled_stub(errors, args.latency)
+                start = time.perf_counter()
+                found = {result.sentence for passage in passages
+                         for result in grammar_check(passage, max_workers=args.workers, openai_client=stub,
+                                                     mode="sentence", triage=level)
+                         if result.errors}
+                elapsed = time.perf_counter() - start
+                print(f"triage={level:<13} {run:<7} {elapsed:6.2f}s  model calls={stub.calls:<3} "
+                      f"({stub.calls / sentences:4.0%} of sentences)  recall={len(found & errors) / len(errors):4.0%}")
+
+
+if __name__ == "__main__":
+    main()
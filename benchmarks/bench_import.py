@@ -0,0 +1,75 @@
+"""
+Measures cold-start import time of the web apps with `python -X importtime`.
+
+Each module is imported in a fresh interpreter several times and the fastest run is
+reported, together with the slowest imports it pulls in. The run fails if an app takes
+longer than the budget, makes a client at import time, or imports a dependency that
+should only load on first use.
+
+Usage: python -m benchmarks.bench_import [--modules app flask_app] [--budget 1.0] [--runs 5]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Only needed once a request or ingestion actually runs
+DEFERRED_MODULES = ("openai", "pinecone", "langchain_text_splitters", "langdetect", "fitz", "numpy")
+
+CHECK = """
+import sys, {module}
+import config.openai, config.pinecone
+loaded = [name for name in {deferred!r} if name in sys.modules]
+clients = [name for name in ("_client", "_async_client") if getattr(config.openai, name) is not None]
+clients += ["_idx"] if config.pinecone._idx is not None else []
+print("LOADED", ",".join(loaded))
+print("CLIENTS", ",".join(clients))
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module: str) -> dict:
+    """Imports `module` in a fresh interpreter; returns its cumulative import time and what it loaded."""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", CHECK.format(module=module, deferred=DEFERRED_MODULES)],
+                             capture_output=True, text=True, env=env, check=True)
+    imports = [(match.group(4), int(match.group(2)) / 1e6, len(match.group(3)))
+               for match in map(IMPORTTIME_LINE.match, process.stderr.splitlines()) if match]
+    total = next(seconds for name, seconds, depth in imports if name == module and depth == 1)
+    output = dict(line.split(" ", 1) if " " in line else (line, "") for line in process.stdout.splitlines())
+    return {
+        "seconds": total,
+        # Direct dependencies of the module, slowest first
+        "slowest": sorted(((name, seconds) for name, seconds, depth in imports if depth == 3),
+                          key=lambda item: -item[1])[:5],
+        "loaded": [name for name in output.get("LOADED", "").split(",") if name],
+        "clients": [name for name in output.get("CLIENTS", "").split(",") if name],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=["app", "flask_app"], help="Modules to import")
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum import time in seconds")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module; the fastest counts")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        result = min((measure(module) for _ in range(args.runs)), key=lambda r: r["seconds"])
+        ok = result["seconds"] <= args.budget and not result["loaded"] and not result["clients"]
+        failed |= not ok
+        print(f"{module:<10} {result['seconds']:.3f}s (budget {args.budget:.3f}s) {'ok' if ok else 'FAIL'}")
+        for name, seconds in result["slowest"]:
+            print(f"    {name:<40} {seconds:.3f}s")
+        if result["loaded"]:
+            print(f"    imported eagerly: {', '.join(result['loaded'])}")
+        if result["clients"]:
+            print(f"    clients created at import: {', '.join(result['clients'])}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures streaming PDF ingestion throughput and peak memory on synthetic PDFs.
+
+Usage: python -m benchmarks.bench_ingest [--pages 100 1000] [--latency 0.05]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+import fitz
+
+from benchmarks.stubs import StubOpenAI, DiscardingIndex
+from document_processing.pipeline import ingest_pdf
+
+PAGE_TEXT = (
+    "Newton's first law states that an object remains at rest or in uniform motion "
+    "unless acted upon by a net external force. "
+) * 20
+
+
+def make_pdf(path: str, pages: int):
+    with fitz.open() as doc:
+        for page_num in range(pages):
+            page = doc.new_page()
+            page.insert_textbox(page.rect + (36, 36, -36, -36), f"Page {page_num + 1}. {PAGE_TEXT}", fontsize=9)
+        doc.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per stubbed embeddings/upsert call")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            path = os.path.join(tmp, f"book_{pages}.pdf")
+            make_pdf(path, pages)
+            client, index = StubOpenAI(latency=args.latency), DiscardingIndex(latency=args.latency)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            stats = ingest_pdf(path, client, index, namespace="bench", metadata={"title": f"bench_{pages}"},
+                               progress=None, manifest_path=os.path.join(tmp, "manifest.sqlite3"))
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(f"pages={pages:<5} chunks={stats['chunks']:<5} {elapsed:7.2f}s  "
+                  f"{pages / elapsed:7.1f} pages/s  {stats['vectors'] / elapsed:7.1f} vectors/s  "
+                  f"embed calls={client.calls:<4} peak traced memory={peak / 2 ** 20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
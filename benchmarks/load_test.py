@@ -0,0 +1,113 @@
+"""
+Compares throughput of the async FastAPI endpoints with equivalent sync (threadpool) handlers.
+
+Both apps run in-process against stub OpenAI/Pinecone backends with simulated latency.
+
+Usage: python -m benchmarks.load_test [--latency 0.2] [--concurrency 200] [--requests 400] [--endpoints grammar answer generate]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="load-test-"))
+# All requests of a run are identical; caching, coalescing and grammar triage would collapse them into one
+os.environ.setdefault("LLM_CACHE", "off")
+os.environ.setdefault("GRAMMAR_TRIAGE", "off")
+
+import httpx
+from fastapi import FastAPI
+
+from benchmarks.stubs import install_stub_backends
+
+PAYLOADS = {
+    "grammar": ("/grammar/check", {"text": "The war began in the summer of 1914 after the assassination in Sarajevo. "
+                                           "Many countries were drawn into the conflict through their alliances. "
+                                           "The fighting on the western front soon turned into trench warfare. "
+                                           "Millions of soldiers died before the armistice was signed in 1918. "
+                                           "The peace treaty was finally signed at Versailles in the following year."}),
+    "answer": ("/answer/analyze", {"question": "What is Newton's first law?",
+                                   "user_answer": "An object keeps moving unless a force acts on it.",
+                                   "subject": "physics"}),
+    "generate": ("/generate/questions", {"book": "Stub Book", "subject": "physics", "num_questions": 5}),
+}
+
+
+def build_sync_app(sync_client) -> FastAPI:
+    """The endpoints as plain `def` handlers, i.e. how app.py served them before going async."""
+    from lib.grammar_check import grammar_check
+    from lib.check_answer import validate_answer
+    from lib.question_pipeline import generate_for_book
+    from app import GrammarCheckRequest, AnswerValidationRequest, GenerationRequest
+
+    sync_app = FastAPI()
+
+    @sync_app.post("/grammar/check")
+    def check_grammar(request: GrammarCheckRequest):
+        return {"results": [r.model_dump() for r in grammar_check(request.text)]}
+
+    @sync_app.post("/answer/analyze")
+    def analyze_answer(request: AnswerValidationRequest):
+        return validate_answer(request.question, request.user_answer, request.subject, sync_client)
+
+    @sync_app.post("/generate/questions")
+    def generate_questions_api(request: GenerationRequest):
+        return generate_for_book(request.subject, request.book, request.num_questions, request.type,
+                                 request.topic, request.subtopic, client=sync_client)
+
+    return sync_app
+
+
+async def run_load(app, path: str, payload: dict, concurrency: int, total: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as http:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await http.post(path, json=payload)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per stubbed OpenAI call")
+    parser.add_argument("--concurrency", type=int, default=200, help="Requests in flight at once")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per endpoint and mode")
+    parser.add_argument("--endpoints", nargs="+", default=list(PAYLOADS), choices=list(PAYLOADS))
+    args = parser.parse_args()
+
+    sync_client, _, index = install_stub_backends(args.latency)
+    index.catalog(PAYLOADS["generate"][1]["subject"])
+    from app import app as async_app
+    sync_app = build_sync_app(sync_client)
+
+    print(f"{args.requests} requests per run, {args.concurrency} concurrent, {args.latency:.3f}s per LLM call")
+    for endpoint in args.endpoints:
+        path, payload = PAYLOADS[endpoint]
+        for mode, app in (("sync", sync_app), ("async", async_app)):
+            result = asyncio.run(run_load(app, path, payload, args.concurrency, args.requests))
+            print(f"{endpoint:<9} {mode:<6} {result['rps']:8.1f} req/s  p50={result['p50']:.3f}s  "
+                  f"p99={result['p99']:.3f}s  errors={result['errors']}")
+
+
+if __name__ == "__main__":
+    main()
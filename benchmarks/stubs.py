@@ -0,0 +1,296 @@
+"""
+Stand-ins for the OpenAI client and vector index used by the benchmarks; no network access or API key needed.
+
+Outputs are derived from the inputs only, so every run sees the same responses. Each stub
+sleeps `latency` seconds per call and fails a seeded, reproducible share (`error_rate`) of calls.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+from lib.tokens import estimate_tokens
+from models.schema_models import (GrammarModel, GrammarBatchModel, AnswerValidation, Subtopic,
+                                  TopicExtractionResponse, Question, QuestionGenerationResponse)
+
+
+def _grammar_response(messages):
+    sentence = messages[-1]["content"]
+    return GrammarModel(sentence=sentence, corrected_sentence=sentence, errors=[])
+
+
+def _grammar_batch_response(messages):
+    sentences = json.loads(messages[-1]["content"])
+    return GrammarBatchModel(results=[
+        GrammarModel(sentence=s, corrected_sentence=s, errors=[]) for s in sentences
+    ])
+
+
+def _answer_response(messages):
+    return AnswerValidation(is_correct=True, score=0.9, incorrect_facts=[])
+
+
+def _topics_response(messages):
+    return TopicExtractionResponse(main_topics=[
+        Subtopic(topic=f"Topic {i}", subtopics=[f"Subtopic {i}.{j}" for j in range(3)]) for i in range(4)
+    ])
+
+
+def _questions_response(messages):
+    prompt = messages[-1]["content"]
+    count = int(prompt.split("Generate ", 1)[1].split(" ", 1)[0])
+    subtopic = prompt.split("Subtopic: ", 1)[1].split("\n", 1)[0].strip()
+    # Distinct per subtopic, so the generation pipeline's deduplication keeps them
+    tag = zlib.crc32(subtopic.encode("utf-8"))
+    return QuestionGenerationResponse(questions=[
+        Question(type="text_based", question=f"Question q{i}_{tag} about {subtopic}?", answer=f"Answer {i}")
+        for i in range(count)
+    ])
+
+
+RESPONSE_BUILDERS = {
+    GrammarModel: _grammar_response,
+    GrammarBatchModel: _grammar_batch_response,
+    AnswerValidation: _answer_response,
+    TopicExtractionResponse: _topics_response,
+    QuestionGenerationResponse: _questions_response,
+}
+
+
+class StubAPIError(RuntimeError):
+    """Raised by a stub for an injected failure."""
+
+
+class _FailureInjector:
+    def __init__(self, error_rate: float, seed: int):
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def maybe_fail(self, what: str):
+        if not self.error_rate:
+            return
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+            self.errors += fail
+        if fail:
+            raise StubAPIError(f"Injected {what} failure")
+
+
+def stub_embedding(text: str, dimension: int = 1536) -> list:
+    """Deterministic pseudo-embedding derived from the text's hash."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(seed[i % len(seed)] - 128) / 128.0 for i in range(dimension)]
+
+
+def _completion(owner, messages, response_format):
+    parsed = owner.builders[response_format](messages)
+    message = SimpleNamespace(parsed=parsed, refusal=None)
+    usage = SimpleNamespace(prompt_tokens=sum(estimate_tokens(m["content"]) for m in messages),
+                            completion_tokens=estimate_tokens(parsed.model_dump_json()))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def _embedding_response(owner, input):
+    texts = [input] if isinstance(input, str) else input
+    data = [SimpleNamespace(index=i, embedding=stub_embedding(text, owner.dimension)) for i, text in enumerate(texts)]
+    return SimpleNamespace(data=data, usage=SimpleNamespace(total_tokens=sum(estimate_tokens(t) for t in texts)))
+
+
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def parse(self, model, messages, response_format, **kwargs):
+        self._owner._record()
+        completion = _completion(self._owner, messages, response_format)
+        time.sleep(self._owner.completion_latency(completion))
+        return completion
+
+
+class _Embeddings:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, input, **kwargs):
+        self._owner._record()
+        time.sleep(self._owner.latency)
+        return _embedding_response(self._owner, input)
+
+
+class _AsyncStream:
+    """Mimics the structured-output stream helper: the response JSON arrives in `STREAM_CHUNKS` pieces."""
+
+    STREAM_CHUNKS = 20
+
+    def __init__(self, owner, messages, response_format):
+        self._owner = owner
+        self._completion = _completion(owner, messages, response_format)
+        self._text = self._completion.choices[0].message.parsed.model_dump_json()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def _events(self):
+        import jiter
+        step = max(1, -(-len(self._text) // self.STREAM_CHUNKS))
+        for end in range(step, len(self._text) + step, step):
+            await asyncio.sleep(self._owner.completion_latency(self._completion) / self.STREAM_CHUNKS)
+            snapshot = self._text[:end]
+            yield SimpleNamespace(type="content.delta", delta=snapshot[end - step:], snapshot=snapshot,
+                                  parsed=jiter.from_json(snapshot.encode(), partial_mode="trailing-strings"))
+
+    def __aiter__(self):
+        return self._events()
+
+    async def get_final_completion(self):
+        return self._completion
+
+
+class _AsyncCompletions(_Completions):
+    async def parse(self, model, messages, response_format, **kwargs):
+        self._owner._record()
+        completion = _completion(self._owner, messages, response_format)
+        await asyncio.sleep(self._owner.completion_latency(completion))
+        return completion
+
+    def stream(self, model, messages, response_format, **kwargs):
+        self._owner._record()
+        return _AsyncStream(self._owner, messages, response_format)
+
+
+class _AsyncEmbeddings(_Embeddings):
+    async def create(self, model, input, **kwargs):
+        self._owner._record()
+        await asyncio.sleep(self._owner.latency)
+        return _embedding_response(self._owner, input)
+
+
+class StubOpenAI:
+    """
+    Mimics `client.beta.chat.completions.parse` and `client.embeddings.create`, sleeping `latency`
+    seconds per call, plus `token_latency` seconds per completion token for chat completions.
+    """
+
+    completions_class, embeddings_class = _Completions, _Embeddings
+
+    def __init__(self, latency: float = 0.2, dimension: int = 1536, error_rate: float = 0.0, seed: int = 0,
+                 token_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.dimension = dimension
+        self.calls = 0
+        self.failures = _FailureInjector(error_rate, seed)
+        self.builders = dict(RESPONSE_BUILDERS)
+        self._lock = threading.Lock()
+        completions = self.completions_class(self)
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        self.chat = SimpleNamespace(completions=completions)
+        self.embeddings = self.embeddings_class(self)
+
+    def completion_latency(self, completion) -> float:
+        return self.latency + self.token_latency * completion.usage.completion_tokens
+
+    def _record(self):
+        with self._lock:
+            self.calls += 1
+        self.failures.maybe_fail("OpenAI")
+
+
+class StubAsyncOpenAI(StubOpenAI):
+    """AsyncOpenAI counterpart of StubOpenAI; latency is simulated with `asyncio.sleep`."""
+
+    completions_class, embeddings_class = _AsyncCompletions, _AsyncEmbeddings
+
+
+class DiscardingIndex:
+    """Vector index stand-in that counts writes and throws the vectors away."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failures = _FailureInjector(error_rate, seed)
+        self.upserts = 0
+        self.vectors = 0
+        self.updates = 0
+        self.deletes = 0
+
+    def upsert(self, vectors, namespace=""):
+        time.sleep(self.latency)
+        self.failures.maybe_fail("upsert")
+        self.upserts += 1
+        self.vectors += len(vectors)
+
+    def update(self, id, set_metadata=None, namespace=""):
+        self.updates += 1
+
+    def delete(self, ids, namespace=""):
+        self.deletes += len(ids)
+
+    def list(self, namespace="", prefix=None):
+        return iter([])
+
+
+class StubIndex(DiscardingIndex):
+    """Read-side index stand-in holding the chunks of one book; every query returns the first `top_k`."""
+
+    def __init__(self, latency: float = 0.0, title: str = "Stub Book", chunks: int = 20, error_rate: float = 0.0,
+                 seed: int = 0):
+        super().__init__(latency, error_rate, seed)
+        self.title = title
+        self.chunks = [f"Chunk {i} of {title}. " + "Newton's laws describe motion. " * 40 for i in range(chunks)]
+        self.ids = [f"{title}_{i}" for i in range(chunks)]
+
+    def catalog(self, subject: str, path: str = None):
+        """Records the stub book in the document catalog so it can be read back by ID."""
+        from document_processing import manifest
+        manifest.save_document(subject, self.title, [
+            {"vector_id": vector_id, "chunk_hash": manifest.chunk_hash(text), "chunk_index": i,
+             "page": 1, "char_start": 0, "char_end": len(text)}
+            for i, (vector_id, text) in enumerate(zip(self.ids, self.chunks))
+        ], path)
+
+    def fetch(self, ids, namespace="", **kwargs):
+        time.sleep(self.latency)
+        self.failures.maybe_fail("fetch")
+        chunks = dict(zip(self.ids, enumerate(self.chunks)))
+        return SimpleNamespace(vectors={
+            vector_id: SimpleNamespace(id=vector_id, values=[], metadata={
+                "title": self.title, "text": chunks[vector_id][1], "chunk_index": chunks[vector_id][0]})
+            for vector_id in ids if vector_id in chunks
+        })
+
+    def query(self, vector=None, namespace="", top_k=10, include_metadata=False, include_values=False,
+              filter=None, **kwargs):
+        time.sleep(self.latency)
+        self.failures.maybe_fail("query")
+        return {"matches": [
+            {"id": self.ids[i], "score": 0.9 - i * 0.01,
+             "metadata": {"title": self.title, "text": text, "chunk_index": i}}
+            for i, text in enumerate(self.chunks[:top_k])
+        ]}
+
+    def describe_index_stats(self):
+        return {"namespaces": {"stub": {"vector_count": len(self.chunks)}}}
+
+
+def install_stub_backends(latency: float, index_latency: float = 0.01, error_rate: float = 0.0, seed: int = 0,
+                          token_latency: float = 0.0):
+    """Points the shared OpenAI clients and vector index at stubs. Returns (sync client, async client, index)."""
+    sync_client = StubOpenAI(latency, error_rate=error_rate, seed=seed, token_latency=token_latency)
+    async_client = StubAsyncOpenAI(latency, error_rate=error_rate, seed=seed, token_latency=token_latency)
+    index = StubIndex(index_latency, error_rate=error_rate, seed=seed)
+
+    from config.openai import set_client, set_async_client
+    from config.pinecone import set_index
+    set_client(sync_client)
+    set_async_client(async_client)
+    set_index(index)
+    return sync_client, async_client, index
@@ -0,0 +1,214 @@
+"""
+Runs the core code paths against stub backends and reports throughput, p50/p99 latency and peak memory.
+
+Results can be saved as JSON and compared with a saved baseline, e.g. one from the previous
+commit, to catch regressions:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --compare baseline.json
+
+Usage: python -m benchmarks.suite [--scenarios grammar_check ...] [--iterations 20] [--latency 0.05]
+       [--error-rate 0.0] [--seed 0] [--output results.json] [--compare baseline.json] [--tolerance 0.25]
+       [--min-delta 0.01]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-suite-"))
+# Every iteration repeats the same work; cached responses and embeddings, or sentences triage already
+# knows to be clean, would hide the calls being measured
+os.environ.setdefault("LLM_CACHE", "off")
+os.environ.setdefault("GRAMMAR_TRIAGE", "off")
+os.environ.setdefault("EMBEDDING_CACHE", "off")
+
+from benchmarks.bench_grammar import load_essay
+from benchmarks.stubs import DiscardingIndex, StubOpenAI, install_stub_backends
+
+SUBJECT = "physics"
+QUESTION = "What is Newton's first law?"
+ANSWER = "An object keeps moving unless a force acts on it."
+SCENARIOS = ["grammar_check", "validate_answer", "generate", "extract_all_topics", "generate_questions", "ingest"]
+
+# Relative change beyond --tolerance that counts as a regression, per metric: +1 if higher is worse
+COMPARED_METRICS = {"p50": 1, "p99": 1, "throughput": -1, "peak_memory_mib": 1}
+LATENCY_METRICS = ("p50", "p99")
+
+
+def build_scenarios(args, sync_client, index, tmp: str) -> dict:
+    """Zero-argument callables, one per scenario, all running the real library code."""
+    from lib.check_answer import validate_answer
+    from lib.generate_questions import extract_all_topics, generate, generate_questions
+    from lib.grammar_check import grammar_check
+
+    essay = load_essay()
+    # Fixed inputs for the steps that normally consume an earlier step's output
+    results = [{"title": index.title, "text": text} for text in index.chunks]
+    context = "\n\n".join(index.chunks[:5])
+    ingest_client = StubOpenAI(args.latency, error_rate=args.error_rate, seed=args.seed)
+    ingest_index = DiscardingIndex(args.index_latency, error_rate=args.error_rate, seed=args.seed)
+    pdf_path = os.path.join(tmp, "book.pdf")
+    runs = iter(range(sys.maxsize))
+
+    def ingest():
+        from document_processing.pipeline import ingest_pdf
+        # A fresh manifest each run, otherwise unchanged chunks would be skipped
+        return ingest_pdf(pdf_path, ingest_client, ingest_index, namespace="bench", metadata={"title": "bench"},
+                          progress=None, manifest_path=os.path.join(tmp, f"manifest_{next(runs)}.sqlite3"))
+
+    scenarios = {
+        "grammar_check": lambda: grammar_check(essay, openai_client=sync_client),
+        "validate_answer": lambda: validate_answer(QUESTION, ANSWER, SUBJECT, sync_client),
+        "generate": lambda: generate(SUBJECT, index.title),
+        "extract_all_topics": lambda: extract_all_topics(results),
+        "generate_questions": lambda: generate_questions("Topic 0", "Subtopic 0.0", context, "text_based", 5),
+        "ingest": ingest,
+    }
+    if "ingest" in args.scenarios:
+        from benchmarks.bench_ingest import make_pdf
+        make_pdf(pdf_path, args.pages)
+    return {name: (scenarios[name], ingest_client if name == "ingest" else sync_client) for name in args.scenarios}
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of `values` (q in 0..100)."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def run_scenario(op, client, iterations: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+
+    def timed_op(_):
+        start = time.perf_counter()
+        try:
+            op()
+            return time.perf_counter() - start, False
+        except Exception:
+            return time.perf_counter() - start, True
+
+    timed_op(None)  # Warm-up: lazy imports and first-use setup are not part of the measurement
+    calls_before = client.calls
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, failed in executor.map(timed_op, range(iterations)):
+            latencies.append(latency)
+            errors += failed
+    elapsed = time.perf_counter() - start
+    calls = client.calls - calls_before
+
+    # Peak memory is measured on a separate run; tracing would slow down the timed ones
+    tracemalloc.start()
+    try:
+        timed_op(None)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops": iterations,
+        "errors": errors,
+        "throughput": iterations / elapsed,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies),
+        "peak_memory_mib": peak / 2 ** 20,
+        "calls_per_op": calls / iterations,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    """
+    Prints each metric's change against `baseline` and returns the regressions found.
+
+    Latency changes smaller than `min_delta` seconds are scheduling noise and never count.
+    """
+    if baseline.get("config") != results["config"]:
+        print(f"warning: baseline config {baseline.get('config')} differs from {results['config']}")
+    regressions = []
+    print(f"\ncompared with {baseline.get('commit', '?')} (tolerance {tolerance:.0%})")
+    for name, current in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            print(f"{name:<20} no baseline")
+            continue
+        changes = []
+        for metric, direction in COMPARED_METRICS.items():
+            if not previous[metric]:
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            regressed = change * direction > tolerance and (
+                metric not in LATENCY_METRICS or current[metric] - previous[metric] > min_delta)
+            changes.append(f"{metric} {change:+.0%}{' REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{name} {metric}")
+        # Call counts are deterministic without injected errors, so any increase is a regression
+        if current["calls_per_op"] > previous["calls_per_op"] and not results["config"]["error_rate"]:
+            changes.append(f"calls/op {previous['calls_per_op']:g} -> {current['calls_per_op']:g} REGRESSION")
+            regressions.append(f"{name} calls_per_op")
+        print(f"{name:<20} " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1, help="Operations run at the same time")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per stubbed OpenAI call")
+    parser.add_argument("--index-latency", type=float, default=0.01, help="Seconds per stubbed index call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stubbed calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the injected failures")
+    parser.add_argument("--pages", type=int, default=20, help="Pages of the synthetic PDF for the ingest scenario")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative change that counts as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.01,
+                        help="Smallest latency increase in seconds that counts as a regression")
+    args = parser.parse_args()
+
+    sync_client, _, index = install_stub_backends(args.latency, args.index_latency, args.error_rate, args.seed)
+    index.catalog(SUBJECT)
+
+    config = {key: getattr(args, key) for key in
+              ("iterations", "concurrency", "latency", "index_latency", "error_rate", "seed", "pages")}
+    results = {"commit": git_commit(), "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+               "python": platform.python_version(), "config": config, "results": {}}
+
+    print(f"{'scenario':<20} {'ops/s':>8} {'p50':>9} {'p99':>9} {'peak MiB':>9} {'calls/op':>9} {'errors':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (op, client) in build_scenarios(args, sync_client, index, tmp).items():
+            result = results["results"][name] = run_scenario(op, client, args.iterations, args.concurrency)
+            print(f"{name:<20} {result['throughput']:8.2f} {result['p50'] * 1000:7.1f}ms {result['p99'] * 1000:7.1f}ms "
+                  f"{result['peak_memory_mib']:9.2f} {result['calls_per_op']:9.2f} {result['errors']:7}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
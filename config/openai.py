@@ -1,7 +1,64 @@
-# from question_gen import generate_embeddings
-from openai import OpenAI
+"""
+Shared OpenAI clients, created on first use.
+
+Importing this module is cheap and makes no network calls; the `openai` package itself
+is only imported when a client is first needed. `set_client`/`set_async_client` install
+a different client (e.g. a stub) for the whole process. The clients do not retry by
+themselves: calls are retried by `lib.governor`, which also paces them.
+"""
+import threading
 from dotenv import load_dotenv
+from constants import OPENAI_MAX_CONNECTIONS, OPENAI_TIMEOUT
 
 load_dotenv()
 
-client = OpenAI()
\ No newline at end of file
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def _limits():
+    import httpx
+    # Both clients keep a pool of up to OPENAI_MAX_CONNECTIONS connections alive between requests
+    return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from openai import OpenAI, DefaultHttpxClient
+                _client = OpenAI(http_client=DefaultHttpxClient(limits=_limits()), timeout=OPENAI_TIMEOUT,
+                                 max_retries=0)
+    return _client
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                _async_client = AsyncOpenAI(http_client=DefaultAsyncHttpxClient(limits=_limits()), timeout=OPENAI_TIMEOUT,
+                                            max_retries=0)
+    return _async_client
+
+
+def set_client(client):
+    global _client
+    _client = client
+
+
+def set_async_client(client):
+    global _async_client
+    _async_client = client
+
+
+def __getattr__(name):
+    # `from config.openai import client` still works, constructing the client at that point
+    if name == "client":
+        return get_client()
+    if name == "async_client":
+        return get_async_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,30 +1,112 @@
-from pinecone import (
-    Pinecone,
-    ServerlessSpec,
-    CloudProvider,
-    AwsRegion,
-    VectorType
-)
+"""
+Shared vector index, created on first use.
+
+Importing this module makes no network calls. The Pinecone client is built, and the
+index created if missing, the first time `get_index()` runs, so a worker still boots
+while Pinecone is briefly unreachable. `set_index` installs a different index
+(e.g. a stub) for the whole process.
+"""
+import asyncio
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
+from constants import PINECONE_MAX_CONCURRENCY, VECTOR_STORE, LOCAL_NAMESPACES
+from lib.governor import get_governor
+from lib.metrics import timed
 
 load_dotenv()
-# 1. Instantiate the Pinecone client
-pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
-
-# 2. Create an index (if not exists)
 index_name = "education-index"
 
-if index_name not in [idx["name"] for idx in pc.list_indexes()]:
-    index_config = pc.create_index(
-        name=index_name,
-        dimension=1536,  # Must match OpenAI embedding dimension
-        spec=ServerlessSpec(
-            cloud=CloudProvider.AWS,
-            region=AwsRegion.US_EAST_1
-        ),
-        vector_type=VectorType.DENSE
-    )
-
-# 3. Instantiate Index Client
-idx = pc.Index(index_name)  # ✅ Use index name directly, no need for `host`
+_pc = None
+_idx = None
+_lock = threading.RLock()
+
+
+def get_pinecone():
+    """The Pinecone client; None when VECTOR_STORE=local."""
+    global _pc
+    if _pc is None and VECTOR_STORE != "local":
+        with _lock:
+            if _pc is None:
+                from pinecone import (
+                    Pinecone,
+                    ServerlessSpec,
+                    CloudProvider,
+                    AwsRegion,
+                    VectorType
+                )
+
+                # 1. Instantiate the Pinecone client
+                pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
+
+                # 2. Create an index (if not exists)
+                if index_name not in [index["name"] for index in get_governor("pinecone").call(pc.list_indexes)]:
+                    pc.create_index(
+                        name=index_name,
+                        dimension=1536,  # Must match OpenAI embedding dimension
+                        spec=ServerlessSpec(
+                            cloud=CloudProvider.AWS,
+                            region=AwsRegion.US_EAST_1
+                        ),
+                        vector_type=VectorType.DENSE
+                    )
+                _pc = pc
+    return _pc
+
+
+def get_index():
+    global _idx
+    if _idx is None:
+        with _lock:
+            if _idx is None:
+                from db_queries.vector_store import GovernedIndex, LocalIndex, RoutedIndex
+
+                if VECTOR_STORE == "local":
+                    # Everything is served from the on-disk index: no Pinecone client, no credentials
+                    _idx = LocalIndex()
+                else:
+                    # 3. Instantiate Index Client
+                    index = GovernedIndex(get_pinecone().Index(index_name, pool_threads=PINECONE_MAX_CONCURRENCY),
+                                          get_governor("pinecone"))
+                    if LOCAL_NAMESPACES:
+                        # Hot subjects are answered from the local copy (see `python -m db_queries.vector_store --pull`)
+                        index = RoutedIndex(index, LocalIndex(), LOCAL_NAMESPACES)
+                    _idx = index
+    return _idx
+
+
+def set_index(index):
+    global _idx
+    _idx = index
+
+
+def __getattr__(name):
+    # `from config.pinecone import idx` still works, connecting at that point
+    if name == "idx":
+        return get_index()
+    if name == "pc":
+        return get_pinecone()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# 4. Async access: index calls run on a dedicated, bounded thread pool so they
+# never compete with the web server's own worker threads
+_executor = ThreadPoolExecutor(max_workers=PINECONE_MAX_CONCURRENCY, thread_name_prefix="pinecone")
+
+
+def _call(method: str, kwargs: dict):
+    index = get_index()
+    with timed(f"vector_{method}"):
+        return getattr(index, method)(**kwargs)
+
+
+async def index_call(method: str, **kwargs):
+    """
+    Awaits the index method named `method` (e.g. "query") without blocking the event loop.
+
+    The index itself is also looked up on the executor, so the first call's connection
+    setup does not stall the loop either.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_executor, partial(_call, method, kwargs))
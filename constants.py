@@ -1,5 +1,121 @@
+import os
 from typing import Literal
 
 EMBEDDINGS_MODEL = 'text-embedding-3-small'
 
 QuestionType = Literal["mcq", "true_false", "text_based", "fill_in_the_blank"]
+
+# Maximum number of sentences checked in parallel by grammar_check
+GRAMMAR_MAX_WORKERS = int(os.environ.get("GRAMMAR_MAX_WORKERS", 8))
+
+GrammarMode = Literal["sentence", "batch"]
+
+# "sentence" sends one request per sentence; "batch" packs sentences into fewer requests
+GRAMMAR_MODE = os.environ.get("GRAMMAR_MODE", "sentence")
+# Approximate input-token budget for the sentences packed into one batched request
+GRAMMAR_BATCH_TOKENS = int(os.environ.get("GRAMMAR_BATCH_TOKENS", 600))
+
+GrammarTriage = Literal["off", "conservative", "balanced", "aggressive"]
+
+# Local pre-pass deciding which sentences are sent to the model:
+# "off" sends all of them; "conservative" skips sentences the model already found clean;
+# "balanced" also skips short sentences that no local rule flags; "aggressive" skips
+# every sentence that no local rule flags (fastest, misses the most errors)
+GRAMMAR_TRIAGE = os.environ.get("GRAMMAR_TRIAGE", "conservative")
+# "balanced" skips unflagged sentences of at most this many words
+GRAMMAR_TRIAGE_SHORT_WORDS = int(os.environ.get("GRAMMAR_TRIAGE_SHORT_WORDS", 6))
+# Sentences remembered as clean are checked by the model again after this many seconds;
+# past the entry cap the least recently matched ones are forgotten first
+GRAMMAR_TRIAGE_TTL = float(os.environ.get("GRAMMAR_TRIAGE_TTL", 30 * 24 * 3600))
+GRAMMAR_TRIAGE_MAX_ENTRIES = int(os.environ.get("GRAMMAR_TRIAGE_MAX_ENTRIES", 1_000_000))
+
+# Embedding requests are split so that no request exceeds either limit
+EMBEDDINGS_BATCH_SIZE = int(os.environ.get("EMBEDDINGS_BATCH_SIZE", 256))
+EMBEDDINGS_BATCH_TOKENS = int(os.environ.get("EMBEDDINGS_BATCH_TOKENS", 200_000))
+EMBEDDINGS_MAX_RETRIES = int(os.environ.get("EMBEDDINGS_MAX_RETRIES", 3))
+
+# Local state (checkpoints, manifests, caches) is kept under this directory
+DATA_DIR = os.environ.get("DATA_DIR", ".data")
+
+# Embedding cache: set EMBEDDING_CACHE=off to always call the API
+EMBEDDING_CACHE = os.environ.get("EMBEDDING_CACHE", "on")
+# Vectors are kept as float32, so 64 MiB holds about 10,000 embeddings of 1536 dimensions
+EMBEDDING_CACHE_MEMORY_BYTES = int(os.environ.get("EMBEDDING_CACHE_MEMORY_BYTES", 64 * 2 ** 20))
+EMBEDDING_CACHE_DISK_BYTES = int(os.environ.get("EMBEDDING_CACHE_DISK_BYTES", 512 * 2 ** 20))
+
+LLM_MODEL = "gpt-4o-2024-08-06"
+
+# Model tiering: calls to the endpoints listed in LLM_SMALL_TIER_MAX_TOKENS ("endpoint:tokens,...")
+# whose prompt fits the given size try LLM_SMALL_MODEL first, and escalate to LLM_MODEL when its
+# output is invalid, inconsistent or less confident than LLM_ESCALATION_CONFIDENCE (mean token
+# probability). Set LLM_ROUTING=off to always use LLM_MODEL.
+LLM_ROUTING = os.environ.get("LLM_ROUTING", "on")
+LLM_SMALL_MODEL = os.environ.get("LLM_SMALL_MODEL", "gpt-4o-mini-2024-07-18")
+LLM_SMALL_TIER_MAX_TOKENS = {
+    endpoint: int(tokens) for endpoint, tokens in
+    (item.split(":") for item in os.environ.get("LLM_SMALL_TIER_MAX_TOKENS", "grammar:400,topics:16000").split(",") if item)
+}
+LLM_ESCALATION_CONFIDENCE = float(os.environ.get("LLM_ESCALATION_CONFIDENCE", 0.8))
+
+# Connection pooling for the shared OpenAI and Pinecone clients
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 60))
+PINECONE_MAX_CONCURRENCY = int(os.environ.get("PINECONE_MAX_CONCURRENCY", 16))
+
+# Upstream governor (lib/governor.py) for OpenAI and Pinecone calls: per-process request and token
+# budgets per minute (0 = unlimited), the longest a call may queue for a budget or a concurrency slot
+# before it is rejected, retries of throttled and failed calls, and the circuit breaker that fails
+# fast after UPSTREAM_BREAKER_FAILURES consecutive failures, for UPSTREAM_BREAKER_RESET seconds.
+OPENAI_RPM = int(os.environ.get("OPENAI_RPM", 0))
+OPENAI_TPM = int(os.environ.get("OPENAI_TPM", 0))
+PINECONE_RPM = int(os.environ.get("PINECONE_RPM", 0))
+UPSTREAM_MAX_WAIT = float(os.environ.get("UPSTREAM_MAX_WAIT", 10))
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", 3))
+UPSTREAM_BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", 5))
+UPSTREAM_BREAKER_RESET = float(os.environ.get("UPSTREAM_BREAKER_RESET", 30))
+# Concurrency is cut back when a call takes longer than this multiple of its recent average
+UPSTREAM_LATENCY_TOLERANCE = float(os.environ.get("UPSTREAM_LATENCY_TOLERANCE", 2.0))
+
+# Vector store backend: "pinecone", or "local" for the on-disk NumPy index (no credentials needed).
+# With the Pinecone backend, LOCAL_NAMESPACES lists subjects served from the local index instead.
+VECTOR_STORE = os.environ.get("VECTOR_STORE", "pinecone")
+LOCAL_NAMESPACES = [ns for ns in os.environ.get("LOCAL_NAMESPACES", "").split(",") if ns]
+# Local namespaces with at least this many vectors are searched through an IVF partitioning
+LOCAL_INDEX_IVF_MIN_VECTORS = int(os.environ.get("LOCAL_INDEX_IVF_MIN_VECTORS", 50_000))
+LOCAL_INDEX_IVF_PROBES = int(os.environ.get("LOCAL_INDEX_IVF_PROBES", 8))
+
+# Prompt budgets for /generate/questions, counted with tiktoken when installed
+TOPIC_CONTEXT_TOKENS = int(os.environ.get("TOPIC_CONTEXT_TOKENS", 12_000))
+GENERATION_CONTEXT_TOKENS = int(os.environ.get("GENERATION_CONTEXT_TOKENS", 3_000))
+# Chunks retrieved per topic/subtopic before packing them into the budget
+GENERATION_CONTEXT_CHUNKS = int(os.environ.get("GENERATION_CONTEXT_CHUNKS", 20))
+# Question generation fans out over up to GENERATION_MAX_TOPICS (topic, subtopic) pairs, each asked for
+# at least GENERATION_MIN_QUESTIONS_PER_TOPIC questions; questions whose word sets overlap by at least
+# GENERATION_DEDUPE_SIMILARITY (Jaccard) count as duplicates
+GENERATION_MAX_TOPICS = int(os.environ.get("GENERATION_MAX_TOPICS", 8))
+GENERATION_MIN_QUESTIONS_PER_TOPIC = int(os.environ.get("GENERATION_MIN_QUESTIONS_PER_TOPIC", 2))
+GENERATION_DEDUPE_SIMILARITY = float(os.environ.get("GENERATION_DEDUPE_SIMILARITY", 0.8))
+
+# /answer/analyze/batch: concurrent validations per batch, and the largest batch accepted
+ANSWER_BATCH_MAX_WORKERS = int(os.environ.get("ANSWER_BATCH_MAX_WORKERS", 8))
+ANSWER_BATCH_MAX_ITEMS = int(os.environ.get("ANSWER_BATCH_MAX_ITEMS", 1000))
+
+# Background jobs (/jobs/...): worker threads per process, and seconds a finished job's
+# record (and result) is kept
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 7 * 24 * 3600))
+
+# LLM response cache: set LLM_CACHE=off to always call the model. LLM_CACHE_SKIP lists
+# endpoints whose responses are never cached: grammar, answer, topics, questions.
+LLM_CACHE = os.environ.get("LLM_CACHE", "on")
+LLM_CACHE_SKIP = [name for name in os.environ.get("LLM_CACHE_SKIP", "").split(",") if name]
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", 2_000))
+LLM_CACHE_DISK_BYTES = int(os.environ.get("LLM_CACHE_DISK_BYTES", 256 * 2 ** 20))
+
+# Retrieval for answer validation: "hybrid" fuses vector hits with a local BM25 index of the
+# same chunks, "vector" uses vector hits only. Each side contributes RETRIEVAL_CANDIDATES hits.
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_CANDIDATES = int(os.environ.get("RETRIEVAL_CANDIDATES", 10))
+# Reciprocal rank fusion constant: higher values flatten the advantage of top-ranked hits
+RETRIEVAL_RRF_K = int(os.environ.get("RETRIEVAL_RRF_K", 60))
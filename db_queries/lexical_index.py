@@ -0,0 +1,155 @@
+"""
+Local BM25 index of chunk texts, kept next to the vector index by ingestion.
+
+Chunks are stored per subject (namespace) under their vector IDs in SQLite, with an FTS5
+table over the subject and the text (Porter-stemmed) that ranks matches by BM25. The subject
+is part of the MATCH, so a search only visits that subject's postings. Retrieval uses it as
+the lexical half of hybrid search.
+
+Chunks ingested before this index existed are added by:
+    python -m document_processing.rebuild_catalog --namespace physics
+"""
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Iterable, List, Tuple
+from constants import DATA_DIR
+
+LEXICAL_INDEX_PATH = os.path.join(DATA_DIR, "lexical.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_texts (
+    subject TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (subject, vector_id)
+);
+CREATE INDEX IF NOT EXISTS chunk_texts_by_document ON chunk_texts (subject, title);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(
+    subject, text, content='chunk_texts', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS chunk_texts_insert AFTER INSERT ON chunk_texts BEGIN
+    INSERT INTO chunk_fts (rowid, subject, text) VALUES (new.rowid, new.subject, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunk_texts_delete AFTER DELETE ON chunk_texts BEGIN
+    INSERT INTO chunk_fts (chunk_fts, rowid, subject, text) VALUES ('delete', old.rowid, old.subject, old.text);
+END;
+"""
+
+# Indexes created before the subject was an FTS column; they are rebuilt from chunk_texts
+UPGRADE = """
+DROP TRIGGER IF EXISTS chunk_texts_insert;
+DROP TRIGGER IF EXISTS chunk_texts_delete;
+DROP TABLE IF EXISTS chunk_fts;
+"""
+
+# Longest query, in terms, sent to FTS5
+MAX_QUERY_TERMS = 64
+
+# Question words and function words that would match almost every chunk
+STOPWORDS = frozenset("""
+a an and are as at be by did do does for from had has have how i in is it its of on or that the their this to was
+were what when where which who whom why will with you your
+""".split())
+
+
+def _fts_columns(conn: sqlite3.Connection) -> List[str]:
+    try:
+        return [column[0] for column in conn.execute("SELECT * FROM chunk_fts LIMIT 0").description]
+    except sqlite3.OperationalError:
+        # No index yet
+        return ["subject"]
+
+
+def _phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def match_expression(query: str) -> str:
+    """FTS5 query matching any of the query's words; BM25 then favours chunks with more (and rarer) ones."""
+    terms = [term for term in dict.fromkeys(re.findall(r"\w+", query.lower())) if term not in STOPWORDS]
+    terms = terms[:MAX_QUERY_TERMS]
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class LexicalIndex:
+    def __init__(self, path: str = None):
+        self.path = path or LEXICAL_INDEX_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            upgrade = "subject" not in _fts_columns(conn)
+            if upgrade:
+                conn.executescript(UPGRADE)
+            conn.executescript(SCHEMA)
+            if upgrade:
+                with conn:
+                    conn.execute("INSERT INTO chunk_fts (chunk_fts) VALUES ('rebuild')")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, subject: str, title: str, chunks: Iterable[Tuple[str, str]]):
+        """Adds or replaces (vector_id, text) pairs of one document."""
+        with closing(self._connect()) as conn, conn:
+            for vector_id, text in chunks:
+                # A plain REPLACE would bypass the delete trigger and leave the old text in the FTS index
+                conn.execute("DELETE FROM chunk_texts WHERE subject = ? AND vector_id = ?", (subject, vector_id))
+                conn.execute("INSERT INTO chunk_texts (subject, vector_id, title, text) VALUES (?, ?, ?, ?)",
+                             (subject, vector_id, title, text))
+
+    def delete(self, subject: str, vector_ids: Iterable[str]):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM chunk_texts WHERE subject = ? AND vector_id = ?",
+                             [(subject, vector_id) for vector_id in vector_ids])
+
+    def prune(self, subject: str, title: str, keep: Iterable[str]) -> int:
+        """Deletes the document's chunks whose IDs are not in `keep`; returns how many were deleted."""
+        keep = set(keep)
+        with closing(self._connect()) as conn:
+            stored = [row[0] for row in conn.execute(
+                "SELECT vector_id FROM chunk_texts WHERE subject = ? AND title = ?", (subject, title))]
+        stale = [vector_id for vector_id in stored if vector_id not in keep]
+        self.delete(subject, stale)
+        return len(stale)
+
+    def search(self, subject: str, query: str, limit: int = 10) -> List[dict]:
+        """Best BM25 matches in the subject as `{"id", "title", "text", "score"}`, higher scores first."""
+        expression = match_expression(query)
+        if not expression:
+            return []
+        # A subject without word characters has no tokens to match on
+        if re.search(r"\w", subject):
+            expression = f"subject : {_phrase(subject)} AND text : ({expression})"
+        with closing(self._connect()) as conn:
+            # The subject phrase narrows the match; the equality check keeps out subjects that merely contain it.
+            # Weight 0 keeps subject matches out of the BM25 score.
+            rows = conn.execute(
+                "SELECT c.vector_id, c.title, c.text, bm25(chunk_fts, 0.0, 1.0) AS rank "
+                "FROM chunk_fts JOIN chunk_texts c ON c.rowid = chunk_fts.rowid "
+                "WHERE chunk_fts MATCH ? AND c.subject = ? ORDER BY rank LIMIT ?",
+                (expression, subject, limit)
+            ).fetchall()
+        # FTS5's bm25() is negative, lower is better
+        return [{"id": vector_id, "title": title, "text": text, "score": -rank} for vector_id, title, text, rank in rows]
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_lexical_index() -> LexicalIndex:
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = LexicalIndex()
+    return _default_index
+
+
+def set_lexical_index(index: LexicalIndex):
+    global _default_index
+    _default_index = index
@@ -1,71 +1,150 @@
+import asyncio
 import logging
-from document_processing.index_utils import get_embeddings  # Ensure this generates a single embedding for queries
-from config.pinecone import idx  # Use the existing Pinecone index
+from concurrent.futures import ThreadPoolExecutor
+from document_processing.index_utils import get_embeddings_batch, get_embeddings_batch_async
+from config.openai import get_async_client
+from document_processing.manifest import list_titles
+from config.pinecone import get_index, index_call  # Use the existing Pinecone index
+from db_queries.retrieval import rank_matches, vector_query
+from lib.governor import UpstreamError
+from lib.metrics import timed
+
+# A malformed query or result only costs the context. Upstream throttling and outages
+# (`UpstreamError`) reach the caller, which reports them as 429/503 with Retry-After.
+_LOOKUP_ERRORS = (LookupError, TypeError, ValueError)
 
 def search_similar_materials(query_text, client, subject, top_k=5, threshold=0.45):
     try:
         # Generate embedding for the query
-        query_embedding = get_embeddings(data=query_text, openai_client=client)
+        query_embedding = get_embeddings_batch([query_text], openai_client=client)[0]
 
         if not query_embedding:
             logging.error("Failed to generate embedding for query.")
             return []
 
-        # Perform similarity search
-        search_results = idx.query(
-            vector=query_embedding,
-            namespace=subject,
-            top_k=top_k,
-            include_values=True,  # ✅ Include vector values instead of text
-            include_metadata=True  
-        )
-
-        # Process results with threshold filtering
-        matches = [
-            {
-                "title": match["metadata"]["title"],
-                "score": match["score"],
-                # "vector": match["values"]  # ✅ Extract vector for context
-                "text": match["metadata"].get("text", "No text available")  # ✅ Extract stored text
-            }
-            for match in search_results["matches"] if match["score"] >= threshold  # ✅ Apply threshold
-        ]
-
-        return matches
-
-    except Exception as e:
+        # Perform similarity search (metadata only: the stored text is what the prompt needs)
+        with timed("vector_query"):
+            search_results = get_index().query(**vector_query(query_embedding, subject, top_k))
+
+        return rank_matches(query_text, search_results, subject, top_k, threshold)
+
+    except UpstreamError:
+        raise
+    except _LOOKUP_ERRORS as e:
         logging.error(f"Error in similarity search: {e}")
         return []
 
-def get_all_subjects():
-    stats = idx.describe_index_stats()
-    # The 'namespaces' key is a dictionary with namespace names as keys
-    namespaces = list(stats.get("namespaces", {}).keys())
-    return namespaces
+async def search_similar_materials_async(query_text, subject, top_k=5, threshold=0.45, client=None):
+    try:
+        query_embedding = (await get_embeddings_batch_async([query_text], openai_client=client or get_async_client()))[0]
+
+        if not query_embedding:
+            logging.error("Failed to generate embedding for query.")
+            return []
+
+        search_results = await index_call("query", **vector_query(query_embedding, subject, top_k))
+
+        return await asyncio.to_thread(rank_matches, query_text, search_results, subject, top_k, threshold)
+
+    except UpstreamError:
+        raise
+    except _LOOKUP_ERRORS as e:
+        logging.error(f"Error in similarity search: {e}")
+        return []
 
-def get_all_titles_in_subject(subject: str, dimension: int = 1536, top_k: int = 1000):
+def _query_matches(query_text, query_embedding, subject, top_k, threshold):
+    try:
+        with timed("vector_query"):
+            search_results = get_index().query(**vector_query(query_embedding, subject, top_k))
+        return rank_matches(query_text, search_results, subject, top_k, threshold)
+    except UpstreamError:
+        raise
+    except _LOOKUP_ERRORS as e:
+        logging.error(f"Error in similarity search: {e}")
+        return []
+
+def search_similar_materials_batch(query_texts, client, subject, top_k=5, threshold=0.45, max_workers=8):
     """
-    Retrieve unique document titles stored in a specific namespace (subject).
+    `search_similar_materials` for several queries: one embeddings request, then concurrent index queries.
 
-    This function queries Pinecone using a dummy vector and extracts the title from each document's metadata.
-    It then returns a list of unique titles (preserving the original order).
+    A failed embeddings request raises, since it affects every query, rather than looking like no matches.
     """
-    # Create a dummy vector of zeros with the specified dimension
-    dummy_vector = [0.0] * dimension
+    query_embeddings = get_embeddings_batch(list(query_texts), openai_client=client)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(query_embeddings)))) as executor:
+        return list(executor.map(lambda text, embedding: _query_matches(text, embedding, subject, top_k, threshold),
+                                 query_texts, query_embeddings))
 
-    results = idx.query(
-        vector=dummy_vector,
+async def search_similar_materials_batch_async(query_texts, subject, top_k=5, threshold=0.45, client=None):
+    query_embeddings = await get_embeddings_batch_async(list(query_texts), openai_client=client or get_async_client())
+
+    async def one(query_text, embedding):
+        try:
+            search_results = await index_call("query", **vector_query(embedding, subject, top_k))
+            return await asyncio.to_thread(rank_matches, query_text, search_results, subject, top_k, threshold)
+        except UpstreamError:
+            raise
+        except _LOOKUP_ERRORS as e:
+            logging.error(f"Error in similarity search: {e}")
+            return []
+
+    return list(await asyncio.gather(*(one(text, embedding) for text, embedding in zip(query_texts, query_embeddings))))
+
+def _book_query(query_embedding, subject: str, book: str, top_k: int) -> dict:
+    return dict(
+        vector=query_embedding,
         namespace=subject,
         top_k=top_k,
-        include_metadata=True
+        include_metadata=True,
+        filter={"title": {"$eq": book}}
     )
 
-    # Use a set to track seen titles and a list to preserve order
-    seen = set()
-    unique_titles = []
-    for match in results.get("matches", []):
-        title = match.get("metadata", {}).get("title", "Unknown Title")
-        if title not in seen:
-            seen.add(title)
-            unique_titles.append(title)
-    return unique_titles
+
+def _book_matches(search_results) -> list:
+    return [
+        {
+            "text": match["metadata"].get("text", ""),
+            "chunk_index": match["metadata"].get("chunk_index", 0),
+            "score": match["score"],
+        }
+        for match in search_results["matches"]
+    ]
+
+
+def search_book_chunks(query_text, client, subject, book, top_k=20):
+    """Chunks of one book most similar to `query_text`, best first."""
+    try:
+        query_embedding = get_embeddings_batch([query_text], openai_client=client)[0]
+        with timed("vector_query"):
+            search_results = get_index().query(**_book_query(query_embedding, subject, book, top_k))
+        return _book_matches(search_results)
+    except UpstreamError:
+        raise
+    except _LOOKUP_ERRORS as e:
+        logging.error(f"Error in book search: {e}")
+        return []
+
+
+async def search_book_chunks_async(query_text, subject, book, top_k=20, client=None):
+    try:
+        query_embedding = (await get_embeddings_batch_async([query_text], openai_client=client or get_async_client()))[0]
+        return _book_matches(await index_call("query", **_book_query(query_embedding, subject, book, top_k)))
+    except UpstreamError:
+        raise
+    except _LOOKUP_ERRORS as e:
+        logging.error(f"Error in book search: {e}")
+        return []
+
+def get_all_subjects():
+    stats = get_index().describe_index_stats()
+    # The 'namespaces' key is a dictionary with namespace names as keys
+    namespaces = list(stats.get("namespaces", {}).keys())
+    return namespaces
+
+def get_all_titles_in_subject(subject: str):
+    """
+    Retrieve the document titles stored in a specific namespace (subject).
+
+    Titles come from the document catalog kept by ingestion, so no vector query is needed.
+    """
+    return list_titles(subject)
@@ -0,0 +1,73 @@
+"""
+Context retrieval for answer validation.
+
+Vector queries ask for metadata only; the stored chunk text is all the prompt needs. In
+hybrid mode (RETRIEVAL_MODE) the vector hits are fused with BM25 hits on the same subject
+from the local lexical index by reciprocal rank fusion, so chunks that both searches rank
+highly come first and the prompt gets fewer, better passages.
+"""
+import logging
+import sqlite3
+from collections import defaultdict
+from typing import List
+from constants import RETRIEVAL_MODE, RETRIEVAL_CANDIDATES, RETRIEVAL_RRF_K
+from db_queries.lexical_index import get_lexical_index
+
+
+def vector_query(query_embedding, subject: str, top_k: int) -> dict:
+    """Index query arguments for `top_k` results, widened to the candidate pool in hybrid mode."""
+    if RETRIEVAL_MODE == "hybrid":
+        top_k = max(top_k, RETRIEVAL_CANDIDATES)
+    return dict(vector=query_embedding, namespace=subject, top_k=top_k, include_values=False,
+                include_metadata=True)
+
+
+def vector_matches(search_results, threshold: float) -> List[dict]:
+    """Vector hits scoring at least `threshold`, best first."""
+    return [
+        {
+            "id": match["id"],
+            "title": match["metadata"]["title"],
+            "score": match["score"],
+            "text": match["metadata"].get("text", "No text available"),
+        }
+        for match in search_results["matches"] if match["score"] >= threshold
+    ]
+
+
+def lexical_matches(query_text: str, subject: str, limit: int = RETRIEVAL_CANDIDATES) -> List[dict]:
+    try:
+        return get_lexical_index().search(subject, query_text, limit)
+    except sqlite3.Error as e:
+        logging.warning(f"Lexical search unavailable, using vector hits only: {e}")
+        return []
+
+
+def fuse(vector_hits: List[dict], lexical_hits: List[dict], top_k: int, rrf_k: int = RETRIEVAL_RRF_K) -> List[dict]:
+    """Reciprocal rank fusion: each list adds 1 / (rrf_k + rank) to a chunk's score; returns the best `top_k`."""
+    chunks, scores = {}, defaultdict(float)
+    for hits in (vector_hits, lexical_hits):
+        for rank, hit in enumerate(hits, start=1):
+            chunks.setdefault(hit["id"], hit)
+            scores[hit["id"]] += 1 / (rrf_k + rank)
+    best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [{"title": chunks[vector_id]["title"], "score": scores[vector_id], "text": chunks[vector_id]["text"]}
+            for vector_id in best]
+
+
+def rank_matches(query_text: str, search_results, subject: str, top_k: int, threshold: float) -> List[dict]:
+    """
+    The `top_k` context chunks for a query given the vector query's results.
+
+    Without a vector hit above `threshold` the question is taken to be off-topic for the
+    subject and nothing is returned, whatever the lexical index matches.
+    """
+    vector_hits = vector_matches(search_results, threshold)
+    if RETRIEVAL_MODE != "hybrid" or not vector_hits:
+        return [{key: hit[key] for key in ("title", "score", "text")} for hit in vector_hits[:top_k]]
+    return fuse(vector_hits, lexical_matches(query_text, subject), top_k)
+
+
+def context_text(matches: List[dict]) -> str:
+    """Prompt form of retrieved chunks: one passage per chunk, headed by its document title."""
+    return "\n\n".join(f"[{match['title']}]\n{match['text']}" for match in matches)
@@ -0,0 +1,458 @@
+"""
+Vector store backends behind the global `idx`.
+
+Every backend exposes the subset of the Pinecone `Index` API this project uses, so
+callers are unaffected by which one `config.pinecone` selects:
+
+- Pinecone's own `Index` (the default);
+- `LocalIndex`: one float32 matrix per namespace, memory-mapped from disk and searched
+  with brute-force cosine similarity, or an IVF partitioning for large namespaces. Writes
+  are kept in memory until `flush()`, which ingestion calls once per document;
+- `RoutedIndex`: serves a few hot namespaces from a `LocalIndex` and everything else remotely;
+- `GovernedIndex`: passes every call to a remote index through an upstream governor.
+
+To copy a namespace from Pinecone into the local index:
+    python -m db_queries.vector_store --pull physics
+"""
+import argparse
+import json
+import os
+import threading
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Protocol
+import numpy as np
+from constants import DATA_DIR, LOCAL_INDEX_IVF_MIN_VECTORS, LOCAL_INDEX_IVF_PROBES
+
+LOCAL_INDEX_DIR = os.path.join(DATA_DIR, "vectors")
+LIST_PAGE_SIZE = 100
+
+
+class VectorIndex(Protocol):
+    def upsert(self, vectors, namespace: str = ""): ...
+    def query(self, vector, namespace: str = "", top_k: int = 10, include_metadata: bool = False,
+              include_values: bool = False, filter: Optional[dict] = None): ...
+    def fetch(self, ids: List[str], namespace: str = ""): ...
+    def update(self, id: str, set_metadata: Optional[dict] = None, values=None, namespace: str = ""): ...
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: str = ""): ...
+    def list(self, namespace: str = "", prefix: Optional[str] = None) -> Iterator[List[str]]: ...
+    def describe_index_stats(self) -> dict: ...
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _matches_condition(value, condition) -> bool:
+    if not isinstance(condition, dict):
+        return value == condition
+    for op, operand in condition.items():
+        if op == "$eq" and value != operand:
+            return False
+        if op == "$ne" and value == operand:
+            return False
+        if op == "$in" and value not in operand:
+            return False
+        if op == "$nin" and value in operand:
+            return False
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is None:
+                return False
+            if (op == "$gt" and not value > operand) or (op == "$gte" and not value >= operand) \
+                    or (op == "$lt" and not value < operand) or (op == "$lte" and not value <= operand):
+                return False
+    return True
+
+
+def matches_filter(metadata: dict, filter: Optional[dict]) -> bool:
+    """Evaluates a Pinecone-style metadata filter (`$eq`, `$ne`, `$in`, `$nin`, comparisons, `$and`, `$or`)."""
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif not _matches_condition(metadata.get(key), condition):
+            return False
+    return True
+
+
+class _Namespace:
+    """Rows of one namespace: IDs, metadata and a (memory-mapped) matrix of unit vectors."""
+
+    # Equality filters on these fields are answered from an inverted index instead of a scan
+    INDEXED_FIELDS = ("title", "subject")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ids: List[str] = []
+        self.metadata: List[dict] = []
+        self.vectors: Optional[np.ndarray] = None
+        self.rows: Dict[str, int] = {}
+        # Writable matrix with spare rows that `vectors` is a view of once the namespace has been written to
+        self._buffer: Optional[np.ndarray] = None
+        self._field_rows = None
+        self._ivf = None
+        # Modification times of the files the rows were read from, to notice other processes' flushes
+        self.stamp = self.disk_stamp()
+        if os.path.exists(os.path.join(path, "records.json")):
+            with open(os.path.join(path, "records.json"), "r", encoding="utf-8") as file:
+                records = json.load(file)
+            self.ids = [record["id"] for record in records]
+            self.metadata = [record["metadata"] for record in records]
+            self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            self.rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def consistent(self) -> bool:
+        """False when the files were read halfway through another process's save."""
+        return len(self) == (len(self.vectors) if self.vectors is not None else 0)
+
+    def disk_stamp(self) -> Optional[tuple]:
+        try:
+            return tuple(os.stat(os.path.join(self.path, name)).st_mtime_ns for name in ("records.json", "vectors.npy"))
+        except FileNotFoundError:
+            return None
+
+    def save(self):
+        """Writes the namespace atomically and re-opens the vectors memory-mapped."""
+        os.makedirs(self.path, exist_ok=True)
+        vectors = self.vectors if self.vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        with open(os.path.join(self.path, "vectors.tmp.npy"), "wb") as file:
+            np.save(file, np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(os.path.join(self.path, "records.tmp.json"), "w", encoding="utf-8") as file:
+            json.dump([{"id": i, "metadata": m} for i, m in zip(self.ids, self.metadata)], file)
+        os.replace(os.path.join(self.path, "vectors.tmp.npy"), os.path.join(self.path, "vectors.npy"))
+        os.replace(os.path.join(self.path, "records.tmp.json"), os.path.join(self.path, "records.json"))
+        self.vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        self._buffer = None
+        self.stamp = self.disk_stamp()
+        self.changed()
+
+    def changed(self):
+        """Drops the lookup structures derived from the rows; they are rebuilt on the next query."""
+        self._field_rows, self._ivf = None, None
+
+    def _writable(self, rows: int, dim: int) -> np.ndarray:
+        """
+        A writable matrix starting with the current vectors, with room for `rows` rows.
+
+        Capacity at least doubles whenever it runs out, so appending batch after batch copies
+        each vector a constant number of times on average.
+        """
+        current = len(self)
+        if self._buffer is None or len(self._buffer) < rows:
+            buffer = np.empty((max(rows, 2 * current, 1024), dim), dtype=np.float32)
+            if current:
+                buffer[:current] = self.vectors
+            self._buffer = buffer
+        return self._buffer
+
+    def upsert(self, items):
+        if not items:
+            return
+        dim = self.vectors.shape[1] if self.vectors is not None and len(self) else len(items[0][1])
+        reused = self._buffer is not None and len(self._buffer) >= len(self) + len(items)
+        buffer = self._writable(len(self) + len(items), dim)
+        if reused and any(vector_id in self.rows for vector_id, _, _ in items):
+            # Queries score a view of the buffer without the lock: overwrite rows in a copy, not under them
+            buffer = self._buffer = buffer.copy()
+        for vector_id, values, metadata in items:
+            if vector_id in self.rows:
+                row = self.rows[vector_id]
+                self.metadata[row] = dict(metadata or {})
+            else:
+                row = self.rows[vector_id] = len(self.ids)
+                self.ids.append(vector_id)
+                self.metadata.append(dict(metadata or {}))
+            buffer[row] = _normalize(np.asarray(values, dtype=np.float32))
+        self.vectors = buffer[:len(self.ids)]
+        self.changed()
+
+    def delete(self, ids):
+        doomed = {self.rows[vector_id] for vector_id in ids if vector_id in self.rows}
+        if not doomed:
+            return
+        keep = [row for row in range(len(self)) if row not in doomed]
+        self.ids = [self.ids[row] for row in keep]
+        self.metadata = [self.metadata[row] for row in keep]
+        self.vectors = np.array(self.vectors)[keep] if keep else None
+        self._buffer = None
+        self.rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        self.changed()
+
+    def candidate_rows(self, filter: Optional[dict]) -> np.ndarray:
+        if not filter:
+            return np.arange(len(self))
+        if self._field_rows is None:
+            self._field_rows = {field: {} for field in self.INDEXED_FIELDS}
+            for row, metadata in enumerate(self.metadata):
+                for field in self.INDEXED_FIELDS:
+                    if field in metadata:
+                        self._field_rows[field].setdefault(metadata[field], []).append(row)
+
+        rows = None
+        for field in self.INDEXED_FIELDS:
+            condition = filter.get(field)
+            if condition is None:
+                continue
+            values = [condition] if not isinstance(condition, dict) else \
+                [condition["$eq"]] if "$eq" in condition else condition.get("$in")
+            if values is not None:
+                field_rows = {r for value in values for r in self._field_rows[field].get(value, [])}
+                rows = field_rows if rows is None else rows & field_rows
+        candidates = sorted(rows) if rows is not None else range(len(self))
+        return np.fromiter((row for row in candidates if matches_filter(self.metadata[row], filter)), dtype=np.int64)
+
+    def ivf(self):
+        """Lazily clusters the vectors into ~sqrt(n) lists with a few rounds of k-means."""
+        if self._ivf is None:
+            vectors = np.asarray(self.vectors)
+            nlist = max(1, int(np.sqrt(len(self))))
+            rng = np.random.default_rng(0)
+            centroids = vectors[rng.choice(len(self), nlist, replace=False)]
+            for _ in range(10):
+                assignment = np.argmax(vectors @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = vectors[assignment == c]
+                    if len(members):
+                        centroids[c] = _normalize(members.mean(axis=0))
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            self._ivf = (centroids, assignment)
+        return self._ivf
+
+
+class LocalIndex:
+    """Pinecone-compatible index stored under `root`, one directory per namespace."""
+
+    def __init__(self, root: str = LOCAL_INDEX_DIR, ivf_min_vectors: int = LOCAL_INDEX_IVF_MIN_VECTORS,
+                 ivf_probes: int = LOCAL_INDEX_IVF_PROBES):
+        self.root = root
+        self.ivf_min_vectors = ivf_min_vectors
+        self.ivf_probes = ivf_probes
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._unsaved = set()
+        self._lock = threading.RLock()
+
+    def _namespace(self, namespace: str) -> _Namespace:
+        """
+        The namespace's rows, re-read when another process (e.g. an ingestion job) has flushed it
+        since, unless this process has unsaved writes to it.
+        """
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None or (namespace not in self._unsaved and ns.disk_stamp() != ns.stamp):
+                fresh = _Namespace(os.path.join(self.root, namespace or "__default__"))
+                # A half-written pair of files is retried on the next call
+                if ns is None or fresh.consistent:
+                    ns = self._namespaces[namespace] = fresh
+            return ns
+
+    def upsert(self, vectors, namespace: str = ""):
+        items = [(v["id"], v["values"], v.get("metadata")) if isinstance(v, dict) else tuple(v) + (None,) * (3 - len(v))
+                 for v in vectors]
+        with self._lock:
+            self._namespace(namespace).upsert(items)
+            self._unsaved.add(namespace)
+        return {"upserted_count": len(items)}
+
+    def flush(self):
+        """Writes every namespace changed since the last flush to disk."""
+        with self._lock:
+            for namespace in sorted(self._unsaved):
+                self._namespaces[namespace].save()
+            self._unsaved.clear()
+
+    def query(self, vector, namespace: str = "", top_k: int = 10, include_metadata: bool = False,
+              include_values: bool = False, filter: Optional[dict] = None, **kwargs):
+        with self._lock:
+            ns = self._namespace(namespace)
+            vectors, ids, metadata = ns.vectors, ns.ids, ns.metadata
+            if not len(ns):
+                return {"matches": [], "namespace": namespace}
+            rows = ns.candidate_rows(filter)
+            query = _normalize(np.asarray(vector, dtype=np.float32))
+            if len(ns) >= self.ivf_min_vectors and len(rows) > top_k:
+                centroids, assignment = ns.ivf()
+                probes = np.argsort(-(centroids @ query))[:self.ivf_probes]
+                probed = rows[np.isin(assignment[rows], probes)]
+                rows = probed if len(probed) >= top_k else rows
+
+        scores = np.asarray(vectors[rows] @ query) if len(rows) else np.zeros(0, dtype=np.float32)
+        k = min(top_k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k] if k else []
+        best = sorted(best, key=lambda i: -scores[i])
+        matches = []
+        for i in best:
+            row = int(rows[i])
+            match = {"id": ids[row], "score": float(scores[i])}
+            if include_metadata:
+                match["metadata"] = dict(metadata[row])
+            if include_values:
+                match["values"] = vectors[row].tolist()
+            matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def fetch(self, ids: List[str], namespace: str = "", **kwargs):
+        with self._lock:
+            ns = self._namespace(namespace)
+            found = {
+                vector_id: SimpleNamespace(id=vector_id, values=ns.vectors[ns.rows[vector_id]].tolist(),
+                                           metadata=dict(ns.metadata[ns.rows[vector_id]]))
+                for vector_id in ids if vector_id in ns.rows
+            }
+        return SimpleNamespace(vectors=found, namespace=namespace)
+
+    def update(self, id: str, set_metadata: Optional[dict] = None, values=None, namespace: str = "", **kwargs):
+        with self._lock:
+            ns = self._namespace(namespace)
+            if id not in ns.rows:
+                return {}
+            row = ns.rows[id]
+            if set_metadata:
+                ns.metadata[row] = {**ns.metadata[row], **set_metadata}
+                ns.changed()
+            if values is not None:
+                ns.upsert([(id, values, ns.metadata[row])])
+            self._unsaved.add(namespace)
+        return {}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: str = "", **kwargs):
+        with self._lock:
+            ns = self._namespace(namespace)
+            ns.delete(list(ns.ids) if delete_all else ids or [])
+            self._unsaved.add(namespace)
+        return {}
+
+    def list(self, namespace: str = "", prefix: Optional[str] = None, **kwargs) -> Iterator[List[str]]:
+        with self._lock:
+            ids = [vector_id for vector_id in self._namespace(namespace).ids
+                   if prefix is None or vector_id.startswith(prefix)]
+        for start in range(0, len(ids), LIST_PAGE_SIZE):
+            yield ids[start:start + LIST_PAGE_SIZE]
+
+    def describe_index_stats(self, **kwargs) -> dict:
+        names = set(os.listdir(self.root)) if os.path.isdir(self.root) else set()
+        with self._lock:
+            # Namespaces written to but not flushed yet have no directory
+            names.update(namespace or "__default__" for namespace in self._unsaved)
+            namespaces = {}
+            for name in sorted(names):
+                namespace = "" if name == "__default__" else name
+                namespaces[namespace] = {"vector_count": len(self._namespace(namespace))}
+        return {"namespaces": namespaces, "total_vector_count": sum(n["vector_count"] for n in namespaces.values())}
+
+
+class RoutedIndex:
+    """Sends calls for `local_namespaces` to the local index and all others to the remote one."""
+
+    def __init__(self, remote, local: LocalIndex, local_namespaces: List[str]):
+        self.remote = remote
+        self.local = local
+        self.local_namespaces = set(local_namespaces)
+
+    def _route(self, namespace: str):
+        return self.local if namespace in self.local_namespaces else self.remote
+
+    def upsert(self, vectors, namespace: str = "", **kwargs):
+        return self._route(namespace).upsert(vectors=vectors, namespace=namespace, **kwargs)
+
+    def query(self, namespace: str = "", **kwargs):
+        return self._route(namespace).query(namespace=namespace, **kwargs)
+
+    def fetch(self, ids: List[str], namespace: str = "", **kwargs):
+        return self._route(namespace).fetch(ids=ids, namespace=namespace, **kwargs)
+
+    def update(self, namespace: str = "", **kwargs):
+        return self._route(namespace).update(namespace=namespace, **kwargs)
+
+    def delete(self, namespace: str = "", **kwargs):
+        return self._route(namespace).delete(namespace=namespace, **kwargs)
+
+    def list(self, namespace: str = "", **kwargs):
+        return self._route(namespace).list(namespace=namespace, **kwargs)
+
+    def flush(self):
+        self.local.flush()
+
+    def describe_index_stats(self, **kwargs) -> dict:
+        namespaces = dict(self.remote.describe_index_stats().get("namespaces", {}))
+        namespaces.update(self.local.describe_index_stats()["namespaces"])
+        return {"namespaces": namespaces}
+
+
+class GovernedIndex:
+    """Runs every call to `index` (Pinecone's) through `governor`, which paces, retries and circuit-breaks them."""
+
+    def __init__(self, index, governor):
+        self.index = index
+        self.governor = governor
+
+    def _call(self, method: str, **kwargs):
+        return self.governor.call(lambda: getattr(self.index, method)(**kwargs))
+
+    def upsert(self, **kwargs):
+        return self._call("upsert", **kwargs)
+
+    def query(self, **kwargs):
+        return self._call("query", **kwargs)
+
+    def fetch(self, **kwargs):
+        return self._call("fetch", **kwargs)
+
+    def update(self, **kwargs):
+        return self._call("update", **kwargs)
+
+    def delete(self, **kwargs):
+        return self._call("delete", **kwargs)
+
+    def describe_index_stats(self, **kwargs):
+        return self._call("describe_index_stats", **kwargs)
+
+    def list(self, **kwargs) -> Iterator[List[str]]:
+        # Each page is a request; a failed one ends the iteration, so pages are not retried
+        pages = self.index.list(**kwargs)
+        while True:
+            page = self.governor.call(lambda: next(pages, None), max_retries=0)
+            if page is None:
+                return
+            yield page
+
+
+def pull_namespace(remote, local: LocalIndex, namespace: str, batch_size: int = 100) -> int:
+    """Copies every vector of a namespace from the remote index into the local one."""
+    from document_processing.pipeline import iter_vector_id_pages
+
+    copied = 0
+    for ids in iter_vector_id_pages(remote, namespace):
+        for start in range(0, len(ids), batch_size):
+            fetched = remote.fetch(ids=ids[start:start + batch_size], namespace=namespace).vectors
+            local.upsert(vectors=[(vector_id, list(v.values), dict(v.metadata or {})) for vector_id, v in fetched.items()],
+                         namespace=namespace)
+            copied += len(fetched)
+    local.flush()
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy Pinecone namespaces into the local vector index.")
+    parser.add_argument("--pull", action="append", required=True, metavar="NAMESPACE", help="Namespace to copy")
+    args = parser.parse_args()
+
+    from config.pinecone import get_pinecone, index_name
+    pc = get_pinecone()
+    if pc is None:
+        parser.error("pulling needs the Pinecone backend (unset VECTOR_STORE=local)")
+    remote, local = pc.Index(index_name), LocalIndex()
+    for namespace in args.pull:
+        print(f"{namespace}: copied {pull_namespace(remote, local, namespace)} vectors into {local.root}")
+
+
+if __name__ == "__main__":
+    main()
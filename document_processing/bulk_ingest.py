@@ -0,0 +1,188 @@
+"""
+Ingests every PDF under a directory into one subject namespace.
+
+Text extraction and chunking (CPU-bound PyMuPDF work) run in a process pool, while
+embedding and upserting run in a thread pool with bounded concurrency. Every finished
+file is recorded in a checkpoint file, so an interrupted run resumes where it stopped.
+
+Usage: python -m document_processing.bulk_ingest docs/ --subject history [--processes 4] [--io-workers 4]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from constants import DATA_DIR
+from document_processing.docs import iter_pages
+from document_processing.embedding_cache import get_embedding_cache
+from document_processing.index_utils import iter_chunks
+from document_processing.pipeline import document_metadata, sync_document
+
+DEFAULT_CHECKPOINT = os.path.join(DATA_DIR, "ingest_checkpoint.json")
+
+
+def find_pdfs(directory: str):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """Writes the checkpoint atomically so a crash never leaves a truncated file behind."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def checkpoint_key(file_path: str, subject: str) -> str:
+    return f"{subject}:{os.path.abspath(file_path)}"
+
+
+def file_signature(file_path: str) -> dict:
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def is_done(checkpoint: dict, file_path: str, subject: str) -> bool:
+    entry = checkpoint.get(checkpoint_key(file_path, subject))
+    return entry is not None and all(entry.get(k) == v for k, v in file_signature(file_path).items())
+
+
+def extract_document(file_path: str, subject: str) -> dict:
+    """Runs in a worker process: extracts and chunks one PDF."""
+    start = time.perf_counter()
+    pages = 0
+
+    def counted_pages():
+        nonlocal pages
+        for page_text in iter_pages(file_path):
+            pages += 1
+            yield page_text
+
+    chunks = list(iter_chunks(counted_pages()))
+    return {
+        "path": file_path,
+        "metadata": document_metadata(file_path, subject),
+        "pages": pages,
+        "chunks": chunks,
+        "extract_seconds": time.perf_counter() - start,
+    }
+
+
+def upload_document(document: dict, openai_client, index, subject: str, build_topics: bool = False) -> dict:
+    """Runs in an I/O thread: embeds and upserts the changed chunks of one extracted PDF."""
+    stats = sync_document(document["chunks"], openai_client, index, namespace=subject, metadata=document["metadata"],
+                          pages=document["pages"], progress=None)
+    if build_topics:
+        from lib.topic_index import build_topic_index
+        build_topic_index(subject, document["metadata"]["title"])
+    return stats
+
+
+def report(document: dict, stats: dict):
+    extract_seconds = max(document["extract_seconds"], 1e-9)
+    upload_seconds = max(stats["elapsed"], 1e-9)
+    print(f"{os.path.basename(document['path'])}: {document['pages']} pages, {stats['chunks']} chunks, "
+          f"{stats['vectors']} vectors ({stats['unchanged']} unchanged, {stats['deleted']} deleted) | extract {document['pages'] / extract_seconds:.1f} pages/s, "
+          f"{stats['chunks'] / extract_seconds:.1f} chunks/s | embed+upsert {stats['vectors'] / upload_seconds:.1f} vectors/s")
+
+
+def ingest_directory(directory: str, subject: str, openai_client, index, processes: int, io_workers: int,
+                     checkpoint_path: str = DEFAULT_CHECKPOINT, build_topics: bool = False) -> dict:
+    checkpoint = load_checkpoint(checkpoint_path)
+    files = find_pdfs(directory)
+    pending = deque(path for path in files if not is_done(checkpoint, path, subject))
+    totals = {"files": 0, "skipped": len(files) - len(pending), "failed": 0, "pages": 0, "vectors": 0}
+    if totals["skipped"]:
+        print(f"Skipping {totals['skipped']} already ingested files (checkpoint: {checkpoint_path})")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as cpu_pool, ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+        extracting, uploading = {}, {}
+
+        def fill():
+            # Extract ahead only while the upload backlog is small, keeping memory bounded
+            while pending and len(extracting) < processes and len(uploading) < 2 * io_workers:
+                path = pending.popleft()
+                extracting[cpu_pool.submit(extract_document, path, subject)] = path
+
+        fill()
+        while extracting or uploading:
+            done, _ = wait(list(extracting) + list(uploading), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in extracting:
+                    path = extracting.pop(future)
+                    try:
+                        document = future.result()
+                    except Exception as e:
+                        logging.error(f"Failed to extract '{path}': {e}")
+                        totals["failed"] += 1
+                        continue
+                    uploading[io_pool.submit(upload_document, document, openai_client, index, subject, build_topics)] = document
+                else:
+                    document = uploading.pop(future)
+                    try:
+                        stats = future.result()
+                    except Exception as e:
+                        logging.error(f"Failed to ingest '{document['path']}': {e}")
+                        totals["failed"] += 1
+                        continue
+                    report(document, stats)
+                    checkpoint[checkpoint_key(document["path"], subject)] = {
+                        **file_signature(document["path"]),
+                        "title": document["metadata"]["title"],
+                        "vectors": stats["vectors"],
+                        "completed_at": time.time(),
+                    }
+                    save_checkpoint(checkpoint_path, checkpoint)
+                    totals["files"] += 1
+                    totals["pages"] += document["pages"]
+                    totals["vectors"] += stats["vectors"]
+            fill()
+
+    totals["elapsed"] = time.perf_counter() - start
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", help="Directory searched recursively for PDFs")
+    parser.add_argument("--subject", required=True, help="Subject namespace to ingest into")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Extraction processes")
+    parser.add_argument("--io-workers", type=int, default=4, help="Concurrent embed/upsert workers")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Checkpoint file used to resume")
+    parser.add_argument("--build-topics", action="store_true", help="Extract each book's topics after ingesting it")
+    args = parser.parse_args()
+
+    from config.openai import get_client
+    from config.pinecone import get_index
+
+    totals = ingest_directory(args.directory, args.subject, get_client(), get_index(), processes=args.processes,
+                              io_workers=args.io_workers, checkpoint_path=args.checkpoint,
+                              build_topics=args.build_topics)
+    elapsed = max(totals["elapsed"], 1e-9)
+    print(f"Ingested {totals['files']} files ({totals['skipped']} skipped, {totals['failed']} failed): "
+          f"{totals['pages']} pages, {totals['vectors']} vectors in {elapsed:.1f}s "
+          f"({totals['pages'] / elapsed:.1f} pages/s, {totals['vectors'] / elapsed:.1f} vectors/s)")
+    cache = get_embedding_cache()
+    if cache:
+        print(f"Embedding cache: {cache.stats()}")
+    if totals["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
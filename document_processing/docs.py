@@ -1,22 +1,21 @@
 import fitz,os
 
 def process_text(file_path):
-    
-    doc = fitz.open(file_path)
-
-    # text_by_page = []
-    text = ""
-
-    for page_num in range(doc.page_count):
-        page = doc.load_page(page_num)
-        # text_by_page.append(page.get_text())
-        text += page.get_text()
+    return "".join(iter_pages(file_path))
 
-    # print(text_by_page[0])
+def iter_pages(file_path):
+    """Yields the text of each page of the PDF in order, holding only one page in memory."""
+    with fitz.open(file_path) as doc:
+        for page_num in range(doc.page_count):
+            yield doc.load_page(page_num).get_text()
 
-    # print(text)
+def get_page_texts(file_path):
+    """Returns the text of every page of the PDF, in page order."""
+    return list(iter_pages(file_path))
 
-    return text
+def get_page_count(file_path):
+    with fitz.open(file_path) as doc:
+        return doc.page_count
 
 def get_pdf_metadata(file_path):
     """Extract the title of a book from its PDF metadata."""
@@ -0,0 +1,196 @@
+"""
+Two-tier embedding cache keyed by (EMBEDDINGS_MODEL, text hash).
+
+Lookups go to an in-process LRU first, then to an on-disk SQLite store shared by all
+workers on the machine. Both tiers store float32 vectors and evict by total bytes,
+least recently used first. Ingestion bypasses the in-process tier (`memory=False`), so
+embedding a large book does not fill every worker's memory with vectors only it needed.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from constants import (DATA_DIR, EMBEDDINGS_MODEL, EMBEDDING_CACHE, EMBEDDING_CACHE_MEMORY_BYTES,
+                       EMBEDDING_CACHE_DISK_BYTES)
+
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embeddings.sqlite3")
+
+
+def cache_key(text: str, model: str = EMBEDDINGS_MODEL) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """Thread-safe LRU of float32 embeddings capped at `max_bytes` of vector data."""
+
+    persistent = False
+
+    def __init__(self, max_bytes: int = EMBEDDING_CACHE_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, list]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return {key: array('f', blob).tolist() for key, blob in found.items()}
+
+    def put_many(self, items: Dict[str, list]):
+        blobs = {key: array('f', vector).tobytes() for key, vector in items.items()}
+        with self._lock:
+            for key, blob in blobs.items():
+                replaced = self._entries.pop(key, None)
+                self._size += len(blob) - (len(replaced) if replaced is not None else 0)
+                self._entries[key] = blob
+            while self._size > self.max_bytes and self._entries:
+                self._size -= len(self._entries.popitem(last=False)[1])
+
+
+class DiskTier:
+    """SQLite store of float32 embeddings capped at `max_bytes` of vector data."""
+
+    persistent = True
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_DISK_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_by_access ON embeddings (accessed)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, list]:
+        found = {}
+        with self._lock, self._conn:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' for _ in batch)})", batch
+                ).fetchall()
+                found.update((key, array('f', blob).tolist()) for key, blob in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET accessed = ? WHERE key = ?", [(now, k) for k in found])
+        return found
+
+    def put_many(self, items: Dict[str, list]):
+        now = time.time()
+        rows = [(key, array('f', vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock, self._conn:
+            # Replaced vectors no longer count towards the cap
+            replaced, keys = 0, list(items)
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings "
+                    f"WHERE key IN ({', '.join('?' for _ in batch)})", batch
+                ).fetchone()[0]
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)", rows)
+            self._size += sum(len(blob) for _, blob, _ in rows) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drops least recently used entries until the store is 10% under its cap."""
+        target = int(self.max_bytes * 0.9)
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY accessed LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self._size <= target:
+                    break
+                evicted.append((key,))
+                self._size -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+
+
+class EmbeddingCache:
+    """Looks embeddings up tier by tier, promoting disk hits into memory, and counts hits and misses."""
+
+    def __init__(self, tiers: list, model: str = EMBEDDINGS_MODEL):
+        self.tiers = tiers
+        self.model = model
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, **{f"{type(t).__name__}_hits": 0 for t in tiers}}
+
+    def _tiers(self, memory: bool) -> list:
+        return self.tiers if memory else [tier for tier in self.tiers if getattr(tier, "persistent", True)]
+
+    def get_many(self, texts: List[str], memory: bool = True) -> List[Optional[list]]:
+        """Cached embeddings of `texts`, None where missing; `memory=False` leaves in-process tiers alone."""
+        keys = [cache_key(text, self.model) for text in texts]
+        found, missing = {}, list(dict.fromkeys(keys))
+        tiers = self._tiers(memory)
+        for depth, tier in enumerate(tiers):
+            if not missing:
+                break
+            hits = tier.get_many(missing)
+            if hits:
+                found.update(hits)
+                missing = [key for key in missing if key not in hits]
+                for upper in tiers[:depth]:
+                    upper.put_many(hits)
+                with self._lock:
+                    self._counters[f"{type(tier).__name__}_hits"] += len(hits)
+
+        results = [found.get(key) for key in keys]
+        with self._lock:
+            self._counters["misses"] += sum(result is None for result in results)
+            self._counters["hits"] += sum(result is not None for result in results)
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[list], memory: bool = True):
+        items = {cache_key(text, self.model): vector for text, vector in zip(texts, vectors)}
+        for tier in self._tiers(memory):
+            tier.put_many(items)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return counters
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def set_embedding_cache(cache: Optional[EmbeddingCache]):
+    """Replaces the process-wide cache, e.g. with custom tiers; None restores the default."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Returns the process-wide cache configured from constants, or None when caching is off."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None and EMBEDDING_CACHE != "off":
+            tiers = [MemoryTier()]
+            try:
+                tiers.append(DiskTier())
+            except sqlite3.Error as e:
+                logging.warning(f"Embedding disk cache unavailable, using memory only: {e}")
+            _default_cache = EmbeddingCache(tiers)
+    return _default_cache
@@ -1,54 +1,181 @@
+import asyncio
+import logging
 import re
-from document_processing.docs import process_text
-from langdetect import detect
-from constants import EMBEDDINGS_MODEL
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from typing import Iterable, Iterator, List
+from document_processing.embedding_cache import get_embedding_cache
+from constants import EMBEDDINGS_MODEL, EMBEDDINGS_BATCH_SIZE, EMBEDDINGS_BATCH_TOKENS, EMBEDDINGS_MAX_RETRIES
+from lib.governor import get_governor
+from lib.metrics import EMBEDDING_TOKENS, timed
+from lib.tokens import estimate_tokens
 
 
 
 
 def get_embeddings(data, openai_client):
     # Generate embeddings
+    return get_embeddings_batch([data], openai_client)[0]
 
-    response = openai_client.embeddings.create(
-        model=EMBEDDINGS_MODEL,
-        input = data,
-    )
-    return response.data[0].embedding
-    # return response
-    # return response
+
+def _token_batches(items: Iterable, batch_size: int, batch_tokens: int, text_of=lambda item: item) -> Iterator[list]:
+    """Groups consecutive items into lists that respect both the count and the token limit."""
+    batch, tokens = [], 0
+    for item in items:
+        item_tokens = estimate_tokens(text_of(item))
+        if batch and (len(batch) >= batch_size or tokens + item_tokens > batch_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += item_tokens
+    if batch:
+        yield batch
+
+
+def _vectors(response) -> List[list]:
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        EMBEDDING_TOKENS.inc(usage.total_tokens, model=EMBEDDINGS_MODEL)
+    # The API may return items out of order; `index` refers to the position in `batch`
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def _embed_with_retry(batch: List[str], openai_client, max_retries: int) -> List[list]:
+    def attempt():
+        with timed("embedding"):
+            return openai_client.embeddings.create(
+                model=EMBEDDINGS_MODEL,
+                input=batch,
+            )
+
+    tokens = sum(estimate_tokens(text) for text in batch)
+    return _vectors(get_governor("openai").call(attempt, tokens=tokens, key="embedding", max_retries=max_retries))
+
+
+async def _embed_with_retry_async(batch: List[str], openai_client, max_retries: int) -> List[list]:
+    async def attempt():
+        with timed("embedding"):
+            return await openai_client.embeddings.create(
+                model=EMBEDDINGS_MODEL,
+                input=batch,
+            )
+
+    tokens = sum(estimate_tokens(text) for text in batch)
+    return _vectors(await get_governor("openai").call_async(attempt, tokens=tokens, key="embedding",
+                                                            max_retries=max_retries))
+
+
+def get_embeddings_batch(texts: List[str], openai_client,
+                         batch_size: int = EMBEDDINGS_BATCH_SIZE,
+                         batch_tokens: int = EMBEDDINGS_BATCH_TOKENS,
+                         max_retries: int = EMBEDDINGS_MAX_RETRIES, cache_in_memory: bool = True) -> List[list]:
+    """
+    Embeds many texts with as few requests as possible.
+
+    Texts found in the embedding cache are not sent; the rest are grouped into requests of
+    at most `batch_size` inputs and roughly `batch_tokens` tokens. Throttled and failed
+    requests are retried up to `max_retries` times by the OpenAI governor (`lib.governor`).
+    The returned embeddings are in the same order as `texts`. `cache_in_memory=False` only
+    uses the on-disk cache tier, for bulk work such as ingestion.
+    """
+    cache = get_embedding_cache()
+    cached = cache.get_many(texts, memory=cache_in_memory) if cache else [None] * len(texts)
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+
+    fetched = {}
+    for batch in _token_batches(missing, batch_size, batch_tokens):
+        vectors = _embed_with_retry(batch, openai_client, max_retries)
+        if cache:
+            cache.put_many(batch, vectors, memory=cache_in_memory)
+        fetched.update(zip(batch, vectors))
+    return [embedding if embedding is not None else fetched[text] for text, embedding in zip(texts, cached)]
+
+
+async def get_embeddings_batch_async(texts: List[str], openai_client,
+                                     batch_size: int = EMBEDDINGS_BATCH_SIZE,
+                                     batch_tokens: int = EMBEDDINGS_BATCH_TOKENS,
+                                     max_retries: int = EMBEDDINGS_MAX_RETRIES) -> List[list]:
+    """
+    Async counterpart of `get_embeddings_batch` for an `AsyncOpenAI` client; requests run concurrently.
+
+    The cache is SQLite-backed, so it is opened and used on a worker thread rather than the event loop.
+    """
+    cache = await asyncio.to_thread(get_embedding_cache)
+    cached = await asyncio.to_thread(cache.get_many, texts) if cache else [None] * len(texts)
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+
+    batches = list(_token_batches(missing, batch_size, batch_tokens))
+    responses = await asyncio.gather(*(_embed_with_retry_async(batch, openai_client, max_retries) for batch in batches))
+    fetched = {}
+    for batch, vectors in zip(batches, responses):
+        fetched.update(zip(batch, vectors))
+    if cache and fetched:
+        await asyncio.to_thread(cache.put_many, list(fetched), list(fetched.values()))
+    return [embedding if embedding is not None else fetched[text] for text, embedding in zip(texts, cached)]
+
+
+def iter_embedded_chunks(chunks: Iterable[dict], openai_client,
+                         batch_size: int = EMBEDDINGS_BATCH_SIZE,
+                         batch_tokens: int = EMBEDDINGS_BATCH_TOKENS,
+                         max_retries: int = EMBEDDINGS_MAX_RETRIES) -> Iterator[List[dict]]:
+    """
+    Embeds a stream of chunk records one request at a time, yielding each batch with `embedding` set.
+
+    Only the on-disk embedding cache is used, so memory stays flat however long the document is.
+    """
+    for batch in _token_batches(chunks, batch_size, batch_tokens, text_of=lambda chunk: chunk['text']):
+        embeddings = get_embeddings_batch([chunk['text'] for chunk in batch], openai_client,
+                                          batch_size, batch_tokens, max_retries, cache_in_memory=False)
+        yield [{**chunk, 'embedding': embedding} for chunk, embedding in zip(batch, embeddings)]
 
     
 def process_chunking_docs(string: str, chunk_size: int = 2000, chunk_overlap: int = 500) -> list:
-    print("""Splits text into chunks for processing.""")    
+    """Splits text into chunks for processing."""
     # print(string)
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     texts = text_splitter.split_text(string)  
     return texts
-    
+
+
+def iter_chunks(pages: Iterable[str], chunk_size: int = 2000, chunk_overlap: int = 500) -> Iterator[dict]:
+    """
+    Splits a stream of page texts into compact chunk records.
+
+    Each record carries only its own text plus where it came from: `chunk_index`,
+    the 1-based `page` it belongs to, and `char_start`/`char_end` offsets into the
+    document text (the concatenation of all pages).
+
+    Chunks never cross a page boundary. Only one page is held in memory, and editing
+    a page changes only that page's chunks, so re-ingestion can skip the rest.
+    """
+    # langchain is slow to import and only needed for ingestion, not by the web apps
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    page_start, chunk_index = 0, 0
+    for page, page_text in enumerate(pages, start=1):
+        for document in text_splitter.create_documents([page_text]):
+            char_start = page_start + document.metadata['start_index']
+            yield {
+                'text': document.page_content,
+                'chunk_index': chunk_index,
+                'page': page,
+                'char_start': char_start,
+                'char_end': char_start + len(document.page_content),
+            }
+            chunk_index += 1
+        page_start += len(page_text)
+
+
+def chunk_pages(page_texts: List[str], chunk_size: int = 2000, chunk_overlap: int = 500) -> List[dict]:
+    return list(iter_chunks(page_texts, chunk_size, chunk_overlap))
+
 
 def generate_embeddings(file_path, openai_client):
-    text = process_text(file_path)
-    if text is None:
-        return "Error processing text"
-    
-    print("Text processed")
-    chunks = process_chunking_docs(text)
-    if len(chunks) == 0:
-        return "No sentences found"
-    print("Sentences split")
+    from document_processing.docs import iter_pages
     embeddings_data = []
-    # print(embeddings(text))
-    for chunk in chunks:
-        response = get_embeddings(chunk, openai_client)
-
-        
-        embeddings_data.append({
-            'text': chunks,
-            'embedding': response
-        })
+    for batch in iter_embedded_chunks(iter_chunks(iter_pages(file_path)), openai_client):
+        embeddings_data.extend(batch)
     
-    print("Embeddings generated")
+    logging.info(f"Generated {len(embeddings_data)} embeddings for {file_path}")
     if len(embeddings_data) == 0:
         return "No embeddings Found"
     return embeddings_data
@@ -0,0 +1,121 @@
+"""
+Local SQLite manifest of what has been ingested: document -> chunk hashes -> vector IDs.
+
+Ingestion diffs a document's fresh chunks against the manifest so only new chunks are
+embedded and upserted, and chunks that disappeared are deleted from the index.
+
+The manifest doubles as the document catalog (subject -> titles -> ordered chunk IDs),
+so listing titles or reading a book back never needs a vector query.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Dict, List, Optional
+from constants import DATA_DIR
+
+MANIFEST_PATH = os.path.join(DATA_DIR, "manifest.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    subject TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (subject, title)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    subject TEXT NOT NULL,
+    title TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    char_start INTEGER NOT NULL,
+    char_end INTEGER NOT NULL,
+    PRIMARY KEY (subject, vector_id)
+);
+CREATE INDEX IF NOT EXISTS chunks_by_document ON chunks (subject, title, chunk_index);
+"""
+
+CHUNK_COLUMNS = ("vector_id", "chunk_hash", "chunk_index", "page", "char_start", "char_end")
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    path = path or MANIFEST_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def content_hash(chunk_hashes: List[str]) -> str:
+    """Version of a document's content: the hash of its chunk hashes in order."""
+    return hashlib.sha256("\n".join(chunk_hashes).encode("utf-8")).hexdigest()
+
+
+def has_document(subject: str, title: str, path: str = None) -> bool:
+    with closing(connect(path)) as conn:
+        row = conn.execute("SELECT 1 FROM documents WHERE subject = ? AND title = ?", (subject, title)).fetchone()
+    return row is not None
+
+
+def document_content_hash(subject: str, title: str, path: str = None) -> Optional[str]:
+    """The content hash recorded for a document, or None if it was never ingested."""
+    with closing(connect(path)) as conn:
+        row = conn.execute("SELECT content_hash FROM documents WHERE subject = ? AND title = ?",
+                           (subject, title)).fetchone()
+    return row["content_hash"] if row else None
+
+
+def load_document_chunks(subject: str, title: str, path: str = None) -> Dict[str, dict]:
+    """Returns the recorded chunks of a document keyed by vector ID."""
+    with closing(connect(path)) as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(CHUNK_COLUMNS)} FROM chunks WHERE subject = ? AND title = ?", (subject, title)
+        ).fetchall()
+    return {row["vector_id"]: dict(row) for row in rows}
+
+
+def list_subjects(path: str = None) -> List[str]:
+    with closing(connect(path)) as conn:
+        rows = conn.execute("SELECT DISTINCT subject FROM documents ORDER BY subject").fetchall()
+    return [row["subject"] for row in rows]
+
+
+def list_titles(subject: str, path: str = None) -> List[str]:
+    with closing(connect(path)) as conn:
+        rows = conn.execute("SELECT title FROM documents WHERE subject = ? ORDER BY title", (subject,)).fetchall()
+    return [row["title"] for row in rows]
+
+
+def document_vector_ids(subject: str, title: str, path: str = None) -> List[str]:
+    """Vector IDs of a document's chunks in document order."""
+    with closing(connect(path)) as conn:
+        rows = conn.execute(
+            "SELECT vector_id FROM chunks WHERE subject = ? AND title = ? ORDER BY chunk_index", (subject, title)
+        ).fetchall()
+    return [row["vector_id"] for row in rows]
+
+
+def save_document(subject: str, title: str, chunks: List[dict], path: str = None) -> str:
+    """Replaces the recorded chunks of a document and returns its new content hash."""
+    digest = content_hash([chunk["chunk_hash"] for chunk in chunks])
+    with closing(connect(path)) as conn, conn:
+        conn.execute("DELETE FROM chunks WHERE subject = ? AND title = ?", (subject, title))
+        conn.executemany(
+            f"INSERT INTO chunks (subject, title, {', '.join(CHUNK_COLUMNS)}) "
+            f"VALUES (?, ?, {', '.join('?' for _ in CHUNK_COLUMNS)})",
+            [(subject, title, *(chunk[column] for column in CHUNK_COLUMNS)) for chunk in chunks],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO documents (subject, title, content_hash, updated_at) VALUES (?, ?, ?, ?)",
+            (subject, title, digest, time.time()),
+        )
+    return digest
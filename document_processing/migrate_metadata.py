@@ -0,0 +1,63 @@
+"""
+Rewrites vectors ingested before compact chunk records into the new metadata format.
+
+Older ingestion stored the document's whole chunk list under `text` on every vector
+(`{title}_{i}`). This replaces it with the vector's own chunk (`text[i]`) and adds
+`chunk_index`. Page and character offsets cannot be recovered without the source PDF;
+re-ingest a document to get them.
+
+Usage: python -m document_processing.migrate_metadata [--namespace history] [--dry-run]
+"""
+import argparse
+import logging
+from config.pinecone import get_index
+from document_processing.pipeline import flush_index, iter_vector_id_pages
+
+FETCH_BATCH_SIZE = 100
+
+
+def compact_metadata(vector_id: str, metadata: dict):
+    """Returns the metadata fields to overwrite for a legacy vector, or None if it is already compact."""
+    text = metadata.get("text")
+    if not isinstance(text, list):
+        return None
+    chunk_index = int(vector_id.rsplit("_", 1)[1])
+    return {"text": text[chunk_index], "chunk_index": chunk_index}
+
+
+def migrate_namespace(namespace: str, dry_run: bool = False) -> int:
+    idx = get_index()
+    migrated = 0
+    for ids in iter_vector_id_pages(idx, namespace):
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            vectors = idx.fetch(ids=ids[start:start + FETCH_BATCH_SIZE], namespace=namespace).vectors
+            for vector_id, vector in vectors.items():
+                try:
+                    update = compact_metadata(vector_id, vector.metadata or {})
+                except (ValueError, IndexError) as e:
+                    logging.error(f"Cannot migrate '{vector_id}' in '{namespace}': {e}")
+                    continue
+                if update is None:
+                    continue
+                if not dry_run:
+                    idx.update(id=vector_id, set_metadata=update, namespace=namespace)
+                migrated += 1
+    flush_index(idx)
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--namespace", action="append", help="Subject namespace to migrate (default: all)")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the vectors that would be rewritten")
+    args = parser.parse_args()
+
+    namespaces = args.namespace or list(get_index().describe_index_stats().get("namespaces", {}).keys())
+    for namespace in namespaces:
+        migrated = migrate_namespace(namespace, dry_run=args.dry_run)
+        action = "would be rewritten" if args.dry_run else "rewritten"
+        print(f"{namespace}: {migrated} vectors {action}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Streaming ingestion: page -> chunk -> embedding batch -> upsert batch.
+
+Every stage is a generator, so at most a handful of pages, chunks and vectors are
+alive at any time regardless of document size. Embedding runs one stage ahead of
+upserting in a background thread through a bounded queue; when upserts fall behind
+the queue fills up and the embedding stage blocks (backpressure).
+
+Chunks are identified by the hash of their text. Chunks already recorded in the
+manifest are not embedded again, and recorded chunks that no longer appear in the
+document are deleted from the index.
+"""
+import logging
+import queue
+import re
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+from document_processing.docs import iter_pages, get_page_count, get_pdf_metadata, get_file_extension, get_file_name
+from document_processing.index_utils import iter_chunks, iter_embedded_chunks
+from document_processing import manifest
+from db_queries.lexical_index import LexicalIndex, get_lexical_index
+
+UPSERT_BATCH_SIZE = 100
+LEXICAL_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 1000
+PREFETCH_BATCHES = 2
+
+CHUNK_POSITION_KEYS = ("chunk_index", "page", "char_start", "char_end")
+CHUNK_METADATA_KEYS = ("text",) + CHUNK_POSITION_KEYS
+
+_DONE = object()
+
+
+def chunk_metadata(item):
+    """Returns the per-vector metadata of a chunk record."""
+    return {key: item[key] for key in CHUNK_METADATA_KEYS}
+
+
+def document_metadata(file_path, subject: str) -> dict:
+    """Document-level metadata stored on every vector of the PDF."""
+    file_metadata = get_pdf_metadata(file_path)
+    extension = get_file_extension(file_path)
+    title = file_metadata.get('title') or get_file_name(file_path)
+
+    return {
+        "title": title,
+        "subject": subject,
+        "format": extension,
+        "type": extension, 
+        "difficulty": "unknown",  
+        "extension": extension
+    }
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(items: Iterable, maxsize: int = PREFETCH_BATCHES) -> Iterator:
+    """
+    Consumes `items` in a background thread, keeping at most `maxsize` results buffered.
+
+    Exceptions raised by the producer are re-raised in the consumer. If the consumer
+    stops early, the producer is told to stop at its next item.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        buffer.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put((_DONE, None))
+        except BaseException as e:
+            buffer.put((_DONE, e))
+
+    producer = threading.Thread(target=produce, name="ingest-prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_vector_id_pages(index, namespace: str, prefix: str = None) -> Iterator[list]:
+    """Yields pages of vector IDs stored in the namespace, optionally restricted to an ID prefix."""
+    kwargs = {"namespace": namespace} if prefix is None else {"namespace": namespace, "prefix": prefix}
+    for page in index.list(**kwargs):
+        # Depending on the SDK version a page is either a list of IDs or a ListResponse
+        if hasattr(page, "vectors"):
+            yield [item.id for item in page.vectors]
+        else:
+            yield list(page)
+
+
+def legacy_vector_ids(index, namespace: str, title: str) -> list:
+    """IDs of vectors written before content hashing, which used the form `{title}_{chunk_index}`."""
+    pattern = re.compile(rf"{re.escape(title)}_\d+")
+    try:
+        return [vector_id for ids in iter_vector_id_pages(index, namespace, prefix=f"{title}_")
+                for vector_id in ids if pattern.fullmatch(vector_id)]
+    except Exception as e:
+        logging.warning(f"Could not list legacy vectors of '{title}' in '{namespace}': {e}")
+        return []
+
+
+def print_progress(stats: dict):
+    rate = stats["vectors"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    print(f"[{stats['title']}] page {stats['page']}/{stats['pages']}, "
+          f"{stats['vectors']} vectors upserted ({rate:.1f}/s)")
+
+
+def flush_index(index):
+    """Persists an index that buffers writes (`LocalIndex`); remote indexes have nothing to flush."""
+    flush = getattr(index, "flush", None)
+    if flush is not None:
+        flush()
+
+
+def upsert_chunks(chunks: Iterable[dict], openai_client, index, namespace: str, metadata: dict,
+                  pages: int = 0, progress: Optional[Callable[[dict], None]] = print_progress,
+                  upsert_batch_size: int = UPSERT_BATCH_SIZE) -> dict:
+    """
+    Embeds a stream of chunk records (each with a `vector_id`) and upserts them, returning the final stats.
+
+    `progress` is called with the running stats after every upsert batch.
+    """
+    start = time.perf_counter()
+    stats = {"title": metadata.get("title"), "page": 0, "pages": pages,
+             "chunks": 0, "vectors": 0, "elapsed": 0.0}
+
+    embedded = (chunk for batch in prefetch(iter_embedded_chunks(chunks, openai_client)) for chunk in batch)
+    for batch in iter_batches(embedded, upsert_batch_size):
+        vectors = [
+            (item['vector_id'], item['embedding'], {**metadata, **chunk_metadata(item)})
+            for item in batch
+        ]
+        index.upsert(vectors=vectors, namespace=namespace)
+
+        stats["chunks"] += len(batch)
+        stats["vectors"] += len(vectors)
+        stats["page"] = batch[-1]["page"]
+        stats["elapsed"] = time.perf_counter() - start
+        logging.info(f"Upserted {stats['vectors']} vectors for '{stats['title']}' into '{namespace}'")
+        if progress:
+            progress(stats)
+
+    stats["page"] = stats["pages"]
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+
+def sync_document(chunks: Iterable[dict], openai_client, index, namespace: str, metadata: dict,
+                  pages: int = 0, progress: Optional[Callable[[dict], None]] = print_progress,
+                  upsert_batch_size: int = UPSERT_BATCH_SIZE, manifest_path: str = None,
+                  lexical: LexicalIndex = None) -> dict:
+    """
+    Brings the index in line with a document's current chunks, embedding only what changed.
+
+    New chunks are embedded and upserted, recorded chunks whose position changed get a
+    metadata update, and recorded chunks missing from the document are deleted. The
+    manifest is only rewritten once the index is up to date, so an interrupted run is
+    simply redone. Returns the upsert stats plus `unchanged`, `moved` and `deleted` counts.
+
+    New chunks' texts are also written to the lexical (BM25) index, which then drops the
+    document's other chunks; unchanged and moved chunks keep their entries.
+    """
+    lexical = lexical or get_lexical_index()
+    title = metadata["title"]
+    start = time.perf_counter()
+    recorded = manifest.load_document_chunks(namespace, title, manifest_path)
+    first_ingest = not recorded and not manifest.has_document(namespace, title, manifest_path)
+    current, moved, occurrences = [], [], {}
+
+    def identified_chunks():
+        for chunk in chunks:
+            digest = manifest.chunk_hash(chunk["text"])
+            # Identical chunks within one document get distinct IDs
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            vector_id = f"{title}:{digest[:16]}" + (f":{occurrence}" if occurrence else "")
+            yield {**chunk, "vector_id": vector_id, "chunk_hash": digest}
+
+    def changed_chunks():
+        for batch in iter_batches(identified_chunks(), LEXICAL_BATCH_SIZE):
+            new = []
+            for chunk in batch:
+                current.append({key: chunk[key] for key in manifest.CHUNK_COLUMNS})
+
+                previous = recorded.get(chunk["vector_id"])
+                if previous is None:
+                    new.append(chunk)
+                elif any(previous[key] != chunk[key] for key in CHUNK_POSITION_KEYS):
+                    moved.append(chunk)
+            if new:
+                lexical.add(namespace, title, [(chunk["vector_id"], chunk["text"]) for chunk in new])
+            yield from new
+
+    stats = upsert_chunks(changed_chunks(), openai_client, index, namespace, metadata,
+                          pages=pages, progress=progress, upsert_batch_size=upsert_batch_size)
+
+    for chunk in moved:
+        index.update(id=chunk["vector_id"], set_metadata={key: chunk[key] for key in CHUNK_POSITION_KEYS},
+                     namespace=namespace)
+
+    current_ids = {chunk["vector_id"] for chunk in current}
+    stale = [vector_id for vector_id in recorded if vector_id not in current_ids]
+    if first_ingest:
+        stale.extend(legacy_vector_ids(index, namespace, title))
+    for batch in iter_batches(stale, DELETE_BATCH_SIZE):
+        index.delete(ids=batch, namespace=namespace)
+    flush_index(index)
+
+    manifest.save_document(namespace, title, current, manifest_path)
+    lexical.prune(namespace, title, current_ids)
+
+    stats.update({"chunks": len(current), "unchanged": len(current) - stats["vectors"] - len(moved),
+                  "moved": len(moved), "deleted": len(stale), "elapsed": time.perf_counter() - start})
+    return stats
+
+
+def ingest_pdf(file_path, openai_client, index, namespace: str, metadata: dict,
+               progress: Optional[Callable[[dict], None]] = print_progress,
+               upsert_batch_size: int = UPSERT_BATCH_SIZE, manifest_path: str = None) -> dict:
+    """Streams a PDF into the vector index, re-embedding only changed chunks, and returns the final stats."""
+    return sync_document(iter_chunks(iter_pages(file_path)), openai_client, index, namespace, metadata,
+                         pages=get_page_count(file_path), progress=progress,
+                         upsert_batch_size=upsert_batch_size, manifest_path=manifest_path)
@@ -0,0 +1,84 @@
+"""
+Records documents ingested before the manifest existed in the document catalog.
+
+Titles and chunk order are read back from the vectors' metadata. Documents already in the
+catalog are left alone. Every chunk's text is also (re)written to the lexical index used by
+hybrid retrieval. Run `migrate_metadata` first on namespaces that still store whole chunk
+lists on every vector.
+
+Usage: python -m document_processing.rebuild_catalog [--namespace history]
+"""
+import argparse
+import logging
+from collections import defaultdict
+from config.pinecone import get_index
+from db_queries.lexical_index import get_lexical_index
+from document_processing import manifest
+from document_processing.pipeline import iter_vector_id_pages
+
+FETCH_BATCH_SIZE = 100
+
+
+def catalog_record(vector_id: str, metadata: dict):
+    """Returns the manifest chunk record of a stored vector, or None if its metadata is not compact."""
+    text = metadata.get("text")
+    if not isinstance(text, str):
+        return None
+    chunk_index = metadata.get("chunk_index")
+    if chunk_index is None:
+        chunk_index = int(vector_id.rsplit("_", 1)[1])
+    return {
+        "vector_id": vector_id,
+        "chunk_hash": manifest.chunk_hash(text),
+        "chunk_index": int(chunk_index),
+        "page": int(metadata.get("page", 0)),
+        "char_start": int(metadata.get("char_start", 0)),
+        "char_end": int(metadata.get("char_end", 0)),
+    }
+
+
+def rebuild_namespace(namespace: str) -> int:
+    idx = get_index()
+    lexical = get_lexical_index()
+    documents = defaultdict(list)
+    for ids in iter_vector_id_pages(idx, namespace):
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            vectors = idx.fetch(ids=ids[start:start + FETCH_BATCH_SIZE], namespace=namespace).vectors
+            texts = defaultdict(list)
+            for vector_id, vector in vectors.items():
+                metadata = vector.metadata or {}
+                try:
+                    record = catalog_record(vector_id, metadata)
+                except (ValueError, IndexError) as e:
+                    logging.error(f"Cannot catalog '{vector_id}' in '{namespace}': {e}")
+                    continue
+                if record is None:
+                    logging.error(f"Skipping '{vector_id}' in '{namespace}': run migrate_metadata first")
+                    continue
+                title = metadata.get("title", "Unknown Title")
+                documents[title].append(record)
+                texts[title].append((vector_id, metadata["text"]))
+            for title, chunks in texts.items():
+                lexical.add(namespace, title, chunks)
+
+    recorded = 0
+    for title, chunks in documents.items():
+        if manifest.has_document(namespace, title):
+            continue
+        manifest.save_document(namespace, title, sorted(chunks, key=lambda chunk: chunk["chunk_index"]))
+        recorded += 1
+    return recorded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--namespace", action="append", help="Subject namespace to catalog (default: all)")
+    args = parser.parse_args()
+
+    namespaces = args.namespace or list(get_index().describe_index_stats().get("namespaces", {}).keys())
+    for namespace in namespaces:
+        print(f"{namespace}: {rebuild_namespace(namespace)} documents added to the catalog")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,34 @@
 
 import logging
-from document_processing.docs import get_pdf_metadata, get_file_extension, get_file_name
-from index_utils import generate_embeddings
+from document_processing.pipeline import document_metadata, ingest_pdf, print_progress
 from dotenv import load_dotenv
-from config.pinecone import idx
+from config.pinecone import get_index
 load_dotenv()
 
 
-def store_pdf_in_pinecone(file_path, client,subject):
+def store_pdf_in_pinecone(file_path, client,subject, progress=print_progress, build_topics=False):
     try:
-        file_metadata = get_pdf_metadata(file_path)
-        extension = get_file_extension(file_path)
-        title = file_metadata.get('title') or get_file_name(file_path)
-
-        metadata = {
-            "title": title,
-            "subject": subject,
-            "format": extension,
-            "type": extension, 
-            "difficulty": "unknown",  
-            "extension": extension
-        }
-
-        # Generate embeddings (Extracted text included)
-        embeddings_data = generate_embeddings(file_path=file_path, openai_client=client)
-
-        if not embeddings_data:
+        metadata = document_metadata(file_path, subject)
+        title = metadata["title"]
+
+        # Stream pages -> chunks -> embeddings -> upserts (with namespace as Subject)
+        # Only chunks that changed since the last ingestion are embedded
+        stats = ingest_pdf(file_path, client, get_index(), namespace=subject, metadata=metadata, progress=progress)
+
+        if stats["chunks"] == 0:
             logging.error("No embeddings to insert into Pinecone")
             return
 
-        # Prepare data for Pinecone
-        vectors = [
-            (f"{title}_{i}", item['embedding'], {**metadata, "text": item['text']})  # ✅ Include text chunk
-            for i, item in enumerate(embeddings_data)
-        ]
-        # print(vectors)
-
-        # Upsert into Pinecone (with namespace as Subject)
-        idx.upsert(vectors=vectors, namespace=subject)
-        
-        print(f"Material '{title}' inserted successfully into Pinecone under '{subject}' namespace.")
+        logging.info(f"Material '{title}' inserted successfully into Pinecone under '{subject}' namespace "
+                     f"({stats['vectors']} new, {stats['moved']} moved, {stats['unchanged']} unchanged, {stats['deleted']} deleted).")
 
-        logging.info(f"Material '{title}' inserted successfully into Pinecone under '{subject}' namespace.")
+        if build_topics:
+            # Pre-compute the topic index so the first /generate/questions request is fast
+            from lib.topic_index import build_topic_index
+            build_topic_index(subject, title)
+        return stats
 
     except Exception as e:
-        logging.error(f"Error storing PDF in Pinecone: {e}")
\ No newline at end of file
+        # Upstream calls were already retried by the governor; the caller (e.g. the job) reports the failure
+        logging.error(f"Error storing PDF in Pinecone: {e}")
+        raise
\ No newline at end of file
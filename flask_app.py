@@ -1,17 +1,41 @@
-from flask import Flask, request, jsonify
+import math
+import time
+from flask import Flask, Response, g, request, jsonify
 from flask_restx import Api, Resource, fields
 from flask_cors import CORS
 
 # Import custom modules
 from lib.grammar_check import grammar_check
-from lib.check_answer import validate_answer
-from lib.generate_questions import generate, extract_all_topics, generate_questions
-from config.openai import client
+from lib.check_answer import validate_answer, validate_answers
+from lib.question_pipeline import GenerationRequestError, generate_for_book
+from config.openai import get_client
+from lib.jobs import get_job_queue
+from lib.job_kinds import UploadError, save_upload
+from lib.governor import UpstreamError
+from lib import metrics
+from constants import ANSWER_BATCH_MAX_ITEMS
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_start, method=request.method, route=route,
+                                     status=response.status_code)
+    return response
+
+@app.route("/metrics")
+def get_metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # Enable Swagger UI at /docs
 api = Api(
     app,
@@ -20,10 +44,22 @@ api = Api(
     doc="/docs"
 )
 
+# An overloaded or failing upstream API is reported as 429/503 with Retry-After, so clients back off
+def _error_response(e: Exception):
+    if isinstance(e, UpstreamError):
+        headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else {}
+        return {"error": str(e)}, e.status_code, headers
+    return {"error": str(e)}, 500
+
+@api.errorhandler(UpstreamError)
+def upstream_error(e):
+    return _error_response(e)
+
 # Define API namespaces
 grammar_ns = api.namespace("grammar", description="Grammar Checking API")
 answer_ns = api.namespace("answer", description="Answer Validation API")
 generation_ns = api.namespace("generate", description="Question Generation API")
+jobs_ns = api.namespace("jobs", description="Background Jobs API")
 
 # Define request/response models
 grammar_model = api.model("GrammarCheckRequest", {"text": fields.String(required=True, description="Text to check for grammar issues")})
@@ -46,15 +82,26 @@ answer_response_model = api.model("AnswerValidationResponse", {
     "incorrect_facts": fields.List(fields.Nested(incorrect_fact_model), description="List of incorrect facts found")
 })
 
+answer_batch_model = api.model("AnswerBatchRequest", {
+    "items": fields.List(fields.Nested(answer_model), required=True, description="Answers to validate")
+})
+
+answer_batch_response_model = api.model("AnswerBatchResponse", {
+    "results": fields.List(fields.Raw, description="One validation result, or an error, per item in order")
+})
+
 generation_request_model = api.model("GenerationRequest", {
     "book": fields.String(required=True, description="Book or text title"),
     "subject": fields.String(required=True, description="Subject area"),
     "num_questions": fields.Integer(required=False, default=5, description="Number of questions to generate"),
-    "type": fields.String(required=False, default="text_based", description="Type of questions to generate")
+    "type": fields.String(required=False, default="text_based", description="Type of questions to generate"),
+    "topic": fields.String(required=False, description="Main topic to ask about (default: the book's first topic)"),
+    "subtopic": fields.String(required=False, description="Subtopic to ask about (default: the topic's first subtopic)")
 })
 
 generation_response_model = api.model("GenerationResponse", {
-    "questions": fields.List(fields.String, description="List of generated questions")
+    "questions": fields.List(fields.Raw, description="List of generated questions"),
+    "topics": fields.List(fields.Raw, description="Topics the questions were spread over, with their question counts")
 })
 
 # API Endpoints
@@ -63,68 +110,121 @@ class GrammarCheckResource(Resource):
     @api.expect(grammar_model)
     @api.response(200, "Success", grammar_response_model)
     @api.response(400, "Bad Request")
+    @api.response(429, "Upstream API busy")
     @api.response(500, "Internal Server Error")
+    @api.response(503, "Upstream API unavailable")
     def post(self):
         data = request.get_json()
         if not data or "text" not in data:
             return {"error": "No text provided"}, 400
         try:
             results = grammar_check(data["text"])
-            return {"results": [r.dict() for r in results]}, 200
+            with metrics.timed("serialization"):
+                return {"results": [r.model_dump() for r in results]}, 200
         except Exception as e:
-            return {"error": str(e)}, 500
+            return _error_response(e)
 
 @answer_ns.route("/analyze")
 class AnswerValidationResource(Resource):
     @api.expect(answer_model)
     @api.response(200, "Success", answer_response_model)
     @api.response(400, "Bad Request")
+    @api.response(429, "Upstream API busy")
     @api.response(500, "Internal Server Error")
+    @api.response(503, "Upstream API unavailable")
     def post(self):
         data = request.get_json()
         if not all(k in data for k in ("question", "user_answer", "subject")):
             return {"error": "Missing required fields"}, 400
         try:
-            return validate_answer(data["question"], data["user_answer"], data["subject"], client), 200
+            return validate_answer(data["question"], data["user_answer"], data["subject"], get_client()), 200
+        except Exception as e:
+            return _error_response(e)
+
+@answer_ns.route("/analyze/batch")
+class AnswerBatchValidationResource(Resource):
+    @api.expect(answer_batch_model)
+    @api.response(200, "Success", answer_batch_response_model)
+    @api.response(400, "Bad Request")
+    @api.response(429, "Upstream API busy")
+    @api.response(500, "Internal Server Error")
+    @api.response(503, "Upstream API unavailable")
+    def post(self):
+        data = request.get_json()
+        items = (data or {}).get("items")
+        if not isinstance(items, list) or not all(
+                isinstance(item, dict) and all(k in item for k in ("question", "user_answer", "subject")) for item in items):
+            return {"error": "Missing required fields"}, 400
+        if len(items) > ANSWER_BATCH_MAX_ITEMS:
+            return {"error": f"At most {ANSWER_BATCH_MAX_ITEMS} items per batch."}, 400
+        try:
+            return {"results": validate_answers(items, get_client())}, 200
         except Exception as e:
-            return {"error": str(e)}, 500
+            return _error_response(e)
 
 @generation_ns.route("/questions")
 class QuestionGenerationResource(Resource):
     @api.expect(generation_request_model)
     @api.response(200, "Success", generation_response_model)
     @api.response(400, "Bad Request")
+    @api.response(429, "Upstream API busy")
     @api.response(500, "Internal Server Error")
+    @api.response(503, "Upstream API unavailable")
     def post(self):
         data = request.get_json()
-        book, subject = data.get("book"), data.get("subject")
-        question_type, num_questions = data.get("type", "text_based"), data.get("num_questions", 5)
-        
-        results = generate(book=book, subject=subject)
-        if not results:
-            return {"error": "No text generated."}, 400
-        
-        topics = extract_all_topics(results)
-        combined_texts = "\n".join("\n".join(res["text"]) for res in results)
-        main_topics = [sub.topic for sub in topics.main_topics]
-        
-        if len(main_topics) < 2:
-            return {"error": "Not enough topics extracted."}, 400
-        
-        questions_response = generate_questions(
-            main_topic=main_topics[0],
-            subtopic=main_topics[1],
-            context=combined_texts,
-            question_type=question_type,
-            num_questions=num_questions
-        )
-        
-        return {"questions": [q.dict() if hasattr(q, "dict") else str(q) for q in questions_response.questions]}, 200
+        try:
+            return generate_for_book(data.get("subject"), data.get("book"), data.get("num_questions", 5),
+                                     data.get("type", "text_based"), data.get("topic"), data.get("subtopic"),
+                                     client=get_client()), 200
+        except GenerationRequestError as e:
+            return {"error": str(e)}, 400
+        except Exception as e:
+            return _error_response(e)
+
+@jobs_ns.route("/generate/questions")
+class GenerationJobResource(Resource):
+    @api.expect(generation_request_model)
+    @api.response(202, "Job submitted")
+    @api.response(400, "Bad Request")
+    def post(self):
+        data = request.get_json()
+        if not data or not all(k in data for k in ("book", "subject")):
+            return {"error": "Missing required fields"}, 400
+        params = {"book": data["book"], "subject": data["subject"],
+                  "num_questions": data.get("num_questions", 5), "type": data.get("type", "text_based"),
+                  "topic": data.get("topic"), "subtopic": data.get("subtopic")}
+        return get_job_queue().submit("generate_questions", params), 202
+
+@jobs_ns.route("/ingest")
+class IngestJobResource(Resource):
+    @api.response(202, "Job submitted")
+    @api.response(400, "Bad Request")
+    def post(self):
+        upload, subject = request.files.get("file"), request.form.get("subject")
+        if upload is None or not subject:
+            return {"error": "A PDF 'file' and a 'subject' are required"}, 400
+        try:
+            path = save_upload(upload.stream, upload.filename)
+        except UploadError as e:
+            return {"error": str(e)}, 400
+        build_topics = request.form.get("build_topics", "false").lower() in ("1", "true", "yes")
+        return get_job_queue().submit("ingest", {"path": path, "subject": subject, "build_topics": build_topics}), 202
+
+@jobs_ns.route("/<string:job_id>")
+class JobResource(Resource):
+    @api.response(200, "Success")
+    @api.response(404, "Job not found")
+    def get(self, job_id):
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return {"error": "Job not found."}, 404
+        return job, 200
 
 # Register Namespaces
 api.add_namespace(grammar_ns)
 api.add_namespace(answer_ns)
 api.add_namespace(generation_ns)
+api.add_namespace(jobs_ns)
 
 if __name__ == "__main__":
     app.run(debug=True)
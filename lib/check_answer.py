@@ -1,38 +1,39 @@
-from db_queries.queries import search_similar_materials
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from constants import ANSWER_BATCH_MAX_WORKERS
+from db_queries.queries import (search_similar_materials, search_similar_materials_async,
+                                search_similar_materials_batch, search_similar_materials_batch_async)
+from db_queries.retrieval import context_text
+from lib.governor import UpstreamError
+from lib.llm import parse, parse_async
 from models.schema_models import AnswerValidation
 
+NO_CONTEXT = {"error": "No relevant context found for validation."}
 
-def validate_answer(question: str, user_answer: str, subject: str, client) -> dict:
-    # Retrieve context from Pinecone
-    context = search_similar_materials(question, client, subject)
-
-    if not context:
-        return {"error": "No relevant context found for validation."}
 
-    # Call OpenAI GPT-4o for validation, ensuring the response is automatically parsed as AnswerValidation
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "Validate the user's answer based on the given context. "
-                    "For each incorrect fact, correct it in the format: "
-                    "'Statement: {corrected_fact}. Explanation: {correct information with reason}'. "
-                    "Provide a score between 0 and 1."
-                )
-            },
-            {
-                "role": "user",
-                "content": f"Question: {question}\nUser Answer: {user_answer}\nContext: {context}\n\nValidate the user's answer."
-            }
-        ],
-        response_format=AnswerValidation  # This tells the client to parse the output accordingly
-    )
+def _validation_messages(question: str, user_answer: str, context: List[dict]) -> list:
+    # Only titles and texts go into the prompt, not the retrieval scores
+    context = context_text(context)
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Validate the user's answer based on the given context. "
+                "For each incorrect fact, correct it in the format: "
+                "'Statement: {corrected_fact}. Explanation: {correct information with reason}'. "
+                "Provide a score between 0 and 1."
+            )
+        },
+        {
+            "role": "user",
+            "content": f"Question: {question}\nUser Answer: {user_answer}\nContext:\n{context}\n\nValidate the user's answer."
+        }
+    ]
 
-    # Access the parsed response directly
-    answer_validation = completion.choices[0].message.parsed
 
+def _validation_result(answer_validation: AnswerValidation) -> dict:
     # Convert to dictionary format for Flask
     return {
         "is_correct": answer_validation.is_correct,
@@ -44,3 +45,123 @@ def validate_answer(question: str, user_answer: str, subject: str, client) -> di
             } for fact in answer_validation.incorrect_facts
         ]
     }
+
+
+def validate_answer(question: str, user_answer: str, subject: str, client) -> dict:
+    # Retrieve context from Pinecone
+    context = search_similar_materials(question, client, subject)
+
+    if not context:
+        return dict(NO_CONTEXT)
+
+    # Call OpenAI GPT-4o for validation, ensuring the response is automatically parsed as AnswerValidation
+    answer_validation = parse(_validation_messages(question, user_answer, context), AnswerValidation,
+                              openai_client=client, endpoint="answer")
+    return _validation_result(answer_validation)
+
+
+async def validate_answer_async(question: str, user_answer: str, subject: str, client=None) -> dict:
+    """Async counterpart of `validate_answer`; `client` is an AsyncOpenAI client (defaults to the shared one)."""
+    context = await search_similar_materials_async(question, subject, client=client)
+
+    if not context:
+        return dict(NO_CONTEXT)
+
+    answer_validation = await parse_async(_validation_messages(question, user_answer, context), AnswerValidation,
+                                          openai_client=client, endpoint="answer")
+    return _validation_result(answer_validation)
+
+
+def _unique(items: List[dict]) -> Tuple[Dict[str, List[str]], List[Tuple[str, str, str]]]:
+    """Unique questions per subject, and unique (subject, question, answer) triples, in first-seen order."""
+    questions, answers = {}, {}
+    for item in items:
+        subject_questions = questions.setdefault(item["subject"], [])
+        if item["question"] not in subject_questions:
+            subject_questions.append(item["question"])
+        answers.setdefault((item["subject"], item["question"], item["user_answer"]), None)
+    return questions, list(answers)
+
+
+def _item_error(key: Tuple[str, str, str], e: Exception) -> dict:
+    logging.error(f"Answer validation failed for question {key[1]!r}: {e}")
+    return {"error": str(e)}
+
+
+def _search_failed(questions: List[str], e: BaseException) -> list:
+    """Per-question context of a subject whose retrieval failed: the error, reported on each of its items."""
+    if isinstance(e, UpstreamError) or not isinstance(e, Exception):
+        raise e
+    logging.error(f"Context retrieval failed for {len(questions)} questions: {e}")
+    return [e] * len(questions)
+
+
+def validate_answers(items: List[dict], client, max_workers: int = ANSWER_BATCH_MAX_WORKERS) -> List[dict]:
+    """
+    Validates many answers at once, returning one result per item in order.
+
+    Each item has `question`, `user_answer` and `subject`. Context is retrieved once per
+    distinct question, identical answers to the same question are validated once, and
+    the validations run on up to `max_workers` threads. A failed item gets an `error`
+    result instead of failing the whole batch, while a throttled or unavailable upstream
+    (`UpstreamError`) fails the batch so it can be retried as a whole.
+    """
+    questions, answers = _unique(items)
+    contexts = {}
+    for subject, subject_questions in questions.items():
+        try:
+            matches = search_similar_materials_batch(subject_questions, client, subject, max_workers=max_workers)
+        except Exception as e:
+            matches = _search_failed(subject_questions, e)
+        contexts.update(((subject, question), context) for question, context in zip(subject_questions, matches))
+
+    def validate(key):
+        subject, question, user_answer = key
+        context = contexts[(subject, question)]
+        if isinstance(context, Exception):
+            return _item_error(key, context)
+        if not context:
+            return dict(NO_CONTEXT)
+        try:
+            return _validation_result(parse(_validation_messages(question, user_answer, context), AnswerValidation,
+                                            openai_client=client, endpoint="answer"))
+        except Exception as e:
+            return _item_error(key, e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(answers)))) as executor:
+        results = dict(zip(answers, executor.map(validate, answers)))
+    return [results[(item["subject"], item["question"], item["user_answer"])] for item in items]
+
+
+async def validate_answers_async(items: List[dict], max_concurrency: int = ANSWER_BATCH_MAX_WORKERS,
+                                 client=None) -> List[dict]:
+    """Async counterpart of `validate_answers`; at most `max_concurrency` validations are in flight."""
+    questions, answers = _unique(items)
+    contexts = {}
+    subjects = list(questions)
+    for subject, matches in zip(subjects, await asyncio.gather(*(
+            search_similar_materials_batch_async(questions[subject], subject, client=client) for subject in subjects),
+            return_exceptions=True)):
+        if isinstance(matches, BaseException):
+            matches = _search_failed(questions[subject], matches)
+        contexts.update(((subject, question), context) for question, context in zip(questions[subject], matches))
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def validate(key):
+        subject, question, user_answer = key
+        context = contexts[(subject, question)]
+        if isinstance(context, Exception):
+            return _item_error(key, context)
+        if not context:
+            return dict(NO_CONTEXT)
+        try:
+            async with semaphore:
+                parsed = await parse_async(_validation_messages(question, user_answer, context), AnswerValidation,
+                                           openai_client=client, endpoint="answer")
+            return _validation_result(parsed)
+        except Exception as e:
+            return _item_error(key, e)
+
+    results = dict(zip(answers, await asyncio.gather(*(validate(key) for key in answers))))
+    return [results[(item["subject"], item["question"], item["user_answer"])] for item in items]
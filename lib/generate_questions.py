@@ -1,13 +1,41 @@
-from config.openai import client
-from models.schema_models import TopicExtractionResponse,QuestionGenerationResponse
-from config.pinecone import idx
-from typing import List
-from constants import QuestionType
+import asyncio
+import logging
+import threading
+from config.openai import get_client
+from config.pinecone import get_index, index_call
+from db_queries.queries import search_book_chunks, search_book_chunks_async
+from document_processing.manifest import document_vector_ids
+from lib.llm import parse, parse_async, stream_list_async
+from lib.metrics import timed
+from lib.tokens import pack_texts
+from models.schema_models import TopicExtractionResponse,QuestionGenerationResponse, Question
+from typing import AsyncIterator, List
+from constants import QuestionType, TOPIC_CONTEXT_TOKENS, GENERATION_CONTEXT_TOKENS, GENERATION_CONTEXT_CHUNKS
 
+FETCH_BATCH_SIZE = 100
 
-def extract_all_topics(results: List[dict]) -> TopicExtractionResponse:
-    """Extracts main topics and subtopics from all search results."""
-    combined_texts = "\n".join(["\n".join(res["text"]) for res in results])
+
+def _spread_order(n: int) -> List[int]:
+    """0..n-1 ordered so that every prefix is spread evenly over the range (0, n/2, n/4, 3n/4, ...)."""
+    order, seen, step = [], set(), n
+    while len(order) < n:
+        for i in range(0, n, max(step, 1)):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+        step //= 2
+    return order
+
+
+def topic_context(results: List[dict], budget: int = TOPIC_CONTEXT_TOKENS) -> str:
+    """Chunks sampled evenly across the whole book, in document order, within `budget` tokens."""
+    order = _spread_order(len(results))
+    selected = sorted(order[i] for i in pack_texts([results[i]["text"] for i in order], budget))
+    return "\n".join(results[i]["text"] for i in selected)
+
+
+def _topic_messages(results: List[dict]) -> List[dict]:
+    combined_texts = topic_context(results)
     
     prompt = f"""
     Extract main topics and subtopics from the following text:
@@ -18,22 +46,29 @@ def extract_all_topics(results: List[dict]) -> TopicExtractionResponse:
     Provide output in JSON format: {"{"}main_topics": [{{"topic": "...", "subtopics": ["...", "..."]}}]. 
     """
     
-    response = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "system", "content": "Extract structured topics from documents."},
-            {"role": "user", "content": prompt}
-        ],
-        response_format=TopicExtractionResponse,
-    )
-    
-    return response.choices[0].message.parsed
+    return [
+        {"role": "system", "content": "Extract structured topics from documents."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _has_topics(response: TopicExtractionResponse) -> bool:
+    return bool(response.main_topics) and all(topic.topic.strip() for topic in response.main_topics)
+
+
+def extract_all_topics(results: List[dict]) -> TopicExtractionResponse:
+    """Extracts main topics and subtopics from all search results."""
+    return parse(_topic_messages(results), TopicExtractionResponse, endpoint="topics", accept=_has_topics)
+
+
+async def extract_all_topics_async(results: List[dict]) -> TopicExtractionResponse:
+    return await parse_async(_topic_messages(results), TopicExtractionResponse, endpoint="topics",
+                             accept=_has_topics)
 
 # Define allowed question types
 
 
-def generate_questions(main_topic: str, subtopic: str, context: str, question_type: QuestionType, num_questions: int = 5) -> QuestionGenerationResponse:
-    """Generates questions of a specified type based on a selected topic, subtopic, and context."""
+def _question_messages(main_topic: str, subtopic: str, context: str, question_type: QuestionType, num_questions: int) -> List[dict]:
     prompt = f"""
     Generate {num_questions} {question_type} questions based on the following information:
     
@@ -52,37 +87,118 @@ def generate_questions(main_topic: str, subtopic: str, context: str, question_ty
      
     """
     
-    response = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "system", "content": "Generate educational questions."},
-            {"role": "user", "content": prompt}
-        ],
-        response_format=QuestionGenerationResponse,
-    )
-    
-    return response.choices[0].message.parsed
+    return [
+        {"role": "system", "content": "Generate educational questions."},
+        {"role": "user", "content": prompt}
+    ]
 
-def generate(subject: str, book: str):
-    """Fetches text from the database based on subject and book title."""
-    results = idx.query(
-        vector=[0.0] * 1536,
-        namespace=subject,
-        top_k=100,
-        include_metadata=True,
-        filter={"title": {"$eq": book}}
-    )
-    
+
+def generate_questions(main_topic: str, subtopic: str, context: str, question_type: QuestionType, num_questions: int = 5) -> QuestionGenerationResponse:
+    """Generates questions of a specified type based on a selected topic, subtopic, and context."""
+    messages = _question_messages(main_topic, subtopic, context, question_type, num_questions)
+    return parse(messages, QuestionGenerationResponse, endpoint="questions")
+
+
+async def generate_questions_async(main_topic: str, subtopic: str, context: str, question_type: QuestionType, num_questions: int = 5) -> QuestionGenerationResponse:
+    messages = _question_messages(main_topic, subtopic, context, question_type, num_questions)
+    return await parse_async(messages, QuestionGenerationResponse, endpoint="questions")
+
+
+def generate_questions_stream_async(main_topic: str, subtopic: str, context: str, question_type: QuestionType,
+                                    num_questions: int = 5) -> AsyncIterator[Question]:
+    """Yields each generated question as soon as the model has finished writing it."""
+    messages = _question_messages(main_topic, subtopic, context, question_type, num_questions)
+    return stream_list_async(messages, QuestionGenerationResponse, "questions", endpoint="questions")
+
+
+def _start_of_book(results: List[dict]) -> List[dict]:
+    return [{"text": res["text"], "chunk_index": i} for i, res in enumerate(results)]
+
+
+def _pack_context(matches: List[dict], budget: int) -> str:
+    selected = [matches[i] for i in pack_texts([match["text"] for match in matches], budget)]
+    return "\n".join(match["text"] for match in sorted(selected, key=lambda match: match["chunk_index"]))
+
+
+def question_context(subject: str, book: str, main_topic: str, subtopic: str, chunks: "BookChunks",
+                     budget: int = GENERATION_CONTEXT_TOKENS, client=None) -> str:
+    """
+    The book's chunks most relevant to the topic and subtopic, packed into `budget` tokens.
+
+    Chunks are taken best match first and returned in document order, so the prompt stays
+    the same size however long the book is. Without retrieval results (e.g. the search
+    failed) the start of the book is used, and only then are all its `chunks` fetched.
+    """
+    matches = search_book_chunks(f"{main_topic}: {subtopic}", client or get_client(), subject, book,
+                                 top_k=GENERATION_CONTEXT_CHUNKS)
+    return _pack_context(matches or _start_of_book(chunks.get()), budget)
+
+
+async def question_context_async(subject: str, book: str, main_topic: str, subtopic: str, chunks: "BookChunks",
+                                 budget: int = GENERATION_CONTEXT_TOKENS, client=None) -> str:
+    matches = await search_book_chunks_async(f"{main_topic}: {subtopic}", subject, book,
+                                             top_k=GENERATION_CONTEXT_CHUNKS, client=client)
+    return _pack_context(matches or _start_of_book(await chunks.get_async()), budget)
+
+
+def _id_batches(ids: List[str]) -> List[List[str]]:
+    return [ids[start:start + FETCH_BATCH_SIZE] for start in range(0, len(ids), FETCH_BATCH_SIZE)]
+
+
+def _book_chunks(ids: List[str], vectors: dict) -> List[dict]:
     output = []
-    matches = results.get("matches")
-    if not matches:
-        print("No matches found for the provided filter.")
-        return output
-    
-    for match in matches:
-        metadata = match.get("metadata", {})
-        meta_title = metadata.get("title", "")
-        text = metadata.get("text", "")
-        output.append({"title": meta_title, "text": text})
-    
+    for vector_id in ids:
+        vector = vectors.get(vector_id)
+        if vector is None:
+            logging.warning(f"Catalogued chunk '{vector_id}' is missing from the index.")
+            continue
+        metadata = vector.metadata or {}
+        output.append({"title": metadata.get("title", ""), "text": metadata.get("text", "")})
+    if not output:
+        logging.warning("No chunks found for the provided book.")
     return output
+
+
+def generate(subject: str, book: str):
+    """Fetches a book's chunks, in document order, by their catalogued vector IDs."""
+    ids = document_vector_ids(subject, book)
+    vectors = {}
+    for batch in _id_batches(ids):
+        with timed("vector_fetch"):
+            vectors.update(get_index().fetch(ids=batch, namespace=subject).vectors)
+    return _book_chunks(ids, vectors)
+
+
+async def generate_async(subject: str, book: str):
+    ids = await asyncio.to_thread(document_vector_ids, subject, book)
+    responses = await asyncio.gather(*(
+        index_call("fetch", ids=batch, namespace=subject) for batch in _id_batches(ids)
+    ))
+    vectors = {}
+    for response in responses:
+        vectors.update(response.vectors)
+    return _book_chunks(ids, vectors)
+
+
+class BookChunks:
+    """A book's chunks (see `generate`), fetched from the index on first use and then kept."""
+
+    def __init__(self, subject: str, book: str):
+        self.subject, self.book = subject, book
+        self._chunks = None
+        self._lock = threading.Lock()
+        self._fetch = None
+
+    def get(self) -> List[dict]:
+        with self._lock:
+            if self._chunks is None:
+                self._chunks = generate(subject=self.subject, book=self.book)
+            return self._chunks
+
+    async def get_async(self) -> List[dict]:
+        if self._chunks is None:
+            # Concurrent callers share one fetch; one of them being cancelled does not cancel it for the others
+            if self._fetch is None:
+                self._fetch = asyncio.ensure_future(generate_async(subject=self.subject, book=self.book))
+            self._chunks = await asyncio.shield(self._fetch)
+        return self._chunks
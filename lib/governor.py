@@ -0,0 +1,429 @@
+"""
+Client-side governor for upstream APIs (OpenAI, Pinecone).
+
+Every upstream call goes through its upstream's `Governor`, which
+- spends request and token budgets from token buckets (OPENAI_RPM, OPENAI_TPM, PINECONE_RPM),
+  queueing the call until the budget refills;
+- holds one of an adaptive number of concurrency slots. The limit grows by one slot per
+  window of successful calls and is cut back multiplicatively on 429s, failures, and calls
+  much slower than usual (AIMD);
+- retries throttled (429) and failed (5xx, timeout, connection) calls with jittered
+  exponential backoff, honouring Retry-After;
+- fails fast while its circuit breaker is open, i.e. after UPSTREAM_BREAKER_FAILURES
+  consecutive failures, letting one probe call through every UPSTREAM_BREAKER_RESET seconds.
+
+A call that cannot get a budget or slot within UPSTREAM_MAX_WAIT, or is still throttled
+after its retries, raises `UpstreamBusy` (HTTP 429); an open circuit or an upstream still
+failing after the retries raises `UpstreamUnavailable` (HTTP 503). Other errors, such as
+invalid requests, are raised unchanged and never retried.
+
+Budgets and limits are per process: with several workers, divide the account's limits.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+from constants import (OPENAI_RPM, OPENAI_TPM, OPENAI_MAX_CONNECTIONS, PINECONE_RPM, PINECONE_MAX_CONCURRENCY,
+                       UPSTREAM_MAX_WAIT, UPSTREAM_MAX_RETRIES, UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET,
+                       UPSTREAM_LATENCY_TOLERANCE)
+from lib.metrics import REGISTRY
+
+T = TypeVar("T")
+
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "upstream_retries_total", "Upstream calls retried, by the reason of the failed attempt.", ("upstream", "reason"))
+UPSTREAM_REJECTIONS = REGISTRY.counter(
+    "upstream_rejections_total", "Upstream calls rejected by the governor without reaching the upstream.",
+    ("upstream", "reason"))
+
+# Smoothing factor of the per-key average latency
+LATENCY_ALPHA = 0.1
+
+# Error classes that mean the request never got a usable answer (openai, httpx, urllib3)
+_TRANSIENT_ERRORS = ("APIConnectionError", "APITimeoutError", "InternalServerError", "ServiceException",
+                     "ConnectError", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+                     "RemoteProtocolError", "ProtocolError", "MaxRetryError", "NewConnectionError")
+
+
+class UpstreamError(Exception):
+    status_code = 503
+
+    def __init__(self, upstream: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class UpstreamBusy(UpstreamError):
+    """The upstream's budget is exhausted or it keeps throttling; worth retrying later."""
+    status_code = 429
+
+
+class UpstreamUnavailable(UpstreamError):
+    """The upstream is failing, or its circuit breaker is open."""
+    status_code = 503
+
+
+def classify(e: Exception) -> Optional[str]:
+    """"throttled" or "failed" for errors worth retrying, None for all others."""
+    status = getattr(e, "status_code", None)
+    if status == 429 or type(e).__name__ == "RateLimitError":
+        # An exhausted quota does not recover by waiting
+        return None if getattr(e, "code", None) == "insufficient_quota" else "throttled"
+    if isinstance(status, int) and (status >= 500 or status == 408):
+        return "failed"
+    if isinstance(e, (TimeoutError, ConnectionError)) or type(e).__name__ in _TRANSIENT_ERRORS:
+        return "failed"
+    return None
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """The Retry-After the upstream sent with an error, in seconds."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or getattr(e, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """`per_minute` units per minute, with bursts of up to a minute's worth; 0 means unlimited."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float, max_wait: float) -> Optional[float]:
+        """
+        Takes `amount` units and returns the seconds to wait before using them, or None (taking
+        nothing) when that would be longer than `max_wait`.
+        """
+        if not self.capacity or amount <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+            self._updated = now
+            wait = max(0.0, (amount - self.level) * 60 / self.capacity)
+            if wait > max_wait:
+                return None
+            self.level -= amount
+            return wait
+
+    def refund(self, amount: float):
+        if self.capacity and amount > 0:
+            with self._lock:
+                self.level = min(self.capacity, self.level + amount)
+
+    def charge(self, amount: float):
+        """Takes units without waiting, e.g. for tokens a call used beyond its estimate."""
+        if self.capacity and amount > 0:
+            with self._lock:
+                self.level -= amount
+
+
+class AdaptiveLimit:
+    """Concurrency slots whose number is adapted by additive increase, multiplicative decrease."""
+
+    def __init__(self, maximum: int, minimum: int = 1, tolerance: float = UPSTREAM_LATENCY_TOLERANCE):
+        self.maximum, self.minimum, self.tolerance = maximum, min(minimum, maximum), tolerance
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._latency: Dict[Optional[str], float] = {}
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        # Wake-up callbacks of callers waiting for a slot; all are woken when one frees up
+        self._waiters: List[Callable[[], None]] = []
+
+    def _try_acquire(self, waiter: Callable[[], None]) -> bool:
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        event = threading.Event()
+        while not self._try_acquire(event.set):
+            if not event.wait(max(0.0, deadline - time.monotonic())):
+                return False
+            event.clear()
+        return True
+
+    async def acquire_async(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            woken = loop.create_future()
+
+            def wake(woken=woken):
+                loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+            if self._try_acquire(wake):
+                return True
+            try:
+                await asyncio.wait_for(woken, max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                return False
+
+    def cancel(self):
+        """Frees a slot that was not used for a call."""
+        with self._lock:
+            self.in_flight -= 1
+            waiters, self._waiters = self._waiters, []
+        for wake in waiters:
+            wake()
+
+    def release(self, outcome: str, latency: float, key: Optional[str] = None):
+        """Frees a slot and adapts the limit to the call's outcome ("ok", "throttled" or "failed")."""
+        with self._lock:
+            self.in_flight -= 1
+            if outcome == "ok":
+                average = self._latency.get(key)
+                self._latency[key] = latency if average is None else average + LATENCY_ALPHA * (latency - average)
+                slow = average is not None and latency > self.tolerance * average
+            else:
+                slow = False
+            now = time.monotonic()
+            if outcome != "ok" or slow:
+                # Calls started before the last decrease report on the old limit; one decrease covers them
+                if now - latency >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * (0.9 if slow else 0.5))
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            waiters, self._waiters = self._waiters, []
+        for wake in waiters:
+            wake()
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = UPSTREAM_BREAKER_FAILURES, reset: float = UPSTREAM_BREAKER_RESET):
+        self.failures, self.reset = failures, reset
+        self.consecutive = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> Optional[float]:
+        """None if a call may go ahead, else the seconds until the next probe is allowed."""
+        with self._lock:
+            if self.opened_at is None:
+                return None
+            remaining = self.opened_at + self.reset - time.monotonic()
+            if remaining > 0 or self._probing:
+                return max(remaining, 1.0)
+            self._probing = True
+            return None
+
+    def abandon_probe(self):
+        """Lets another probe through after the probe call was cancelled without an outcome."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, outcome: str):
+        """Counts a call's outcome: "failed" calls open the breaker, throttled ones are neutral."""
+        with self._lock:
+            self._probing = False
+            if outcome == "ok":
+                self.consecutive, self.opened_at = 0, None
+            elif outcome == "failed":
+                self.consecutive += 1
+                if self.opened_at is not None or self.consecutive >= self.failures:
+                    self.opened_at = time.monotonic()
+
+
+class Governor:
+    def __init__(self, name: str, max_concurrency: int, rpm: int = 0, tpm: int = 0,
+                 max_wait: float = UPSTREAM_MAX_WAIT, max_retries: int = UPSTREAM_MAX_RETRIES):
+        self.name, self.max_wait, self.max_retries = name, max_wait, max_retries
+        self.requests, self.tokens = TokenBucket(rpm), TokenBucket(tpm)
+        self.concurrency = AdaptiveLimit(max_concurrency)
+        self.breaker = CircuitBreaker()
+
+    def _reject(self, error_type, reason: str, message: str, retry_after: float = None):
+        UPSTREAM_REJECTIONS.inc(upstream=self.name, reason=reason)
+        return error_type(self.name, message, retry_after)
+
+    def _reserve(self, tokens: int) -> float:
+        """Takes the budgets; returns the seconds to wait before calling."""
+        request_wait = self.requests.reserve(1, self.max_wait)
+        token_wait = self.tokens.reserve(tokens, self.max_wait) if request_wait is not None else None
+        if token_wait is None:
+            if request_wait is not None:
+                self.requests.refund(1)
+            raise self._reject(UpstreamBusy, "budget", "request or token budget exhausted", self.max_wait)
+        return max(request_wait, token_wait)
+
+    def _refund(self, tokens: int):
+        """Returns the budgets of a call rejected before it reached the upstream."""
+        self.requests.refund(1)
+        self.tokens.refund(tokens)
+
+    def _acquire_failed(self, tokens: int) -> UpstreamError:
+        self._refund(tokens)
+        return self._reject(UpstreamBusy, "concurrency", "no free upstream slot", self.max_wait)
+
+    def _pass_breaker(self, tokens: int) -> bool:
+        """
+        Checked once a slot is held, so calls queued before an outage fail fast once the breaker opens.
+        Returns whether the call is the breaker's probe: the only call let through while it is open.
+        """
+        remaining = self.breaker.allow()
+        if remaining is not None:
+            self.concurrency.cancel()
+            self._refund(tokens)
+            raise self._reject(UpstreamUnavailable, "circuit_open", "circuit breaker open after repeated failures",
+                               remaining)
+        return self.breaker.is_open
+
+    def _finish(self, start: float, outcome: str, key: Optional[str], tokens: int, used: Optional[int] = None):
+        self.concurrency.release(outcome, time.perf_counter() - start, key)
+        self.breaker.record(outcome)
+        if used is not None:
+            self.tokens.charge(used - tokens)
+
+    def _abandon(self, probe: bool):
+        """Frees the slot of a cancelled call, which says nothing about the upstream's latency or health."""
+        self.concurrency.cancel()
+        if probe:
+            self.breaker.abandon_probe()
+
+    def _give_up(self, e: Exception, outcome: str) -> UpstreamError:
+        error_type = UpstreamBusy if outcome == "throttled" else UpstreamUnavailable
+        return error_type(self.name, f"{type(e).__name__}: {e}", retry_after(e))
+
+    def _backoff(self, e: Exception, outcome: str, attempt: int, retries: int) -> float:
+        """Seconds to wait before retrying after `e`, or raises when the call should not be retried."""
+        if attempt >= retries or self.breaker.is_open:
+            raise self._give_up(e, outcome) from e
+        UPSTREAM_RETRIES.inc(upstream=self.name, reason=outcome)
+        delay = retry_after(e) or min(2 ** attempt, 30) * (0.5 + random.random())
+        logging.warning(f"{self.name} call {outcome} ({e}); retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, fn: Callable[[], T], tokens: int = 0, key: Optional[str] = None,
+             max_retries: Optional[int] = None, used_tokens: Callable[[T], Optional[int]] = None) -> T:
+        """
+        Runs `fn()` under the governor, retrying it on transient errors.
+
+        `tokens` is the call's estimated token count and `used_tokens(result)` its actual one,
+        if known; `key` groups calls of similar latency (e.g. an LLM endpoint).
+        """
+        retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(retries + 1):
+            time.sleep(self._reserve(tokens))
+            if not self.concurrency.acquire(self.max_wait):
+                raise self._acquire_failed(tokens)
+            self._pass_breaker(tokens)
+            start = time.perf_counter()
+            try:
+                result = fn()
+            except Exception as e:
+                outcome = classify(e)
+                self._finish(start, outcome or "ok", key, tokens)
+                if outcome is None:
+                    raise
+                delay = self._backoff(e, outcome, attempt, retries)
+            else:
+                self._finish(start, "ok", key, tokens, used_tokens(result) if used_tokens else None)
+                return result
+            time.sleep(delay)
+
+    async def call_async(self, fn: Callable[[], Awaitable[T]], tokens: int = 0, key: Optional[str] = None,
+                         max_retries: Optional[int] = None,
+                         used_tokens: Callable[[T], Optional[int]] = None) -> T:
+        retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(retries + 1):
+            await asyncio.sleep(self._reserve(tokens))
+            if not await self.concurrency.acquire_async(self.max_wait):
+                raise self._acquire_failed(tokens)
+            probe = self._pass_breaker(tokens)
+            start = time.perf_counter()
+            try:
+                result = await fn()
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._abandon(probe)
+                    raise
+                outcome = classify(e)
+                self._finish(start, outcome or "ok", key, tokens)
+                if outcome is None:
+                    raise
+                delay = self._backoff(e, outcome, attempt, retries)
+            else:
+                self._finish(start, "ok", key, tokens, used_tokens(result) if used_tokens else None)
+                return result
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot_async(self, tokens: int = 0, key: Optional[str] = None):
+        """Admits one attempt of a call that cannot be retried as a whole, such as a stream."""
+        await asyncio.sleep(self._reserve(tokens))
+        if not await self.concurrency.acquire_async(self.max_wait):
+            raise self._acquire_failed(tokens)
+        probe = self._pass_breaker(tokens)
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            # Also a stream whose consumer went away
+            if not isinstance(e, Exception):
+                self._abandon(probe)
+                raise
+            outcome = classify(e)
+            self._finish(start, outcome or "ok", key, tokens)
+            if outcome is None:
+                raise
+            raise self._give_up(e, outcome) from e
+        self._finish(start, "ok", key, tokens)
+
+
+_governors: Dict[str, Governor] = {}
+_governors_lock = threading.Lock()
+
+_DEFAULTS = {
+    "openai": dict(max_concurrency=OPENAI_MAX_CONNECTIONS, rpm=OPENAI_RPM, tpm=OPENAI_TPM),
+    "pinecone": dict(max_concurrency=PINECONE_MAX_CONCURRENCY, rpm=PINECONE_RPM),
+}
+
+
+def get_governor(name: str) -> Governor:
+    """The process-wide governor of the "openai" or "pinecone" upstream."""
+    governor = _governors.get(name)
+    if governor is None:
+        with _governors_lock:
+            governor = _governors.get(name)
+            if governor is None:
+                governor = _governors[name] = Governor(name, **_DEFAULTS[name])
+    return governor
+
+
+def set_governor(name: str, governor: Governor):
+    _governors[name] = governor
+
+
+def _governor_lines() -> List[str]:
+    lines = []
+    for metric, help, value in (
+            ("upstream_concurrency_limit", "Current adaptive concurrency limit.", lambda g: int(g.concurrency.limit)),
+            ("upstream_in_flight", "Upstream calls in flight.", lambda g: g.concurrency.in_flight),
+            ("upstream_circuit_open", "1 while the upstream's circuit breaker is open.", lambda g: int(g.breaker.is_open))):
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} gauge"]
+        lines += [f'{metric}{{upstream="{name}"}} {value(governor)}' for name, governor in sorted(_governors.items())]
+    return lines
+
+
+REGISTRY.add_collector(_governor_lines)
@@ -1,37 +1,291 @@
-from langdetect import detect
+import asyncio
+import json
+import logging
 import re
-from config.openai import client
-from models.schema_models import GrammarModel
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+from constants import (GRAMMAR_MAX_WORKERS, GRAMMAR_MODE, GRAMMAR_BATCH_TOKENS, GRAMMAR_TRIAGE, GrammarMode,
+                       GrammarTriage)
+from lib import grammar_triage
+from lib.llm import parse, parse_async
+from lib.metrics import timed
+from lib.tokens import estimate_tokens
+from models.schema_models import GrammarModel, GrammarFailure, GrammarBatchModel
+
+# langdetect loads its language profiles lazily, and concurrent first calls corrupt them
+_langdetect_init_lock = threading.Lock()
 
 def split_english(text: str):
-    detected_lang = detect(text)
+    # Imported here: langdetect is slow to import and the web apps should start fast
+    from langdetect import detect
+    from langdetect.detector_factory import init_factory
+    with timed("language_detection"):
+        with _langdetect_init_lock:
+            init_factory()
+        detected_lang = detect(text)
     if detected_lang != "en":
         raise ValueError(f"Text is not in English. Detected language: {detected_lang}")
-    return re.split(r'(?<=[.!?,:;…])\s+|(?<=\.\.\.)\s+', text.strip())
-
-def grammar(sentence: str) -> GrammarModel:
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {
-                "role": "system", 
-                "content": (
-                    "Correct only the grammatical errors in the provided sentence. "
-                    "Do not change or remove any factual information, even if it appears incorrect. "
-                    "Focus solely on grammar, punctuation, and capitalization. "
-                    "Return your response as JSON with keys: 'sentence', 'corrected_sentence', and 'errors'."
-                )
-            },
-            {"role": "user", "content": sentence},
-        ],
-        response_format=GrammarModel,
-    )
-    return completion.choices[0].message.parsed
-
-def grammar_check(text: str):
-    sentences = split_english(text)
-    results = []
+    with timed("sentence_split"):
+        return re.split(r'(?<=[.!?,:;…])\s+|(?<=\.\.\.)\s+', text.strip())
+
+# Changing either grammar prompt: bump grammar_triage.PROMPT_VERSION
+def _grammar_messages(sentence: str) -> List[dict]:
+    return [
+        {
+            "role": "system", 
+            "content": (
+                "Correct only the grammatical errors in the provided sentence. "
+                "Do not change or remove any factual information, even if it appears incorrect. "
+                "Focus solely on grammar, punctuation, and capitalization. "
+                "Return your response as JSON with keys: 'sentence', 'corrected_sentence', and 'errors'."
+            )
+        },
+        {"role": "user", "content": sentence},
+    ]
+
+def _consistent(result: GrammarModel) -> bool:
+    """Whether a result lists errors exactly when its correction changes the sentence; the small model tier is
+    only trusted when it does."""
+    changed = grammar_triage.normalize(result.corrected_sentence) != grammar_triage.normalize(result.sentence)
+    return changed == bool(result.errors)
+
+def grammar(sentence: str, openai_client=None) -> GrammarModel:
+    return parse(_grammar_messages(sentence), GrammarModel, openai_client=openai_client, endpoint="grammar",
+                 accept=_consistent)
+
+async def grammar_async(sentence: str, openai_client=None) -> GrammarModel:
+    return await parse_async(_grammar_messages(sentence), GrammarModel, openai_client=openai_client,
+                             endpoint="grammar", accept=_consistent)
+
+def _grammar_batch_messages(sentences: List[str]) -> List[dict]:
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Correct only the grammatical errors in each of the provided sentences. "
+                "Do not change or remove any factual information, even if it appears incorrect. "
+                "Focus solely on grammar, punctuation, and capitalization. "
+                "The input is a JSON list of sentences; check each one independently. "
+                "Return your response as JSON with key 'results': one object per input sentence, in the same order, "
+                "with keys 'sentence' (copied verbatim from the input), 'corrected_sentence', and 'errors'."
+            )
+        },
+        {"role": "user", "content": json.dumps(sentences, ensure_ascii=False)},
+    ]
+
+def _batch_results(parsed: Optional[GrammarBatchModel], sentences: List[str]) -> Optional[List[GrammarModel]]:
+    if parsed is None or len(parsed.results) != len(sentences):
+        return None
+    if any(" ".join(r.sentence.split()) != " ".join(s.split()) for r, s in zip(parsed.results, sentences)):
+        return None
+    for result in parsed.results:
+        result._verified = parsed._verified
+    return parsed.results
+
+def _batch_accepted(parsed: GrammarBatchModel, sentences: List[str]) -> bool:
+    results = _batch_results(parsed, sentences)
+    return results is not None and all(_consistent(result) for result in results)
+
+def grammar_batch(sentences: List[str], openai_client=None) -> Optional[List[GrammarModel]]:
+    """
+    Checks several sentences with a single request.
+
+    Returns None when the response is malformed, i.e. it does not contain exactly one
+    result per input sentence with the input sentence echoed back in order.
+    """
+    parsed = parse(_grammar_batch_messages(sentences), GrammarBatchModel, openai_client=openai_client,
+                   endpoint="grammar", accept=lambda p: _batch_accepted(p, sentences))
+    return _batch_results(parsed, sentences)
+
+async def grammar_batch_async(sentences: List[str], openai_client=None) -> Optional[List[GrammarModel]]:
+    parsed = await parse_async(_grammar_batch_messages(sentences), GrammarBatchModel, openai_client=openai_client,
+                               endpoint="grammar", accept=lambda p: _batch_accepted(p, sentences))
+    return _batch_results(parsed, sentences)
+
+def pack_sentences(sentences: List[str], token_budget: int = GRAMMAR_BATCH_TOKENS) -> List[List[str]]:
+    """Groups consecutive sentences into batches whose estimated token count stays within the budget."""
+    batches, batch, batch_tokens = [], [], 0
     for sentence in sentences:
-        result = grammar(sentence)
-        results.append(result)
+        tokens = estimate_tokens(sentence)
+        if batch and batch_tokens + tokens > token_budget:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(sentence)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _failure(sentence: str, e: Exception) -> GrammarFailure:
+    logging.error(f"Grammar check failed for sentence {sentence!r}: {e}")
+    return GrammarFailure(sentence=sentence, corrected_sentence=sentence, errors=[], error=str(e))
+
+def _safe_grammar(sentence: str, openai_client=None):
+    """Checks one sentence, turning a failure into a GrammarFailure so the other results survive."""
+    try:
+        return grammar(sentence, openai_client)
+    except Exception as e:
+        return _failure(sentence, e)
+
+async def _safe_grammar_async(sentence: str, openai_client=None):
+    try:
+        return await grammar_async(sentence, openai_client)
+    except Exception as e:
+        return _failure(sentence, e)
+
+def _safe_grammar_batch(sentences: List[str], openai_client=None):
+    try:
+        return grammar_batch(sentences, openai_client)
+    except Exception as e:
+        logging.error(f"Batched grammar check of {len(sentences)} sentences failed: {e}")
+        return None
+
+async def _safe_grammar_batch_async(sentences: List[str], openai_client=None):
+    try:
+        return await grammar_batch_async(sentences, openai_client)
+    except Exception as e:
+        logging.error(f"Batched grammar check of {len(sentences)} sentences failed: {e}")
+        return None
+
+def _run(fn, items: list, max_workers: int) -> list:
+    if max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(fn, items))
+
+async def _run_async(fn, items: list, max_concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def bounded(item):
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(bounded(item) for item in items))
+
+def _batches_to_retry(batches, batch_results) -> List[str]:
+    retry = [s for batch, checked in zip(batches, batch_results) if checked is None for s in batch]
+    if retry:
+        logging.warning(f"Falling back to per-sentence checks for {len(retry)} sentences")
+    return retry
+
+def _merge_batches(batches, batch_results, retried) -> list:
+    retried = iter(retried)
+    results = []
+    for batch, checked in zip(batches, batch_results):
+        results.extend(checked if checked is not None else [next(retried) for _ in batch])
+    return results
+
+def _raise_if_all_failed(results):
+    if results and all(isinstance(r, GrammarFailure) for r in results):
+        raise RuntimeError(f"Grammar check failed for every sentence: {results[0].error}")
+
+def _check(sentences: List[str], max_workers: int, openai_client, mode: GrammarMode, batch_tokens: int) -> list:
+    check_sentence = lambda sentence: _safe_grammar(sentence, openai_client)
+
+    if mode == "batch":
+        batches = pack_sentences(sentences, batch_tokens)
+        batch_results = _run(lambda batch: _safe_grammar_batch(batch, openai_client), batches, max_workers)
+        retried = _run(check_sentence, _batches_to_retry(batches, batch_results), max_workers)
+        return _merge_batches(batches, batch_results, retried)
+    return _run(check_sentence, sentences, max_workers)
+
+def grammar_check(text: str, max_workers: int = GRAMMAR_MAX_WORKERS, openai_client=None,
+                  mode: GrammarMode = GRAMMAR_MODE, batch_tokens: int = GRAMMAR_BATCH_TOKENS,
+                  triage: GrammarTriage = GRAMMAR_TRIAGE):
+    """
+    Checks every sentence of the text, running up to `max_workers` requests concurrently.
+
+    Only the sentences the `triage` level selects (see lib.grammar_triage) are sent to the
+    model; the others are returned without errors.
+    In "batch" mode sentences are packed into requests of at most `batch_tokens` estimated
+    tokens; a batch whose response is malformed is retried one sentence at a time.
+    Results are returned in the original sentence order. A sentence whose check fails is
+    returned as a GrammarFailure; the whole call only raises if every sentence failed.
+    """
+    sentences = split_english(text)
+    flagged = grammar_triage.triage(sentences, triage)
+    checked = _check([s for s, needs_check in zip(sentences, flagged) if needs_check], max_workers, openai_client,
+                     mode, batch_tokens)
+    results = grammar_triage.merge(sentences, flagged, checked)
+
+    _raise_if_all_failed(results)
+    grammar_triage.remember_clean(checked, triage)
     return results
+
+async def _check_async(sentences: List[str], max_concurrency: int, openai_client, mode: GrammarMode,
+                       batch_tokens: int) -> list:
+    check_sentence = lambda sentence: _safe_grammar_async(sentence, openai_client)
+
+    if mode == "batch":
+        batches = pack_sentences(sentences, batch_tokens)
+        batch_results = await _run_async(lambda batch: _safe_grammar_batch_async(batch, openai_client),
+                                         batches, max_concurrency)
+        retried = await _run_async(check_sentence, _batches_to_retry(batches, batch_results), max_concurrency)
+        return _merge_batches(batches, batch_results, retried)
+    return await _run_async(check_sentence, sentences, max_concurrency)
+
+async def grammar_check_async(text: str, max_concurrency: int = GRAMMAR_MAX_WORKERS, openai_client=None,
+                              mode: GrammarMode = GRAMMAR_MODE, batch_tokens: int = GRAMMAR_BATCH_TOKENS,
+                              triage: GrammarTriage = GRAMMAR_TRIAGE):
+    """Async counterpart of `grammar_check`, with at most `max_concurrency` requests in flight."""
+    sentences = await asyncio.to_thread(split_english, text)
+    flagged = await asyncio.to_thread(grammar_triage.triage, sentences, triage)
+    checked = await _check_async([s for s, needs_check in zip(sentences, flagged) if needs_check], max_concurrency,
+                                 openai_client, mode, batch_tokens)
+    results = grammar_triage.merge(sentences, flagged, checked)
+
+    _raise_if_all_failed(results)
+    await asyncio.to_thread(grammar_triage.remember_clean, checked, triage)
+    return results
+
+async def grammar_check_stream_async(sentences: List[str], max_concurrency: int = GRAMMAR_MAX_WORKERS,
+                                     openai_client=None, mode: GrammarMode = GRAMMAR_MODE,
+                                     batch_tokens: int = GRAMMAR_BATCH_TOKENS,
+                                     triage: GrammarTriage = GRAMMAR_TRIAGE) -> AsyncIterator[Tuple[int, GrammarModel]]:
+    """
+    Checks already split sentences (see `split_english`) and yields `(index, result)` as each one completes.
+
+    Sentences that triage skips are yielded first. The rest arrive in completion order, not
+    sentence order; in "batch" mode a whole batch is yielded at once. Failures are yielded
+    as GrammarFailure like in `grammar_check`.
+    """
+    flagged = await asyncio.to_thread(grammar_triage.triage, sentences, triage)
+    for index, (sentence, needs_check) in enumerate(zip(sentences, flagged)):
+        if not needs_check:
+            yield index, grammar_triage.clean_result(sentence)
+    positions = [index for index, needs_check in enumerate(flagged) if needs_check]
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def bounded(fn, item):
+        async with semaphore:
+            return await fn(item, openai_client)
+
+    async def check_sentence(index):
+        return [(index, await bounded(_safe_grammar_async, sentences[index]))]
+
+    async def check_batch(batch_positions, batch):
+        checked = await bounded(_safe_grammar_batch_async, batch)
+        if checked is None:
+            checked = await asyncio.gather(*(bounded(_safe_grammar_async, s) for s in _batches_to_retry([batch], [None])))
+        return list(zip(batch_positions, checked))
+
+    if mode == "batch":
+        work, start = [], 0
+        for batch in pack_sentences([sentences[index] for index in positions], batch_tokens):
+            work.append(check_batch(positions[start:start + len(batch)], batch))
+            start += len(batch)
+    else:
+        work = [check_sentence(index) for index in positions]
+
+    tasks = [asyncio.ensure_future(item) for item in work]
+    try:
+        for done in asyncio.as_completed(tasks):
+            pairs = await done
+            await asyncio.to_thread(grammar_triage.remember_clean, [result for _, result in pairs], triage)
+            for pair in pairs:
+                yield pair
+    finally:
+        # The client went away: stop the checks that are still running
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,214 @@
+"""
+Local triage for grammar_check: decides which sentences need the model at all.
+
+Two signals are used:
+- a persistent store of normalized sentences the model has already returned without
+  errors, which are skipped from then on;
+- cheap rules for common error patterns (agreement, articles, repeated words, ...). Rules
+  only ever flag a sentence; a sentence no rule flags is not proven correct, which is
+  why skipping those is limited to the "balanced" and "aggressive" levels.
+
+Skipped sentences get a synthesized GrammarModel without errors.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import closing
+from typing import Iterable, List
+from constants import (DATA_DIR, GRAMMAR_TRIAGE, GRAMMAR_TRIAGE_MAX_ENTRIES, GRAMMAR_TRIAGE_SHORT_WORDS,
+                       GRAMMAR_TRIAGE_TTL, LLM_MODEL, GrammarTriage)
+from models.schema_models import GrammarFailure, GrammarModel
+
+CLEAN_SENTENCES_PATH = os.path.join(DATA_DIR, "clean_sentences.sqlite3")
+# Hashes per `IN (...)` lookup, well under SQLite's bound-parameter limit
+LOOKUP_BATCH_SIZE = 500
+# Part of every clean-sentence hash: bump it whenever the grammar prompts in lib.grammar_check
+# change, so verdicts given under the old prompts are not reused
+PROMPT_VERSION = 1
+
+_MODALS = r"can|could|will|would|shall|should|must|may|might|did|does|do"
+
+# Patterns that make an error likely; false positives only cost a model call
+ERROR_PATTERNS = [re.compile(pattern, flags) for pattern, flags in (
+    # Repeated word: "the the"
+    (r"\b(\w+)\s+\1\b", re.IGNORECASE),
+    # Article before the wrong sound: "a apple", "an book"
+    (r"\ba\s+(?!uni|use|usu|uti|one|once|eu|ur)[aeiou]\w", re.IGNORECASE),
+    (r"\ban\s+(?!hour|honest|honou?r|heir|herb)[b-df-hj-np-tv-z]\w", re.IGNORECASE),
+    # Subject-verb agreement: "they was", "he have", "cats and dogs was"
+    (r"\b(they|we|you)\s+(was|is|has|does|doesn't|wasn't)\b", re.IGNORECASE),
+    (r"\b(he|she|it)\s+(are|were|have|do|don't|aren't|weren't)\b", re.IGNORECASE),
+    (r"\bI\s+(is|are|has|does|doesn't)\b", 0),
+    (r"\b\w+s\s+and\s+\w+\s+(was|is|has)\b|\band\s+\w+s\s+(was|is|has)\b", re.IGNORECASE),
+    # Third person singular without -s/-ed: "he invade"
+    (r"\b(he|she|it)\s+(?!(?:" + _MODALS + r"|was|had|has|is|also|never|always|then|still|just|only|often|not|"
+     r"too|soon|later|first|once|finally)\b)[a-z]+(?<![sd])\b", re.IGNORECASE),
+    # Modal or "to" followed by a past form: "did started", "to invaded"
+    (r"\b(" + _MODALS + r"|to)\s+[a-z]+(?<!e)ed\b", re.IGNORECASE),
+    (r"\b(could|should|would|must|might)\s+of\b", re.IGNORECASE),
+    # Decade without an article: "in 1800s"
+    (r"\b(in|during|by|since)\s+\d{3,4}'?s\b", re.IGNORECASE),
+    # Frequent confusions and misspellings
+    (r"\b(alot|irregardless|more then|less then|rather then|their is|their are|your welcome|it's own)\b",
+     re.IGNORECASE),
+    # Lowercase pronoun I, spacing and punctuation slips
+    (r"(^|\s)i(\s|'m\b|'ve\b|'ll\b|'d\b)", 0),
+    (r"\s[,.;:!?]|\s{2,}|[,;:][^\s\d\"'’”)\]]", 0),
+)]
+
+_PAIRS = (("(", ")"), ("[", "]"), ("“", "”"), ("‘", "’"))
+
+
+def normalize(sentence: str) -> str:
+    """Unicode- and whitespace-normalized sentence; case and punctuation are kept, since they can be errors."""
+    return " ".join(unicodedata.normalize("NFC", sentence).split())
+
+
+def rule_flags(sentence: str) -> bool:
+    """True when a local rule suggests the sentence has an error."""
+    if any(pattern.search(sentence) for pattern in ERROR_PATTERNS):
+        return True
+    if sentence.count('"') % 2:
+        return True
+    return any(sentence.count(opening) < sentence.count(closing) for opening, closing in _PAIRS)
+
+
+class CleanSentenceStore:
+    """
+    Hashes of normalized sentences the model returned without errors, in SQLite.
+
+    Hashes include `version` (the model and prompt that gave the verdict), so a new model
+    or prompt does not reuse old verdicts. Entries expire after `ttl` seconds; past
+    `max_entries`, expired entries are dropped first, then the least recently matched ones.
+    """
+
+    def __init__(self, path: str = None, version: str = None, ttl: float = GRAMMAR_TRIAGE_TTL,
+                 max_entries: int = GRAMMAR_TRIAGE_MAX_ENTRIES):
+        self.path = path or CLEAN_SENTENCES_PATH
+        self.version = version or f"{LLM_MODEL}:{PROMPT_VERSION}"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Unversioned verdicts from before the hash included the model and prompt
+            conn.execute("DROP TABLE IF EXISTS clean_sentences")
+            conn.execute("CREATE TABLE IF NOT EXISTS clean_verdicts "
+                         "(hash TEXT PRIMARY KEY, expires REAL NOT NULL, accessed REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS clean_verdicts_by_access ON clean_verdicts (accessed)")
+            self._count = conn.execute("SELECT COUNT(*) FROM clean_verdicts").fetchone()[0]
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _hash(self, sentence: str) -> str:
+        return hashlib.sha256(f"{self.version}\0{normalize(sentence)}".encode("utf-8")).hexdigest()
+
+    def contains_many(self, sentences: List[str]) -> List[bool]:
+        hashes = [self._hash(sentence) for sentence in sentences]
+        if not hashes:
+            return []
+        now = time.time()
+        found = set()
+        with closing(self._connect()) as conn, conn:
+            for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                hits = [row[0] for row in conn.execute(
+                    f"SELECT hash FROM clean_verdicts WHERE hash IN ({placeholders}) AND expires > ?", (*batch, now))]
+                if hits:
+                    conn.execute(f"UPDATE clean_verdicts SET accessed = ? WHERE hash IN ({','.join('?' * len(hits))})",
+                                 (now, *hits))
+                found.update(hits)
+        return [digest in found for digest in hashes]
+
+    def add_many(self, sentences: Iterable[str]):
+        now = time.time()
+        rows = [(self._hash(sentence), now + self.ttl, now) for sentence in sentences]
+        if not rows:
+            return
+        with self._lock, closing(self._connect()) as conn, conn:
+            # An expired verdict that is confirmed again gets a fresh expiry
+            conn.executemany("INSERT OR REPLACE INTO clean_verdicts (hash, expires, accessed) VALUES (?, ?, ?)", rows)
+            # Replaced rows are counted too; _evict recounts before dropping anything
+            self._count += len(rows)
+            if self._count > self.max_entries:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drops expired entries, then least recently matched ones, until the store is 10% under its cap."""
+        conn.execute("DELETE FROM clean_verdicts WHERE expires <= ?", (time.time(),))
+        self._count = conn.execute("SELECT COUNT(*) FROM clean_verdicts").fetchone()[0]
+        if self._count > self.max_entries:
+            excess = self._count - int(self.max_entries * 0.9)
+            conn.execute("DELETE FROM clean_verdicts WHERE hash IN "
+                         "(SELECT hash FROM clean_verdicts ORDER BY accessed LIMIT ?)", (excess,))
+            self._count -= excess
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_clean_store() -> CleanSentenceStore:
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = CleanSentenceStore()
+    return _default_store
+
+
+def set_clean_store(store: CleanSentenceStore):
+    global _default_store
+    _default_store = store
+
+
+def triage(sentences: List[str], level: GrammarTriage = GRAMMAR_TRIAGE,
+           short_words: int = GRAMMAR_TRIAGE_SHORT_WORDS) -> List[bool]:
+    """For each sentence, whether it should be sent to the model."""
+    if level == "off" or not sentences:
+        return [True] * len(sentences)
+    known_clean = get_clean_store().contains_many(sentences)
+    flagged = []
+    for sentence, clean in zip(sentences, known_clean):
+        if clean:
+            flagged.append(False)
+        elif level == "conservative" or rule_flags(sentence):
+            flagged.append(True)
+        elif level == "balanced":
+            flagged.append(len(sentence.split()) > short_words)
+        else:
+            flagged.append(False)
+    return flagged
+
+
+def clean_result(sentence: str) -> GrammarModel:
+    return GrammarModel(sentence=sentence, corrected_sentence=sentence, errors=[])
+
+
+def remember_clean(results: Iterable[GrammarModel], level: GrammarTriage = GRAMMAR_TRIAGE):
+    """
+    Records the model's error-free results so the same sentences are skipped next time.
+
+    Only verified results count (see GrammarModel): a small-tier answer of unknown
+    confidence, or one replayed from the response cache, may have missed an error.
+    """
+    if level == "off":
+        return
+    get_clean_store().add_many(
+        result.sentence for result in results
+        if not isinstance(result, GrammarFailure) and result._verified and not result.errors
+        and normalize(result.corrected_sentence) == normalize(result.sentence)
+    )
+
+
+def merge(sentences: List[str], flagged: List[bool], checked: List[GrammarModel]) -> List[GrammarModel]:
+    """Results in sentence order: the model's for flagged sentences, synthesized clean ones for the rest."""
+    checked = iter(checked)
+    return [next(checked) if needs_check else clean_result(sentence) for sentence, needs_check in zip(sentences, flagged)]
@@ -0,0 +1,89 @@
+"""Job kinds run by the background job queue (see lib/jobs.py)."""
+import hashlib
+import os
+import tempfile
+from config.openai import get_client
+from constants import DATA_DIR
+from lib.jobs import JobContext, JobQueue
+
+UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+UPLOAD_BLOCK_SIZE = 2 ** 20
+# Where a PDF's "%PDF-" header may start; readers accept leading junk up to this offset
+PDF_HEADER_WINDOW = 1024
+
+
+class UploadError(ValueError):
+    """The uploaded file is not a PDF."""
+
+
+def generate_questions_job(params: dict, context: JobContext) -> dict:
+    """Same steps as `/generate/questions`; params are the fields of its request body."""
+    from lib.question_pipeline import generate_for_targets, load_book, plan_topics
+
+    subject, book = params["subject"], params["book"]
+    with context.stage("retrieval"):
+        chunks, topics = load_book(subject, book)
+    targets = plan_topics(topics, params.get("num_questions", 5), params.get("topic"), params.get("subtopic"))
+    with context.stage("generation"):
+        return generate_for_targets(subject, book, chunks, targets, params.get("type", "text_based"))
+
+
+def ingest_job(params: dict, context: JobContext) -> dict:
+    """Ingests the PDF at `params["path"]` into the `params["subject"]` namespace."""
+    from document_processing.store_vector import store_pdf_in_pinecone
+
+    try:
+        with context.stage("ingest"):
+            stats = store_pdf_in_pinecone(params["path"], get_client(), params["subject"], progress=context.progress,
+                                          build_topics=params.get("build_topics", False))
+    finally:
+        remove_upload(params["path"])
+    if stats is None:
+        raise RuntimeError("Ingestion failed; see the server log for details.")
+    return stats
+
+
+def register_job_kinds(queue: JobQueue):
+    queue.register("generate_questions", generate_questions_job)
+    queue.register("ingest", ingest_job)
+
+
+def save_upload(fileobj, filename: str, root: str = None) -> str:
+    """
+    Stores an uploaded PDF under `.data/uploads/<content hash>/<filename>` and returns its path.
+
+    The file keeps its name because ingestion uses it as the title when the PDF has none,
+    and the content hash makes identical uploads land on the same path (and job). Raises
+    UploadError, storing nothing, if the file does not start like a PDF.
+    """
+    root = root or UPLOADS_DIR
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=root, delete=False) as tmp:
+        for block in iter(lambda: fileobj.read(UPLOAD_BLOCK_SIZE), b""):
+            digest.update(block)
+            tmp.write(block)
+    with open(tmp.name, "rb") as file:
+        is_pdf = b"%PDF-" in file.read(PDF_HEADER_WINDOW)
+    if not is_pdf:
+        os.remove(tmp.name)
+        raise UploadError("The uploaded file is not a PDF.")
+    directory = os.path.join(root, digest.hexdigest()[:16])
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, os.path.basename(filename) or "upload.pdf")
+    os.replace(tmp.name, path)
+    return path
+
+
+def remove_upload(path: str, root: str = None):
+    """Deletes a file stored by `save_upload`, and its directory once empty; other paths are left alone."""
+    root = os.path.abspath(root or UPLOADS_DIR)
+    path = os.path.abspath(path)
+    if os.path.commonpath([root, path]) != root:
+        return
+    try:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        # Already removed by an identical job, or the directory holds another upload
+        pass
@@ -0,0 +1,230 @@
+"""
+Background jobs for work that outlives an HTTP request (question generation, ingestion).
+
+A submission is stored in an SQLite job store and run on a local worker pool; clients get
+a job ID back immediately and poll (or stream) its status until the result is ready.
+Submitting the same work while an identical job is still queued or running returns the
+existing job instead of starting another one. Finished jobs are deleted JOB_RETENTION
+seconds after they finish.
+
+Every job records a timing breakdown: time spent queued plus one entry per stage the job
+function reports through `stage()`.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from typing import Callable, Dict, Optional, Tuple
+from constants import DATA_DIR, JOB_RETENTION, JOB_WORKERS
+
+JOBS_PATH = os.path.join(DATA_DIR, "jobs.sqlite3")
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    timings TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_dedupe_key ON jobs (dedupe_key, status);
+CREATE INDEX IF NOT EXISTS jobs_by_finished_at ON jobs (finished_at);
+"""
+
+JSON_COLUMNS = ("params", "progress", "result", "timings")
+
+
+class JobContext:
+    """Passed to a job function to report stage timings and progress."""
+
+    def __init__(self, store: "JobStore", job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def progress(self, progress: dict):
+        self.store.update(self.job_id, progress=progress)
+
+
+class JobStore:
+    """Persistent job records in SQLite, shared by every worker process on the machine."""
+
+    def __init__(self, path: str = None):
+        self.path = path or JOBS_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_or_get(self, kind: str, params: dict, owner: str) -> Tuple[dict, bool]:
+        """Inserts a queued job, or returns the unfinished job with the same kind and params. Returns (job, created)."""
+        key = dedupe_key(kind, params)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running') ORDER BY created_at LIMIT 1",
+                (key,)
+            ).fetchone()
+            if row is not None:
+                return _job(row), False
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, dedupe_key, status, params, timings, owner, created_at) "
+                "VALUES (?, ?, ?, 'queued', ?, '{}', ?, ?)",
+                (job_id, kind, key, json.dumps(params), owner, time.time())
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row), True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        for column in JSON_COLUMNS:
+            if column in fields:
+                fields[column] = json.dumps(fields[column])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def purge(self, retention: float = JOB_RETENTION) -> int:
+        """Deletes jobs that finished more than `retention` seconds ago."""
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' for _ in TERMINAL_STATUSES)}) AND finished_at < ?",
+                (*TERMINAL_STATUSES, time.time() - retention)
+            ).rowcount
+
+    def fail_orphans(self):
+        """Fails unfinished jobs whose worker process on this host no longer exists."""
+        host = socket.gethostname()
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT id, owner FROM jobs WHERE status IN ('queued', 'running') AND owner LIKE ?", (f"{host}:%",)
+            ).fetchall()
+            orphans = [row["id"] for row in rows if not _process_alive(int(row["owner"].rsplit(":", 1)[1]))]
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart', finished_at = ? WHERE id = ?",
+                [(time.time(), job_id) for job_id in orphans]
+            )
+        return len(orphans)
+
+
+def dedupe_key(kind: str, params: dict) -> str:
+    return hashlib.sha256(f"{kind}\n{json.dumps(params, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+
+def _job(row: sqlite3.Row) -> dict:
+    job = {key: row[key] for key in row.keys() if key not in ("dedupe_key", "owner")}
+    for column in JSON_COLUMNS:
+        job[column] = json.loads(job[column]) if job[column] is not None else None
+    return job
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """Runs jobs of registered kinds on a local thread pool and records them in a JobStore."""
+
+    def __init__(self, store: JobStore = None, max_workers: int = JOB_WORKERS, retention: float = JOB_RETENTION):
+        self.store = store or JobStore()
+        self.retention = retention
+        self.kinds: Dict[str, Callable[[dict, JobContext], dict]] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self.store.fail_orphans()
+        self.store.purge(retention)
+
+    def register(self, kind: str, fn: Callable[[dict, JobContext], dict]):
+        """`fn(params, context)` must return a JSON-serializable result."""
+        self.kinds[kind] = fn
+
+    def submit(self, kind: str, params: dict) -> dict:
+        """Queues a job, or returns the identical job that is already queued or running."""
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job, created = self.store.create_or_get(kind, params, self.owner)
+        if created:
+            self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def _run(self, job: dict):
+        started = time.time()
+        context = JobContext(self.store, job["id"])
+        self.store.update(job["id"], status="running", started_at=started)
+        try:
+            with context.stage("run"):
+                result = self.kinds[job["kind"]](job["params"], context)
+            status, error = "succeeded", None
+        except Exception as e:
+            logging.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            result, status, error = None, "failed", str(e)
+        timings = {"queued": started - job["created_at"], **context.timings}
+        self.store.update(job["id"], status=status, result=result, error=error, timings=timings,
+                          finished_at=time.time())
+        self.store.purge(self.retention)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """The process-wide job queue with the built-in job kinds registered."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                from lib.job_kinds import register_job_kinds
+                queue = JobQueue()
+                register_job_kinds(queue)
+                _queue = queue
+    return _queue
+
+
+def set_job_queue(queue: JobQueue):
+    global _queue
+    _queue = queue
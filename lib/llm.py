@@ -0,0 +1,215 @@
+"""Structured-output chat completions shared by the grammar, validation and generation calls."""
+import asyncio
+from typing import AsyncIterator, Callable, List, Optional, Type, TypeVar, get_args
+from pydantic import BaseModel
+from config.openai import get_client, get_async_client
+from lib import llm_router
+from lib.governor import get_governor
+from lib.llm_cache import get_response_cache, response_cache_key
+from lib.metrics import record_llm_usage, timed_llm_call
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def _cache_for(endpoint: Optional[str]):
+    cache = get_response_cache()
+    return cache if cache is not None and cache.enabled_for(endpoint) else None
+
+
+def _cached(cache, key: str, response_format: Type[T]) -> Optional[T]:
+    response = cache.get(key)
+    return response_format.model_validate_json(response) if response is not None else None
+
+
+def _store(cache, key: str, parsed):
+    # Refusals come back as None and are not cached
+    if parsed is not None:
+        cache.put(key, parsed.model_dump_json())
+
+
+def _answer(choice, model: str):
+    """The parsed answer, marked as verified when its response model declares a `_verified` private attribute."""
+    parsed = choice.message.parsed
+    if parsed is not None and "_verified" in type(parsed).__private_attributes__:
+        parsed._verified = llm_router.verified(choice, model)
+    return parsed
+
+
+def _used_tokens(completion) -> Optional[int]:
+    return getattr(getattr(completion, "usage", None), "total_tokens", None)
+
+
+def _complete(messages: List[dict], response_format: Type[T], model: str, openai_client, endpoint: Optional[str],
+              **kwargs):
+    def attempt():
+        with timed_llm_call(endpoint, model):
+            return (openai_client or get_client()).beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                **kwargs,
+            )
+
+    completion = get_governor("openai").call(attempt, tokens=llm_router.prompt_tokens(messages), key=endpoint,
+                                             used_tokens=_used_tokens)
+    record_llm_usage(endpoint, model, getattr(completion, "usage", None))
+    return completion.choices[0]
+
+
+async def _complete_async(messages: List[dict], response_format: Type[T], model: str, openai_client,
+                          endpoint: Optional[str], **kwargs):
+    async def attempt():
+        with timed_llm_call(endpoint, model):
+            return await (openai_client or get_async_client()).beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                **kwargs,
+            )
+
+    completion = await get_governor("openai").call_async(attempt, tokens=llm_router.prompt_tokens(messages),
+                                                         key=endpoint, used_tokens=_used_tokens)
+    record_llm_usage(endpoint, model, getattr(completion, "usage", None))
+    return completion.choices[0]
+
+
+def _parse_uncached(messages: List[dict], response_format: Type[T], models: List[str], openai_client,
+                    endpoint: Optional[str], accept: Optional[Callable[[T], bool]]) -> T:
+    """Tries each model in turn; every model but the last must give an acceptable answer to be used."""
+    tokens = llm_router.prompt_tokens(messages) if len(models) > 1 else None
+    for model in models[:-1]:
+        try:
+            choice = _complete(messages, response_format, model, openai_client, endpoint, logprobs=True)
+            reason = llm_router.escalation_reason(choice, accept)
+        except Exception as e:
+            if not llm_router.unusable(e):
+                raise
+            reason = type(e).__name__
+        if reason is None:
+            llm_router.record(endpoint, model, "answered", tokens)
+            return _answer(choice, model)
+        llm_router.record(endpoint, model, "escalated", tokens, reason)
+    parsed = _answer(_complete(messages, response_format, models[-1], openai_client, endpoint), models[-1])
+    if tokens is not None:
+        llm_router.record(endpoint, models[-1], "answered", tokens)
+    return parsed
+
+
+async def _parse_uncached_async(messages: List[dict], response_format: Type[T], models: List[str], openai_client,
+                                endpoint: Optional[str], accept: Optional[Callable[[T], bool]]) -> T:
+    tokens = llm_router.prompt_tokens(messages) if len(models) > 1 else None
+    for model in models[:-1]:
+        try:
+            choice = await _complete_async(messages, response_format, model, openai_client, endpoint, logprobs=True)
+            reason = llm_router.escalation_reason(choice, accept)
+        except Exception as e:
+            if not llm_router.unusable(e):
+                raise
+            reason = type(e).__name__
+        if reason is None:
+            llm_router.record(endpoint, model, "answered", tokens)
+            return _answer(choice, model)
+        llm_router.record(endpoint, model, "escalated", tokens, reason)
+    parsed = _answer(await _complete_async(messages, response_format, models[-1], openai_client, endpoint),
+                     models[-1])
+    if tokens is not None:
+        llm_router.record(endpoint, models[-1], "answered", tokens)
+    return parsed
+
+
+def parse(messages: List[dict], response_format: Type[T], model: Optional[str] = None, openai_client=None,
+          endpoint: Optional[str] = None, accept: Optional[Callable[[T], bool]] = None) -> T:
+    """
+    Returns the model's response to `messages` parsed into `response_format`.
+
+    `endpoint` ("grammar", "answer", "topics" or "questions") opts the call into the response
+    cache unless that endpoint is listed in LLM_CACHE_SKIP; identical concurrent calls then
+    share one upstream request. Without an explicit `model` the call is routed to a model
+    tier by `lib.llm_router`; `accept(parsed)` returning False escalates a small-tier answer.
+    A response model declaring a `_verified` private attribute has it set on fresh answers
+    (see `llm_router.verified`); cached answers keep its default.
+    """
+    models = [model] if model else llm_router.plan(endpoint, messages)
+    cache = _cache_for(endpoint)
+    if cache is None:
+        return _parse_uncached(messages, response_format, models, openai_client, endpoint, accept)
+
+    key = response_cache_key(",".join(models), messages, response_format)
+
+    def fetch():
+        parsed = _cached(cache, key, response_format)
+        if parsed is None:
+            parsed = _parse_uncached(messages, response_format, models, openai_client, endpoint, accept)
+            _store(cache, key, parsed)
+        return parsed
+
+    return cache.coalesce(key, fetch)
+
+
+async def parse_async(messages: List[dict], response_format: Type[T], model: Optional[str] = None,
+                      openai_client=None, endpoint: Optional[str] = None,
+                      accept: Optional[Callable[[T], bool]] = None) -> T:
+    models = [model] if model else llm_router.plan(endpoint, messages)
+    cache = _cache_for(endpoint)
+    if cache is None:
+        return await _parse_uncached_async(messages, response_format, models, openai_client, endpoint, accept)
+
+    key = response_cache_key(",".join(models), messages, response_format)
+
+    async def fetch():
+        parsed = await asyncio.to_thread(_cached, cache, key, response_format)
+        if parsed is None:
+            parsed = await _parse_uncached_async(messages, response_format, models, openai_client, endpoint, accept)
+            await asyncio.to_thread(_store, cache, key, parsed)
+        return parsed
+
+    return await cache.coalesce_async(key, fetch)
+
+
+async def stream_list_async(messages: List[dict], response_format: Type[BaseModel], field: str,
+                            model: Optional[str] = None, openai_client=None,
+                            endpoint: Optional[str] = None) -> AsyncIterator[BaseModel]:
+    """
+    Streams a structured response whose `field` is a list, yielding each item as soon as it is complete.
+
+    An item counts as complete once the partial JSON already contains the item after it;
+    the last items come from the final, fully validated response. A cached response is
+    replayed at once, and a completed stream is stored in the cache. Streams are not routed
+    to the small tier, since a rejected answer could not be taken back once items are out.
+    """
+    model = model or llm_router.plan(None, messages)[-1]
+    cache = _cache_for(endpoint)
+    key = response_cache_key(model, messages, response_format) if cache is not None else None
+    if cache is not None:
+        parsed = await asyncio.to_thread(_cached, cache, key, response_format)
+        if parsed is not None:
+            for item in getattr(parsed, field):
+                yield item
+            return
+
+    item_type = get_args(response_format.model_fields[field].annotation)[0]
+    emitted = 0
+    # The recorded latency includes time the consumer spends between items. A stream is not
+    # retried: the governor only admits it and counts its outcome.
+    async with get_governor("openai").slot_async(tokens=llm_router.prompt_tokens(messages),
+                                              key=f"{endpoint}_stream"):
+        with timed_llm_call(endpoint, model):
+            async with (openai_client or get_async_client()).beta.chat.completions.stream(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+            ) as stream:
+                async for event in stream:
+                    if event.type != "content.delta" or not isinstance(event.parsed, dict):
+                        continue
+                    items = event.parsed.get(field) or []
+                    while emitted < len(items) - 1:
+                        yield item_type.model_validate(items[emitted])
+                        emitted += 1
+                completion = await stream.get_final_completion()
+    record_llm_usage(endpoint, model, getattr(completion, "usage", None))
+    parsed = completion.choices[0].message.parsed
+    if cache is not None:
+        await asyncio.to_thread(_store, cache, key, parsed)
+    for item in getattr(parsed, field)[emitted:]:
+        yield item
@@ -0,0 +1,238 @@
+"""
+Cache of structured LLM responses keyed by (model, messages, response schema).
+
+Like the embedding cache it has an in-process LRU tier and an SQLite tier shared by all
+workers on the machine. Entries also expire after LLM_CACHE_TTL seconds. Identical requests
+that are in flight at the same time are coalesced: the first caller makes the upstream
+request and the others wait for its result.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+from constants import (DATA_DIR, LLM_CACHE, LLM_CACHE_SKIP, LLM_CACHE_TTL, LLM_CACHE_MEMORY_ENTRIES,
+                       LLM_CACHE_DISK_BYTES)
+
+LLM_CACHE_PATH = os.path.join(DATA_DIR, "llm_responses.sqlite3")
+
+
+def response_cache_key(model: str, messages: List[dict], response_format) -> str:
+    schema = json.dumps(response_format.model_json_schema(), sort_keys=True)
+    payload = json.dumps([model, messages, schema], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """Thread-safe LRU of at most `max_entries` responses, each with an expiry time."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, response: str, expires: float):
+        with self._lock:
+            self._entries[key] = (response, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskTier:
+    """SQLite store of responses capped at `max_bytes` of response text; expired entries are dropped first."""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_DISK_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_by_access ON responses (accessed)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(response)), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return row[0], row[1]
+
+    def put(self, key: str, response: str, expires: float):
+        with self._lock, self._conn:
+            # A replaced response no longer counts towards the cap
+            replaced = self._conn.execute("SELECT LENGTH(response) FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, response, expires, accessed) VALUES (?, ?, ?, ?)",
+                               (key, response, expires, time.time()))
+            self._size += len(response) - (replaced[0] if replaced else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drops expired entries, then least recently used ones, until the store is 10% under its cap."""
+        self._conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+        target = int(self.max_bytes * 0.9)
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(response)), 0) FROM responses").fetchone()[0]
+        while self._size > target:
+            rows = self._conn.execute("SELECT key, LENGTH(response) FROM responses ORDER BY accessed LIMIT 1000").fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self._size <= target:
+                    break
+                evicted.append((key,))
+                self._size -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+
+class _LeaderCancelled(Exception):
+    """Set on an in-flight request whose leader was cancelled, so its followers retry instead of failing."""
+
+
+class ResponseCache:
+    """Looks responses up in memory, then on disk, and coalesces identical in-flight requests."""
+
+    def __init__(self, memory: MemoryTier, disk: Optional[DiskTier] = None, ttl: float = LLM_CACHE_TTL,
+                 skip: List[str] = LLM_CACHE_SKIP):
+        self.memory = memory
+        self.disk = disk
+        self.ttl = ttl
+        self.skip = set(skip)
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._in_flight_async: Dict[tuple, asyncio.Future] = {}
+        self._counters = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "coalesced": 0}
+
+    def enabled_for(self, endpoint: Optional[str]) -> bool:
+        return endpoint is not None and endpoint not in self.skip
+
+    def _count(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        response = self.memory.get(key)
+        if response is not None:
+            self._count("hits", "memory_hits")
+            return response
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.put(key, *entry)
+                self._count("hits", "disk_hits")
+                return entry[0]
+        self._count("misses")
+        return None
+
+    def put(self, key: str, response: str):
+        expires = time.time() + self.ttl
+        self.memory.put(key, response, expires)
+        if self.disk is not None:
+            self.disk.put(key, response, expires)
+
+    def coalesce(self, key: str, fn):
+        """Runs `fn()` unless the same key is already being computed, in which case its result is shared."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def coalesce_async(self, key: str, fn):
+        """Async `coalesce`: `fn()` returns an awaitable; callers on the same event loop share it."""
+        loop = asyncio.get_running_loop()
+        in_flight_key = (id(loop), key)
+        future = self._in_flight_async.get(in_flight_key)
+        if future is not None:
+            self._count("coalesced")
+        while future is not None:
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # The leader's caller went away (e.g. a client disconnected): the first follower takes over
+                future = self._in_flight_async.get(in_flight_key)
+        future = self._in_flight_async[in_flight_key] = loop.create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._in_flight_async[in_flight_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return counters
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    """Replaces the process-wide cache; None restores the default."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Returns the process-wide cache configured from constants, or None when caching is off."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None and LLM_CACHE != "off":
+            try:
+                disk = DiskTier()
+            except sqlite3.Error as e:
+                logging.warning(f"LLM response disk cache unavailable, using memory only: {e}")
+                disk = None
+            _default_cache = ResponseCache(MemoryTier(), disk)
+    return _default_cache
@@ -0,0 +1,79 @@
+"""
+Model tier selection for `lib.llm` calls.
+
+A call is routed by its endpoint (the task) and prompt size: endpoints listed in
+LLM_SMALL_TIER_MAX_TOKENS try LLM_SMALL_MODEL first when the prompt fits, everything else
+goes straight to LLM_MODEL. A small-tier answer is escalated to the large model when it
+fails to parse or validate, when the caller's `accept` check rejects it, or when the
+model's mean token probability is below LLM_ESCALATION_CONFIDENCE.
+
+Every decision is logged and counted in `llm_routes_total`, next to the per-model latency
+and token metrics, so the savings can be measured.
+"""
+import json
+import logging
+import math
+from typing import Callable, List, Optional
+from pydantic import ValidationError
+from constants import (LLM_MODEL, LLM_ROUTING, LLM_SMALL_MODEL, LLM_SMALL_TIER_MAX_TOKENS,
+                       LLM_ESCALATION_CONFIDENCE)
+from lib.metrics import REGISTRY
+from lib.tokens import count_tokens
+
+LLM_ROUTES = REGISTRY.counter(
+    "llm_routes_total", "Model tier decisions per endpoint: answered by a tier, or escalated from it.",
+    ("endpoint", "model", "outcome"))
+
+# Raised by the OpenAI SDK when a structured response is cut off or filtered
+_UNUSABLE_RESPONSE_ERRORS = ("LengthFinishReasonError", "ContentFilterFinishReasonError")
+
+
+def prompt_tokens(messages: List[dict]) -> int:
+    return sum(count_tokens(message["content"]) for message in messages)
+
+
+def plan(endpoint: Optional[str], messages: List[dict]) -> List[str]:
+    """Models to try, in order, for a call."""
+    limit = LLM_SMALL_TIER_MAX_TOKENS.get(endpoint)
+    if LLM_ROUTING == "off" or limit is None or prompt_tokens(messages) > limit:
+        return [LLM_MODEL]
+    return [LLM_SMALL_MODEL, LLM_MODEL]
+
+
+def unusable(e: Exception) -> bool:
+    """Whether a failed call produced an invalid response, as opposed to not getting one at all."""
+    return isinstance(e, (ValidationError, json.JSONDecodeError)) or type(e).__name__ in _UNUSABLE_RESPONSE_ERRORS
+
+
+def confidence(choice) -> Optional[float]:
+    """Geometric mean probability of the response tokens, when the response carries logprobs."""
+    tokens = getattr(getattr(choice, "logprobs", None), "content", None)
+    if not tokens:
+        return None
+    return math.exp(sum(token.logprob for token in tokens) / len(tokens))
+
+
+def escalation_reason(choice, accept: Optional[Callable] = None) -> Optional[str]:
+    """Why a small-tier response should not be used, or None to use it."""
+    parsed = choice.message.parsed
+    if parsed is None:
+        return "refusal"
+    if accept is not None and not accept(parsed):
+        return "rejected"
+    probability = confidence(choice)
+    if probability is not None and probability < LLM_ESCALATION_CONFIDENCE:
+        return f"low confidence ({probability:.2f})"
+    return None
+
+
+def verified(choice, model: str) -> bool:
+    """Whether a used answer can be trusted like the large model's: it came from that model, or from a
+    smaller one whose confidence was measured (and, since it was not escalated, high enough)."""
+    return model == LLM_MODEL or confidence(choice) is not None
+
+
+def record(endpoint: Optional[str], model: str, outcome: str, tokens: int, reason: str = None):
+    endpoint = endpoint or "other"
+    LLM_ROUTES.inc(endpoint=endpoint, model=model, outcome=outcome)
+    logging.info(f"LLM route: endpoint={endpoint} prompt_tokens={tokens} model={model} outcome={outcome}"
+                 + (f" reason={reason}" if reason else ""))
@@ -0,0 +1,172 @@
+"""
+In-process metrics, rendered in the Prometheus text format by the `/metrics` endpoints.
+
+Hot-path code records stage latencies with `timed("stage")`. LLM calls also record token
+counts, and HTTP middleware records request latency per route. Cache hit rates are read
+from the embedding and response caches when the metrics are rendered. Every worker
+process keeps its own registry, so scrape each worker.
+"""
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_text(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_text(dict(zip(self.labelnames, key)))} {value}" for key, value in sorted(values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            # [per-bucket counts (last is +Inf), sum]
+            series = self._series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_label_text({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{self.name}_count{_label_text(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """`collector()` returns exposition lines computed at scrape time."""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = [line for metric in self.metrics for line in metric.render()]
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Latency of hot-path stages (splitting, language detection, embedding, vector queries, "
+    "serialization).", ("stage",))
+LLM_SECONDS = REGISTRY.histogram(
+    "llm_request_duration_seconds", "Latency of upstream LLM requests.", ("endpoint", "model"))
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens used by LLM requests.", ("endpoint", "model", "kind"))
+LLM_ERRORS = REGISTRY.counter(
+    "llm_request_errors_total", "LLM requests that raised.", ("endpoint", "model"))
+EMBEDDING_TOKENS = REGISTRY.counter(
+    "embedding_tokens_total", "Tokens sent to the embeddings API.", ("model",))
+HTTP_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests by route.", ("method", "route", "status"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+@contextmanager
+def timed_llm_call(endpoint: str, model: str):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        LLM_ERRORS.inc(endpoint=endpoint or "other", model=model)
+        raise
+    finally:
+        LLM_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint or "other", model=model)
+
+
+def record_llm_usage(endpoint: str, model: str, usage):
+    """Adds the prompt/completion token counts of a completion's `usage`, if the response had one."""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            LLM_TOKENS.inc(tokens, endpoint=endpoint or "other", model=model, kind=kind.split("_")[0])
+
+
+def _cache_lines() -> List[str]:
+    # Only caches the process already uses are reported: scraping must not import the cache
+    # modules, create a cache or open its SQLite file
+    caches = {name: getattr(sys.modules.get(module), "_default_cache", None)
+              for name, module in (("embedding", "document_processing.embedding_cache"),
+                                   ("llm_response", "lib.llm_cache"))}
+    stats = {name: cache.stats() for name, cache in caches.items() if cache is not None}
+    lines = []
+    for metric, kind, help, field in (
+            ("cache_hits_total", "counter", "Cache lookups answered from the cache.", "hits"),
+            ("cache_misses_total", "counter", "Cache lookups that missed.", "misses"),
+            ("cache_hit_ratio", "gauge", "Share of cache lookups that hit since the process started.", "hit_rate")):
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{cache="{name}"}} {values[field]}' for name, values in stats.items()]
+    return lines
+
+
+REGISTRY.add_collector(_cache_lines)
+
+
+def render() -> str:
+    return REGISTRY.render()
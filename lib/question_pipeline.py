@@ -0,0 +1,253 @@
+"""
+Question generation for a book, shared by both web apps and the background jobs.
+
+`num_questions` is spread over the book's (topic, subtopic) pairs, taking every main topic's
+first subtopic before any topic's second, so larger requests cover more of the book. Each
+pair gets its own retrieval and generation call, and the calls run concurrently, so latency
+follows the slowest pair rather than the total question count. Each pair is asked for one
+spare question; the batches are then merged round-robin and near-identical questions dropped.
+"""
+import asyncio
+import logging
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
+from constants import (QuestionType, GENERATION_MAX_TOPICS, GENERATION_MIN_QUESTIONS_PER_TOPIC,
+                       GENERATION_DEDUPE_SIMILARITY)
+from lib.generate_questions import (BookChunks, generate_questions, generate_questions_async,
+                                    generate_questions_stream_async, question_context, question_context_async)
+from lib.metrics import timed
+from lib.topic_index import get_topics, get_topics_async
+from models.schema_models import Question, TopicExtractionResponse
+
+# Spare questions asked of each pair when there are several, so duplicates can be dropped
+EXTRA_QUESTIONS = 1
+
+
+class GenerationRequestError(ValueError):
+    """The request cannot be served for this book: no text, no topics, or an unknown topic."""
+
+
+class TopicTarget(NamedTuple):
+    main_topic: str
+    subtopic: str
+    num_questions: int
+
+
+def _interleave(groups: List[list]) -> list:
+    """The first item of every group, then every group's second item, and so on."""
+    return [group[i] for i in range(max(map(len, groups), default=0)) for group in groups if i < len(group)]
+
+
+def plan_topics(topics: TopicExtractionResponse, num_questions: int, topic: Optional[str] = None,
+                subtopic: Optional[str] = None, max_topics: int = GENERATION_MAX_TOPICS,
+                min_per_topic: int = GENERATION_MIN_QUESTIONS_PER_TOPIC) -> List[TopicTarget]:
+    """
+    The (main topic, subtopic) pairs to generate questions about, with their share of `num_questions`.
+
+    `topic` limits the pairs to that main topic's subtopics, and `subtopic` to one pair. A topic
+    without subtopics counts as its own subtopic.
+    """
+    if num_questions < 1:
+        raise GenerationRequestError("num_questions must be at least 1.")
+    if not topics.main_topics:
+        raise GenerationRequestError("Not enough topics extracted.")
+    candidates = topics.main_topics
+    if topic is not None:
+        candidates = [t for t in topics.main_topics if t.topic.lower() == topic.lower()][:1]
+        if not candidates:
+            raise GenerationRequestError(f"Topic '{topic}' was not found in the book.")
+    if subtopic is not None:
+        pairs = [(candidates[0].topic, subtopic)]
+    else:
+        pairs = _interleave([[(t.topic, s) for s in t.subtopics or [t.topic]] for t in candidates])
+
+    count = max(1, min(len(pairs), max_topics, math.ceil(num_questions / max(min_per_topic, 1))))
+    shares = [num_questions // count + (i < num_questions % count) for i in range(count)]
+    return [TopicTarget(main, sub, share) for (main, sub), share in zip(pairs, shares)]
+
+
+def _words(question: Question) -> frozenset:
+    return frozenset(re.findall(r"\w+", question.question.lower()))
+
+
+def is_duplicate(words: frozenset, kept: List[frozenset], threshold: float = GENERATION_DEDUPE_SIMILARITY) -> bool:
+    """Whether a question's word set overlaps one of the `kept` ones by at least `threshold` (Jaccard)."""
+    return any(words == other or (words | other and len(words & other) / len(words | other) >= threshold)
+               for other in kept)
+
+
+def merge(batches: List[List[Question]], limit: int) -> List[Tuple[int, Question]]:
+    """Up to `limit` (batch index, question) pairs, taken round-robin from the batches, without near-duplicates."""
+    merged, kept = [], []
+    for index, question in _interleave([[(i, q) for q in batch] for i, batch in enumerate(batches)]):
+        words = _words(question)
+        if is_duplicate(words, kept):
+            continue
+        kept.append(words)
+        merged.append((index, question))
+        if len(merged) == limit:
+            break
+    return merged
+
+
+def _extra(targets: List[TopicTarget]) -> int:
+    return EXTRA_QUESTIONS if len(targets) > 1 else 0
+
+
+def _batches(targets: List[TopicTarget], outcomes: list) -> List[List[Question]]:
+    """Per-target questions; a failed target contributes none, unless all failed."""
+    failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    if len(failures) == len(outcomes):
+        raise failures[0]
+    for target, outcome in zip(targets, outcomes):
+        if isinstance(outcome, BaseException):
+            logging.warning(f"Question generation for '{target.main_topic}: {target.subtopic}' failed: {outcome}")
+    return [[] if isinstance(outcome, BaseException) else outcome.questions for outcome in outcomes]
+
+
+def _result(targets: List[TopicTarget], batches: List[List[Question]], num_questions: int) -> dict:
+    merged = merge(batches, num_questions)
+    with timed("serialization"):
+        return {
+            "topics": [{"main_topic": target.main_topic, "subtopic": target.subtopic,
+                        "num_questions": sum(1 for index, _ in merged if index == i)}
+                       for i, target in enumerate(targets)],
+            "questions": [question.model_dump() for _, question in merged],
+        }
+
+
+def load_book(subject: str, book: str) -> Tuple[BookChunks, TopicExtractionResponse]:
+    """The book's chunks, fetched only if needed, and topics."""
+    chunks = BookChunks(subject, book)
+    topics = get_topics(subject, book, chunks)
+    if topics is None:
+        raise GenerationRequestError("No text generated.")
+    return chunks, topics
+
+
+async def load_book_async(subject: str, book: str) -> Tuple[BookChunks, TopicExtractionResponse]:
+    chunks = BookChunks(subject, book)
+    topics = await get_topics_async(subject, book, chunks)
+    if topics is None:
+        raise GenerationRequestError("No text generated.")
+    return chunks, topics
+
+
+def generate_for_targets(subject: str, book: str, chunks: BookChunks, targets: List[TopicTarget],
+                         question_type: QuestionType = "text_based", client=None) -> dict:
+    """
+    Generates every target's questions concurrently and merges them.
+
+    Returns `{"topics": [{"main_topic", "subtopic", "num_questions"}], "questions": [...]}`,
+    where `num_questions` counts the questions a topic contributed after deduplication.
+    """
+    extra = _extra(targets)
+
+    def run(target: TopicTarget):
+        context = question_context(subject, book, target.main_topic, target.subtopic, chunks, client=client)
+        return generate_questions(target.main_topic, target.subtopic, context, question_type,
+                                  target.num_questions + extra)
+
+    def attempt(target: TopicTarget):
+        try:
+            return run(target)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="generation") as pool:
+        outcomes = list(pool.map(attempt, targets))
+    return _result(targets, _batches(targets, outcomes), sum(target.num_questions for target in targets))
+
+
+async def generate_for_targets_async(subject: str, book: str, chunks: BookChunks, targets: List[TopicTarget],
+                                     question_type: QuestionType = "text_based", client=None) -> dict:
+    extra = _extra(targets)
+
+    async def run(target: TopicTarget):
+        context = await question_context_async(subject, book, target.main_topic, target.subtopic, chunks,
+                                               client=client)
+        return await generate_questions_async(target.main_topic, target.subtopic, context, question_type,
+                                              target.num_questions + extra)
+
+    outcomes = await asyncio.gather(*(run(target) for target in targets), return_exceptions=True)
+    return _result(targets, _batches(targets, outcomes), sum(target.num_questions for target in targets))
+
+
+def generate_for_book(subject: str, book: str, num_questions: int = 5, question_type: QuestionType = "text_based",
+                      topic: Optional[str] = None, subtopic: Optional[str] = None, client=None) -> dict:
+    """`/generate/questions`: questions about the book spread over its topics (see `generate_for_targets`)."""
+    chunks, topics = load_book(subject, book)
+    targets = plan_topics(topics, num_questions, topic, subtopic)
+    return generate_for_targets(subject, book, chunks, targets, question_type, client)
+
+
+async def generate_for_book_async(subject: str, book: str, num_questions: int = 5,
+                                  question_type: QuestionType = "text_based", topic: Optional[str] = None,
+                                  subtopic: Optional[str] = None, client=None) -> dict:
+    chunks, topics = await load_book_async(subject, book)
+    targets = plan_topics(topics, num_questions, topic, subtopic)
+    return await generate_for_targets_async(subject, book, chunks, targets, question_type, client)
+
+
+async def stream_for_targets_async(subject: str, book: str, chunks: BookChunks, targets: List[TopicTarget],
+                                   question_type: QuestionType = "text_based") -> AsyncIterator[dict]:
+    """
+    Events for `/generate/questions/stream`: a `topic` event per target, then `question` events
+    as the concurrent streams produce them, and an `error` event for each target that failed.
+
+    A target's questions beyond its share are held back and only used, deduplicated, to make
+    up for targets that fell short.
+    """
+    extra = _extra(targets)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run(index: int, target: TopicTarget):
+        try:
+            context = await question_context_async(subject, book, target.main_topic, target.subtopic, chunks)
+            async for question in generate_questions_stream_async(target.main_topic, target.subtopic, context,
+                                                                  question_type, target.num_questions + extra):
+                await queue.put((index, question, None))
+        except Exception as e:
+            await queue.put((index, None, e))
+        finally:
+            await queue.put((index, None, None))
+
+    def accept(index: int, question: Question) -> Optional[dict]:
+        words = _words(question)
+        if is_duplicate(words, kept):
+            return None
+        kept.append(words)
+        emitted[index] += 1
+        return {"event": "question", "main_topic": targets[index].main_topic, "subtopic": targets[index].subtopic,
+                **question.model_dump()}
+
+    for target in targets:
+        yield {"event": "topic", **target._asdict()}
+    tasks = [asyncio.create_task(run(i, target)) for i, target in enumerate(targets)]
+    limit = sum(target.num_questions for target in targets)
+    emitted, spare, kept, running = [0] * len(targets), [], [], len(targets)
+    try:
+        while running and sum(emitted) < limit:
+            index, question, error = await queue.get()
+            if error is not None:
+                yield {"event": "error", "main_topic": targets[index].main_topic,
+                       "subtopic": targets[index].subtopic, "detail": str(error)}
+            elif question is None:
+                running -= 1
+            elif emitted[index] >= targets[index].num_questions:
+                spare.append((index, question))
+            else:
+                line = accept(index, question)
+                if line is not None:
+                    yield line
+        for index, question in spare:
+            if sum(emitted) >= limit:
+                break
+            line = accept(index, question)
+            if line is not None:
+                yield line
+    finally:
+        for task in tasks:
+            task.cancel()
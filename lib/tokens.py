@@ -0,0 +1,51 @@
+import logging
+import math
+from functools import lru_cache
+from constants import LLM_MODEL
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English) used for batching decisions."""
+    return max(1, math.ceil(len(text) / 4))
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # tiktoken is optional; without it prompt budgets fall back to the estimate above. The result,
+    # fallback included, is cached, so a failure is only logged once.
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(LLM_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use, which fails offline or behind a proxy
+        logging.warning(f"tiktoken encoding unavailable, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of `text` for LLM_MODEL: exact with tiktoken installed, estimated otherwise."""
+    encoding = _encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def pack_texts(texts, budget: int) -> list:
+    """
+    Indices of the texts, taken in the given order, that fit into `budget` tokens together.
+
+    A text that does not fit is skipped so a shorter one further down can still be used.
+    """
+    selected, used = [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if used + tokens <= budget:
+            selected.append(i)
+            used += tokens
+    return selected
@@ -0,0 +1,112 @@
+"""
+Per-book index of extracted topics, so topic extraction runs once per book version.
+
+Entries are keyed by (subject, title) and stamped with the content hash of the book's
+chunks. Lookups use the hash the ingestion manifest recorded, so a hit needs no chunks from
+the index; a book re-ingested with changes misses, and the entry is rebuilt.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import List, Optional
+from constants import DATA_DIR
+from document_processing.manifest import chunk_hash, content_hash, document_content_hash
+from lib.generate_questions import BookChunks, extract_all_topics, extract_all_topics_async
+from models.schema_models import TopicExtractionResponse
+
+TOPIC_INDEX_PATH = os.path.join(DATA_DIR, "topics.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS topics (
+    subject TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    topics TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (subject, title)
+);
+"""
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    path = path or TOPIC_INDEX_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def content_version(results: List[dict]) -> str:
+    """Content hash of a book's chunks as returned by `generate()`; matches the ingestion manifest."""
+    return content_hash([chunk_hash(res["text"]) for res in results])
+
+
+def load_topics(subject: str, title: str, version: str, path: str = None) -> Optional[TopicExtractionResponse]:
+    with closing(connect(path)) as conn:
+        row = conn.execute(
+            "SELECT topics FROM topics WHERE subject = ? AND title = ? AND content_hash = ?", (subject, title, version)
+        ).fetchone()
+    return TopicExtractionResponse.model_validate_json(row[0]) if row else None
+
+
+def save_topics(subject: str, title: str, version: str, topics: TopicExtractionResponse, path: str = None):
+    with closing(connect(path)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO topics (subject, title, content_hash, topics, created_at) VALUES (?, ?, ?, ?, ?)",
+            (subject, title, version, topics.model_dump_json(), time.time()),
+        )
+
+
+def _no_topics(subject: str, title: str) -> TopicExtractionResponse:
+    # The model refused: nothing is stored, so the next request tries again
+    logging.warning(f"Topic extraction for '{title}' in '{subject}' returned no result.")
+    return TopicExtractionResponse(main_topics=[])
+
+
+def cached_topics(subject: str, title: str, path: str = None,
+                  manifest_path: str = None) -> Optional[TopicExtractionResponse]:
+    """The stored topics of the book's current version, as recorded by the ingestion manifest."""
+    version = document_content_hash(subject, title, manifest_path)
+    return load_topics(subject, title, version, path) if version is not None else None
+
+
+def get_topics(subject: str, title: str, chunks: BookChunks, path: str = None,
+               manifest_path: str = None) -> Optional[TopicExtractionResponse]:
+    """
+    Returns the book's topics, extracting and storing them only if this version has not been seen.
+
+    The book's `chunks` are only fetched on a miss. Returns None when the book has no chunks;
+    a refused extraction gives an empty topic list, which is not stored.
+    """
+    topics = cached_topics(subject, title, path, manifest_path)
+    if topics is None:
+        results = chunks.get()
+        if not results:
+            return None
+        topics = extract_all_topics(results)
+        if topics is None:
+            return _no_topics(subject, title)
+        save_topics(subject, title, content_version(results), topics, path)
+    return topics
+
+
+async def get_topics_async(subject: str, title: str, chunks: BookChunks, path: str = None,
+                           manifest_path: str = None) -> Optional[TopicExtractionResponse]:
+    topics = await asyncio.to_thread(cached_topics, subject, title, path, manifest_path)
+    if topics is None:
+        results = await chunks.get_async()
+        if not results:
+            return None
+        topics = await extract_all_topics_async(results)
+        if topics is None:
+            return _no_topics(subject, title)
+        await asyncio.to_thread(save_topics, subject, title, content_version(results), topics, path)
+    return topics
+
+
+def build_topic_index(subject: str, title: str, path: str = None) -> Optional[TopicExtractionResponse]:
+    """Builds the topic entry for a freshly ingested book; a no-op if its content has not changed."""
+    return get_topics(subject, title, BookChunks(subject, title), path)
@@ -1,13 +1,23 @@
 from typing import List, Union
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from constants import QuestionType
 
 class GrammarModel(BaseModel):
     sentence: str
     corrected_sentence: str
     errors: List[str]  # Explicitly specify list items as strings
+    # Set by lib.llm when the large model tier gave the answer, or a small-tier answer was confident enough
+    # to keep; not serialized, so an answer replayed from the response cache is not verified
+    _verified: bool = PrivateAttr(default=False)
 
 
+class GrammarFailure(GrammarModel):
+    error: str  # Why the sentence could not be checked; the sentence is returned unchanged
+
+class GrammarBatchModel(BaseModel):
+    results: List[GrammarModel]  # One entry per input sentence, in input order
+    _verified: bool = PrivateAttr(default=False)  # Copied to every result, see GrammarModel
+
 class IncorrectFact(BaseModel):
     statement: str  # Example: "World War 1 did not happen in 1990"
     explanation: str  # Example: "World War 1 started in 1914 and ended in 1918."
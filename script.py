@@ -61,7 +61,7 @@ def main():
         # print(result['text'])
    
     topics = extract_all_topics(results)
-    combined_texts = "\n".join(["\n".join(res["text"]) for res in results])
+    combined_texts = "\n".join([res["text"] for res in results])
     # print(type(topics))
     # print(topics)
 
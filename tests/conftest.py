@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Before any repo module reads constants: stub credentials and a throwaway data directory
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="tests-"))
+os.environ.setdefault("LLM_CACHE", "off")
+os.environ.setdefault("GRAMMAR_TRIAGE", "off")
@@ -0,0 +1,45 @@
+"""A failed context retrieval is reported on each batch item, not as missing context."""
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.stubs import install_stub_backends
+from lib.governor import Governor, get_governor, set_governor
+
+ITEMS = [{"question": f"Which force acts in case {i}?", "user_answer": "Gravity.", "subject": "physics"}
+         for i in range(3)]
+
+
+@pytest.fixture(params=["fastapi", "flask"])
+def client(request):
+    # Every OpenAI call, including the embeddings request, fails with a non-retryable error
+    install_stub_backends(0.0, index_latency=0.0, error_rate=1.0)
+    if request.param == "fastapi":
+        from app import app
+        return TestClient(app)
+    from flask_app import app
+    return app.test_client()
+
+
+@pytest.fixture
+def open_circuit():
+    previous = get_governor("openai")
+    governor = Governor("openai", 4)
+    for _ in range(governor.breaker.failures):
+        governor.breaker.record("failed")
+    set_governor("openai", governor)
+    yield
+    set_governor("openai", previous)
+
+
+def test_embedding_failure_is_an_item_error(client):
+    response = client.post("/answer/analyze/batch", json={"items": ITEMS})
+    assert response.status_code == 200
+    results = (response.get_json() if hasattr(response, "get_json") else response.json())["results"]
+    assert len(results) == len(ITEMS)
+    assert all("Injected OpenAI failure" in result["error"] for result in results)
+
+
+def test_unavailable_embeddings_fail_the_batch(client, open_circuit):
+    response = client.post("/answer/analyze/batch", json={"items": ITEMS})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
@@ -0,0 +1,12 @@
+import os
+
+from document_processing.embedding_cache import DiskTier
+
+
+def test_disk_tier_size_counts_replaced_vectors_once(tmp_path):
+    disk = DiskTier(os.path.join(tmp_path, "embeddings.sqlite3"), max_bytes=10_000)
+    for _ in range(10):
+        disk.put_many({"key": [0.5] * 16, "other": [0.25] * 16})
+    # 16 float32 values take 64 bytes
+    assert disk._size == 128
+    assert disk.get_many(["key"]) == {"key": [0.5] * 16}
@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+from lib.governor import AdaptiveLimit, CircuitBreaker, Governor, TokenBucket, UpstreamBusy, UpstreamUnavailable
+
+
+def _open_breaker(governor):
+    for _ in range(governor.breaker.failures):
+        governor.breaker.record("failed")
+
+
+def test_concurrency_rejection_refunds_the_budget():
+    governor = Governor("test", 1, rpm=10, tpm=1000, max_wait=0.01)
+    assert governor.concurrency.acquire(0)
+    with pytest.raises(UpstreamBusy):
+        governor.call(lambda: "unreachable", tokens=300)
+    assert governor.requests.level == pytest.approx(10, abs=0.01)
+    assert governor.tokens.level == pytest.approx(1000, abs=1)
+
+
+def test_open_breaker_rejection_refunds_the_budget():
+    governor = Governor("test", 4, rpm=10, tpm=1000)
+    _open_breaker(governor)
+    with pytest.raises(UpstreamUnavailable):
+        governor.call(lambda: "unreachable", tokens=300)
+    assert governor.requests.level == pytest.approx(10, abs=0.01)
+    assert governor.tokens.level == pytest.approx(1000, abs=1)
+    assert governor.concurrency.in_flight == 0
+
+
+def test_cancelled_call_records_no_outcome():
+    governor = Governor("test", 4)
+
+    async def main():
+        task = asyncio.ensure_future(governor.call_async(lambda: asyncio.sleep(10), key="slow"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert governor.concurrency.in_flight == 0
+    assert governor.concurrency.limit == 4
+    assert "slow" not in governor.concurrency._latency
+
+
+def test_cancelled_probe_lets_the_next_probe_through():
+    governor = Governor("test", 4)
+    _open_breaker(governor)
+    governor.breaker.opened_at -= governor.breaker.reset
+
+    async def main():
+        async def cancelled():
+            async with governor.slot_async():
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(cancelled())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await governor.call_async(lambda: asyncio.sleep(0, "probed"))
+
+    assert asyncio.run(main()) == "probed"
+    assert not governor.breaker.is_open
+
+
+class Throttled(Exception):
+    status_code = 429
+    headers = {"retry-after": "0.01"}
+
+
+class Failed(Exception):
+    status_code = 503
+    headers = {"retry-after": "0.01"}
+
+
+class Invalid(Exception):
+    status_code = 400
+
+
+def _failing(error, times):
+    calls = []
+
+    def fn():
+        calls.append(None)
+        if len(calls) <= times:
+            raise error("upstream says no")
+        return "ok"
+
+    return fn, calls
+
+
+def test_token_bucket_waits_for_refill_and_rejects_past_max_wait():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60, max_wait=0) == 0
+    # One unit refills per second
+    assert bucket.reserve(2, max_wait=5) == pytest.approx(2, abs=0.05)
+    assert bucket.reserve(10, max_wait=5) is None
+    # A refund takes the bucket back out of debt
+    bucket.refund(2)
+    assert bucket.reserve(1, max_wait=2) == pytest.approx(1, abs=0.05)
+
+
+def test_budget_exhaustion_is_busy():
+    governor = Governor("test", 4, rpm=1, max_wait=0.01)
+    assert governor.call(lambda: "ok") == "ok"
+    with pytest.raises(UpstreamBusy):
+        governor.call(lambda: "ok")
+
+
+def test_limit_halves_on_throttling_and_grows_back_additively():
+    limit = AdaptiveLimit(8)
+    limit.acquire(0)
+    limit.release("throttled", 0.01)
+    assert limit.limit == 4
+    for _ in range(4):
+        limit.acquire(0)
+        limit.release("ok", 0.01)
+    assert limit.limit == pytest.approx(5, abs=0.1)
+
+
+def test_slow_calls_shrink_the_limit_by_ten_percent():
+    limit = AdaptiveLimit(10, tolerance=2)
+    limit.acquire(0)
+    limit.release("ok", 0.01, key="grammar")
+    limit.acquire(0)
+    limit.release("ok", 1.0, key="grammar")
+    assert limit.limit == pytest.approx(9)
+
+
+def test_retries_transient_errors_then_succeeds():
+    fn, calls = _failing(Throttled, 2)
+    assert Governor("test", 4, max_retries=3).call(fn) == "ok"
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("error, raised", [(Throttled, UpstreamBusy), (Failed, UpstreamUnavailable)])
+def test_errors_left_after_retries_map_to_busy_or_unavailable(error, raised):
+    fn, calls = _failing(error, 10)
+    with pytest.raises(raised) as info:
+        Governor("test", 4, max_retries=1).call(fn)
+    assert len(calls) == 2
+    assert info.value.status_code == {UpstreamBusy: 429, UpstreamUnavailable: 503}[raised]
+
+
+def test_invalid_requests_are_raised_unchanged_without_retry():
+    fn, calls = _failing(Invalid, 10)
+    with pytest.raises(Invalid):
+        Governor("test", 4).call(fn)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_after_a_good_probe():
+    governor = Governor("test", 4, max_retries=0)
+    fn, calls = _failing(Failed, governor.breaker.failures)
+    for _ in range(governor.breaker.failures):
+        with pytest.raises(UpstreamUnavailable):
+            governor.call(fn)
+    assert governor.breaker.is_open
+    with pytest.raises(UpstreamUnavailable):
+        governor.call(fn)
+    assert len(calls) == governor.breaker.failures
+
+    # Half-open: once the reset period is over a single probe goes through
+    governor.breaker.opened_at -= governor.breaker.reset
+    assert governor.breaker.allow() is None
+    assert governor.breaker.allow() is not None
+    governor.breaker.record("ok")
+    assert not governor.breaker.is_open
+    assert governor.call(fn) == "ok"
+
+
+def test_failed_probe_keeps_the_breaker_open():
+    breaker = CircuitBreaker(failures=2, reset=60)
+    breaker.record("failed")
+    breaker.record("failed")
+    breaker.opened_at -= 60
+    assert breaker.allow() is None
+    breaker.record("failed")
+    assert breaker.is_open and breaker.allow() is not None
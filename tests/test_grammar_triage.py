@@ -0,0 +1,88 @@
+import math
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.stubs import StubOpenAI
+from lib import grammar_triage
+from lib.grammar_check import grammar
+from lib.grammar_triage import CleanSentenceStore, remember_clean
+from models.schema_models import GrammarModel
+
+
+class ConfidentStub(StubOpenAI):
+    """Stub whose responses carry logprobs giving every response the same `confidence`."""
+
+    def __init__(self, confidence=None, **kwargs):
+        super().__init__(latency=0, **kwargs)
+        parse = self.beta.chat.completions.parse
+
+        def parse_with_logprobs(*args, **kwargs):
+            completion = parse(*args, **kwargs)
+            if confidence is not None:
+                completion.choices[0].logprobs = SimpleNamespace(
+                    content=[SimpleNamespace(logprob=math.log(confidence))])
+            return completion
+
+        self.beta.chat.completions.parse = parse_with_logprobs
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CleanSentenceStore(str(tmp_path / "clean.sqlite3"))
+    grammar_triage.set_clean_store(store)
+    yield store
+    grammar_triage.set_clean_store(None)
+
+
+def _verified(sentence, verified=True):
+    result = GrammarModel(sentence=sentence, corrected_sentence=sentence, errors=[])
+    result._verified = verified
+    return result
+
+
+def test_contains_many_exceeds_bound_parameter_limit(tmp_path):
+    limit = sqlite3.connect(":memory:").getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    store = CleanSentenceStore(str(tmp_path / "clean.sqlite3"))
+    sentences = [f"Sentence number {i} is fine." for i in range(limit + 1)]
+    store.add_many(sentences[::2])
+    assert store.contains_many(sentences) == [i % 2 == 0 for i in range(len(sentences))]
+
+
+def test_verdicts_are_kept_per_model_and_prompt_version(tmp_path):
+    path = str(tmp_path / "clean.sqlite3")
+    CleanSentenceStore(path, version="model-a:1").add_many(["The cat sat."])
+    assert CleanSentenceStore(path, version="model-a:1").contains_many(["The cat sat."]) == [True]
+    assert CleanSentenceStore(path, version="model-a:2").contains_many(["The cat sat."]) == [False]
+    assert CleanSentenceStore(path, version="model-b:1").contains_many(["The cat sat."]) == [False]
+
+
+def test_expired_verdicts_are_checked_again(tmp_path):
+    store = CleanSentenceStore(str(tmp_path / "clean.sqlite3"), ttl=0)
+    store.add_many(["The cat sat."])
+    assert store.contains_many(["The cat sat."]) == [False]
+
+
+def test_least_recently_matched_verdicts_are_evicted(tmp_path):
+    store = CleanSentenceStore(str(tmp_path / "clean.sqlite3"), max_entries=4)
+    sentences = [f"Sentence {i} is fine." for i in range(5)]
+    for sentence in sentences[:4]:
+        store.add_many([sentence])
+        time.sleep(0.001)
+    store.contains_many(sentences[:1])
+    time.sleep(0.001)
+    store.add_many(sentences[4:])
+    assert store.contains_many(sentences) == [True, False, False, True, True]
+
+
+def test_only_verified_results_are_remembered(store):
+    remember_clean([_verified("Trusted."), _verified("Unverified.", False)], "conservative")
+    assert store.contains_many(["Trusted.", "Unverified."]) == [True, False]
+
+
+@pytest.mark.parametrize("confidence, verified", [(None, False), (0.95, True)])
+def test_small_tier_answers_are_verified_only_when_confident(confidence, verified):
+    result = grammar("The cat sat on the mat.", openai_client=ConfidentStub(confidence))
+    assert result._verified is verified
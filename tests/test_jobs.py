@@ -0,0 +1,55 @@
+import io
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from document_processing import store_vector
+from lib import job_kinds
+from lib.jobs import JobContext, JobStore
+
+
+@pytest.fixture(params=["fastapi", "flask"])
+def post_upload(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_kinds, "UPLOADS_DIR", str(tmp_path / "uploads"))
+    if request.param == "fastapi":
+        from app import app
+        client = TestClient(app)
+        return lambda content: client.post("/jobs/ingest", files={"file": ("notes.txt", content)},
+                                           data={"subject": "physics"})
+    from flask_app import app
+    client = app.test_client()
+    return lambda content: client.post("/jobs/ingest", data={"file": (io.BytesIO(content), "notes.txt"),
+                                                             "subject": "physics"})
+
+
+def test_non_pdf_upload_is_rejected(post_upload, tmp_path):
+    assert post_upload(b"just some text").status_code == 400
+    assert os.listdir(tmp_path / "uploads") == []
+
+
+def test_upload_is_removed_once_ingested(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_vector, "store_pdf_in_pinecone", lambda *args, **kwargs: {"chunks": 1})
+    root = str(tmp_path / "uploads")
+    monkeypatch.setattr(job_kinds, "UPLOADS_DIR", root)
+    path = job_kinds.save_upload(io.BytesIO(b"%PDF-1.7\n..."), "book.pdf")
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    job, _ = store.create_or_get("ingest", {"path": path, "subject": "physics"}, "test:1")
+
+    assert job_kinds.ingest_job(job["params"], JobContext(store, job["id"])) == {"chunks": 1}
+    assert os.listdir(root) == []
+
+
+def test_finished_jobs_are_purged_after_retention(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    old, _ = store.create_or_get("ingest", {"n": 1}, "test:1")
+    recent, _ = store.create_or_get("ingest", {"n": 2}, "test:1")
+    running, _ = store.create_or_get("ingest", {"n": 3}, "test:1")
+    store.update(old["id"], status="succeeded", finished_at=time.time() - 120)
+    store.update(recent["id"], status="failed", finished_at=time.time())
+    store.update(running["id"], status="running")
+
+    assert store.purge(retention=60) == 1
+    assert store.get(old["id"]) is None
+    assert store.get(recent["id"]) is not None and store.get(running["id"]) is not None
@@ -0,0 +1,36 @@
+import sqlite3
+from contextlib import closing
+
+from db_queries.lexical_index import LexicalIndex
+
+
+def _ids(index, subject, query):
+    return [hit["id"] for hit in index.search(subject, query)]
+
+
+def test_search_stays_within_the_subject(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    index.add("world history", "Book", [("h1", "The printing press spread ideas.")])
+    index.add("ancient world history", "Book", [("a1", "The printing press came much later.")])
+    index.add("physics", "Book", [("p1", "A press applies force over an area."),
+                                  ("p2", "Physics of the printing press.")])
+    assert _ids(index, "world history", "printing press") == ["h1"]
+    assert sorted(_ids(index, "physics", "printing press")) == ["p1", "p2"]
+    assert _ids(index, "chemistry", "printing press") == []
+
+
+def test_index_without_subject_column_is_rebuilt(tmp_path):
+    path = str(tmp_path / "lexical.sqlite3")
+    with closing(sqlite3.connect(path)) as conn, conn:
+        conn.executescript("""
+            CREATE TABLE chunk_texts (subject TEXT NOT NULL, vector_id TEXT NOT NULL, title TEXT NOT NULL,
+                                      text TEXT NOT NULL, PRIMARY KEY (subject, vector_id));
+            CREATE VIRTUAL TABLE chunk_fts USING fts5(text, content='chunk_texts', content_rowid='rowid');
+            INSERT INTO chunk_texts VALUES ('physics', 'p1', 'Book', 'Momentum is conserved.');
+            INSERT INTO chunk_fts (chunk_fts) VALUES ('rebuild');
+        """)
+    index = LexicalIndex(path)
+    assert _ids(index, "physics", "momentum") == ["p1"]
+    index.add("physics", "Book", [("p2", "Momentum equals mass times velocity.")])
+    index.delete("physics", ["p1"])
+    assert _ids(index, "physics", "momentum") == ["p2"]
@@ -0,0 +1,33 @@
+import asyncio
+import os
+
+from lib.llm_cache import DiskTier, MemoryTier, ResponseCache
+
+
+def test_followers_survive_cancelled_leader():
+    cache = ResponseCache(MemoryTier())
+    calls = []
+
+    async def fetch():
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.create_task(cache.coalesce_async("key", fetch))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(cache.coalesce_async("key", fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(*followers)
+
+    # One follower takes over as leader and the others share its result
+    assert asyncio.run(main()) == [2, 2, 2]
+
+
+def test_disk_tier_size_counts_replaced_responses_once(tmp_path):
+    disk = DiskTier(os.path.join(tmp_path, "responses.sqlite3"), max_bytes=100)
+    for _ in range(10):
+        disk.put("key", "x" * 60, float("inf"))
+    assert disk._size == 60
+    assert disk.get("key") is not None
@@ -0,0 +1,76 @@
+import json
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.stubs import StubOpenAI
+from constants import LLM_MODEL, LLM_SMALL_MODEL
+from lib import llm_router
+from lib.llm import parse
+from models.schema_models import GrammarModel
+
+MESSAGES = [{"role": "user", "content": "The cat sat on the mat."}]
+
+
+class TieredStub(StubOpenAI):
+    """Stub answering with the given mean token probability per model, or raising that model's error."""
+
+    def __init__(self, confidence):
+        super().__init__(latency=0)
+        self.models, self.answers = [], []
+        parse_completion = self.beta.chat.completions.parse
+
+        def parse_tiered(model, messages, response_format, **kwargs):
+            self.models.append(model)
+            outcome = confidence[model]
+            if isinstance(outcome, Exception):
+                raise outcome
+            completion = parse_completion(model, messages, response_format, **kwargs)
+            choice = completion.choices[0]
+            choice.logprobs = SimpleNamespace(content=[SimpleNamespace(logprob=math.log(outcome))])
+            self.answers.append(choice.message.parsed)
+            return completion
+
+        self.beta.chat.completions.parse = parse_tiered
+
+
+def _parse(client, **kwargs):
+    return parse(MESSAGES, GrammarModel, openai_client=client, endpoint="grammar", **kwargs)
+
+
+def test_confident_small_tier_answer_is_used():
+    client = TieredStub({LLM_SMALL_MODEL: 0.99, LLM_MODEL: 0.99})
+    assert _parse(client) is client.answers[0]
+    assert client.models == [LLM_SMALL_MODEL]
+
+
+def test_low_confidence_escalates_to_the_large_model():
+    escalations = ("grammar", LLM_SMALL_MODEL, "escalated")
+    before = llm_router.LLM_ROUTES._values.get(escalations, 0)
+    client = TieredStub({LLM_SMALL_MODEL: 0.3, LLM_MODEL: 0.99})
+    assert _parse(client) is client.answers[1]
+    assert client.models == [LLM_SMALL_MODEL, LLM_MODEL]
+    assert llm_router.LLM_ROUTES._values[escalations] == before + 1
+
+
+def test_rejected_answer_escalates():
+    client = TieredStub({LLM_SMALL_MODEL: 0.99, LLM_MODEL: 0.99})
+    _parse(client, accept=lambda parsed: False)
+    assert client.models == [LLM_SMALL_MODEL, LLM_MODEL]
+
+
+def test_unusable_response_escalates_but_other_errors_are_raised():
+    client = TieredStub({LLM_SMALL_MODEL: ValueError("not JSON"), LLM_MODEL: 0.99})
+    with pytest.raises(ValueError):
+        _parse(client)
+    client = TieredStub({LLM_SMALL_MODEL: json.JSONDecodeError("cut off", "{", 1), LLM_MODEL: 0.99})
+    assert _parse(client) is client.answers[0]
+    assert client.models == [LLM_SMALL_MODEL, LLM_MODEL]
+
+
+def test_long_prompts_and_untiered_endpoints_go_straight_to_the_large_model():
+    long_prompt = [{"role": "user", "content": "word " * (llm_router.LLM_SMALL_TIER_MAX_TOKENS["grammar"] + 1)}]
+    assert llm_router.plan("grammar", long_prompt) == [LLM_MODEL]
+    assert llm_router.plan("answer", MESSAGES) == [LLM_MODEL]
+    assert llm_router.plan("grammar", MESSAGES) == [LLM_SMALL_MODEL, LLM_MODEL]
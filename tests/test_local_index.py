@@ -0,0 +1,71 @@
+from db_queries.vector_store import LocalIndex
+
+
+def _ids(index, namespace="ns", **kwargs):
+    return [match["id"] for match in index.query(vector=[1.0, 0.0, 0.0], namespace=namespace, **kwargs)["matches"]]
+
+
+def test_reads_another_processes_flush(tmp_path):
+    web, job = LocalIndex(str(tmp_path)), LocalIndex(str(tmp_path))
+    assert _ids(web) == []
+    job.upsert(vectors=[("a", [1.0, 0.0, 0.0], {"title": "Book"})], namespace="ns")
+    assert _ids(web) == []
+    job.flush()
+    assert _ids(web) == ["a"]
+    assert list(web.fetch(ids=["a"], namespace="ns").vectors) == ["a"]
+
+
+def test_unsaved_writes_are_not_replaced_by_disk(tmp_path):
+    web, job = LocalIndex(str(tmp_path)), LocalIndex(str(tmp_path))
+    web.upsert(vectors=[("b", [0.0, 1.0, 0.0], {})], namespace="ns")
+    job.upsert(vectors=[("a", [1.0, 0.0, 0.0], {})], namespace="ns")
+    job.flush()
+    assert _ids(web) == ["b"]
+
+
+def test_overwrite_leaves_earlier_views_intact(tmp_path):
+    index = LocalIndex(str(tmp_path))
+    index.upsert(vectors=[("a", [0.0, 0.0, 1.0], {}), ("b", [0.0, 1.0, 0.0], {})], namespace="ns")
+    view = index._namespace("ns").vectors
+    index.upsert(vectors=[("a", [1.0, 0.0, 0.0], {})], namespace="ns")
+    assert view[0].tolist() == [0.0, 0.0, 1.0]
+    assert _ids(index, top_k=1) == ["a"]
+
+
+def test_upsert_replaces_vectors_and_metadata(tmp_path):
+    index = LocalIndex(str(tmp_path))
+    index.upsert(vectors=[("a", [1.0, 0.0, 0.0], {"title": "Old"})], namespace="ns")
+    index.upsert(vectors=[("a", [0.0, 1.0, 0.0], {"title": "New"}), ("b", [0.0, 0.0, 1.0], {})], namespace="ns")
+    found = index.fetch(ids=["a", "b", "missing"], namespace="ns").vectors
+    assert sorted(found) == ["a", "b"]
+    assert found["a"].values == [0.0, 1.0, 0.0] and found["a"].metadata == {"title": "New"}
+    assert index.describe_index_stats()["namespaces"]["ns"]["vector_count"] == 2
+
+
+def test_query_ranks_by_similarity_within_the_filter(tmp_path):
+    index = LocalIndex(str(tmp_path))
+    index.upsert(vectors=[("a1", [1.0, 0.0, 0.0], {"title": "A", "page": 1}),
+                          ("a2", [0.6, 0.8, 0.0], {"title": "A", "page": 2}),
+                          ("b1", [1.0, 0.1, 0.0], {"title": "B", "page": 1})], namespace="ns")
+    assert _ids(index) == ["a1", "b1", "a2"]
+    assert _ids(index, filter={"title": "A"}) == ["a1", "a2"]
+    assert _ids(index, filter={"title": {"$in": ["B"]}}) == ["b1"]
+    assert _ids(index, filter={"title": "A", "page": {"$gt": 1}}) == ["a2"]
+    assert _ids(index, filter={"title": "C"}) == []
+    match = index.query(vector=[1.0, 0.0, 0.0], namespace="ns", top_k=1, include_metadata=True)["matches"][0]
+    assert match["metadata"] == {"title": "A", "page": 1}
+
+
+def test_flush_persists_for_a_new_process(tmp_path):
+    index = LocalIndex(str(tmp_path))
+    index.upsert(vectors=[("a", [1.0, 0.0, 0.0], {"title": "A"}), ("b", [0.0, 1.0, 0.0], {"title": "B"})],
+                 namespace="ns")
+    index.update(id="a", set_metadata={"page": 3}, namespace="ns")
+    index.delete(ids=["b"], namespace="ns")
+    assert _ids(LocalIndex(str(tmp_path))) == []
+    index.flush()
+
+    reloaded = LocalIndex(str(tmp_path))
+    assert _ids(reloaded) == ["a"]
+    assert reloaded.fetch(ids=["a"], namespace="ns").vectors["a"].metadata == {"title": "A", "page": 3}
+    assert list(reloaded.list(namespace="ns")) == [["a"]]
@@ -0,0 +1,19 @@
+import sys
+
+from lib import llm_cache, metrics
+from lib.llm_cache import MemoryTier, ResponseCache
+
+
+def test_scraping_creates_no_caches(monkeypatch):
+    monkeypatch.setattr(llm_cache, "_default_cache", None)
+    monkeypatch.delitem(sys.modules, "document_processing.embedding_cache", raising=False)
+    assert 'cache="llm_response"' not in metrics.render()
+    assert llm_cache._default_cache is None
+    assert "document_processing.embedding_cache" not in sys.modules
+
+
+def test_existing_caches_are_reported(monkeypatch):
+    cache = ResponseCache(MemoryTier())
+    cache.get("missing")
+    monkeypatch.setattr(llm_cache, "_default_cache", cache)
+    assert 'cache_misses_total{cache="llm_response"} 1' in metrics.render()
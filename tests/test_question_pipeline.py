@@ -0,0 +1,63 @@
+import pytest
+
+from lib.question_pipeline import GenerationRequestError, TopicTarget, merge, plan_topics
+from models.schema_models import Question, Subtopic, TopicExtractionResponse
+
+TOPICS = TopicExtractionResponse(main_topics=[
+    Subtopic(topic="Motion", subtopics=["Velocity", "Acceleration", "Momentum"]),
+    Subtopic(topic="Energy", subtopics=["Kinetic energy", "Potential energy"]),
+    Subtopic(topic="Waves", subtopics=[]),
+])
+
+
+def _question(text):
+    return Question(type="text_based", question=text, answer="-")
+
+
+def test_pairs_take_every_topics_first_subtopic_first():
+    targets = plan_topics(TOPICS, 10, max_topics=8, min_per_topic=2)
+    assert [(t.main_topic, t.subtopic) for t in targets] == [
+        ("Motion", "Velocity"), ("Energy", "Kinetic energy"), ("Waves", "Waves"),
+        ("Motion", "Acceleration"), ("Energy", "Potential energy")]
+    assert [t.num_questions for t in targets] == [2, 2, 2, 2, 2]
+
+
+def test_questions_are_spread_unevenly_when_they_do_not_divide():
+    targets = plan_topics(TOPICS, 7, max_topics=3, min_per_topic=1)
+    assert [t.num_questions for t in targets] == [3, 2, 2]
+    assert plan_topics(TOPICS, 1)[0] == TopicTarget("Motion", "Velocity", 1)
+
+
+def test_topic_and_subtopic_narrow_the_pairs():
+    targets = plan_topics(TOPICS, 4, topic="energy", min_per_topic=2)
+    assert [(t.main_topic, t.subtopic, t.num_questions) for t in targets] == [
+        ("Energy", "Kinetic energy", 2), ("Energy", "Potential energy", 2)]
+    assert plan_topics(TOPICS, 4, topic="Motion", subtopic="Friction") == [TopicTarget("Motion", "Friction", 4)]
+
+
+@pytest.mark.parametrize("topics, kwargs", [
+    (TOPICS, {"num_questions": 0}),
+    (TopicExtractionResponse(main_topics=[]), {"num_questions": 5}),
+    (TOPICS, {"num_questions": 5, "topic": "Optics"}),
+])
+def test_unservable_requests_are_rejected(topics, kwargs):
+    with pytest.raises(GenerationRequestError):
+        plan_topics(topics, **kwargs)
+
+
+def test_merge_round_robins_and_drops_near_duplicates():
+    batches = [
+        [_question("What is velocity?"), _question("How is velocity measured?")],
+        [_question("What is velocity"), _question("Define kinetic energy.")],
+        [_question("What is a wave?")],
+    ]
+    merged = merge(batches, limit=10)
+    assert [(index, question.question) for index, question in merged] == [
+        (0, "What is velocity?"), (2, "What is a wave?"), (0, "How is velocity measured?"),
+        (1, "Define kinetic energy.")]
+
+
+def test_merge_stops_at_the_limit():
+    batches = [[_question(f"Question {i} about topic {t}?") for i in range(3)] for t in "ab"]
+    merged = merge(batches, limit=3)
+    assert [index for index, _ in merged] == [0, 1, 0]
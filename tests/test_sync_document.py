@@ -0,0 +1,98 @@
+import pytest
+
+from benchmarks.stubs import StubOpenAI
+from db_queries.lexical_index import LexicalIndex
+from db_queries.vector_store import LocalIndex
+from document_processing.pipeline import sync_document
+
+METADATA = {"title": "Book", "subject": "physics"}
+
+
+class RecordingIndex(LocalIndex):
+    """LocalIndex that remembers the updates and deletes it was sent."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.updated, self.deleted = [], []
+
+    def update(self, id, set_metadata=None, values=None, namespace="", **kwargs):
+        self.updated.append(id)
+        return super().update(id=id, set_metadata=set_metadata, values=values, namespace=namespace)
+
+    def delete(self, ids=None, delete_all=False, namespace="", **kwargs):
+        self.deleted.extend(ids)
+        return super().delete(ids=ids, delete_all=delete_all, namespace=namespace)
+
+
+def _chunks(*texts, page=1):
+    offsets, start = [], 0
+    for text in texts:
+        offsets.append(start)
+        start += len(text) + 1
+    return [{"text": text, "chunk_index": i, "page": page, "char_start": offset, "char_end": offset + len(text)}
+            for i, (text, offset) in enumerate(zip(texts, offsets))]
+
+
+@pytest.fixture
+def sync(tmp_path):
+    index = RecordingIndex(str(tmp_path / "index"))
+    lexical = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+
+    def run(chunks):
+        index.updated.clear()
+        index.deleted.clear()
+        return sync_document(chunks, StubOpenAI(latency=0, dimension=8), index, "physics", METADATA, progress=None,
+                             manifest_path=str(tmp_path / "manifest.sqlite3"), lexical=lexical)
+
+    run.index = index
+    return run
+
+
+def _stored_ids(index):
+    return sorted(vector_id for page in index.list(namespace="physics") for vector_id in page)
+
+
+def test_unchanged_document_is_not_embedded_again(sync):
+    chunks = _chunks("Force equals mass times acceleration.", "Energy is conserved.")
+    assert sync(chunks)["vectors"] == 2
+    stats = sync(chunks)
+    assert (stats["vectors"], stats["unchanged"], stats["moved"], stats["deleted"]) == (0, 2, 0, 0)
+
+
+def test_identical_chunks_get_distinct_ids(sync):
+    stats = sync(_chunks("Repeated paragraph.", "Repeated paragraph."))
+    assert stats["vectors"] == 2
+    assert len(_stored_ids(sync.index)) == 2
+
+
+def test_moved_chunks_only_get_a_metadata_update(sync):
+    sync(_chunks("Force equals mass times acceleration.", "Energy is conserved."))
+    stats = sync(_chunks("A new opening line.", "Force equals mass times acceleration.", "Energy is conserved."))
+    assert (stats["vectors"], stats["moved"], stats["unchanged"]) == (1, 2, 0)
+    assert len(sync.index.updated) == 2
+    moved = sync.index.fetch(ids=sync.index.updated, namespace="physics").vectors
+    assert sorted(vector.metadata["chunk_index"] for vector in moved.values()) == [1, 2]
+
+
+def test_removed_chunks_are_deleted(sync):
+    sync(_chunks("Force equals mass times acceleration.", "Energy is conserved."))
+    stats = sync(_chunks("Force equals mass times acceleration."))
+    assert stats["deleted"] == 1 and len(sync.index.deleted) == 1
+    assert len(_stored_ids(sync.index)) == 1
+
+
+def test_first_ingest_removes_legacy_vectors(sync):
+    sync.index.upsert(vectors=[("Book_0", [1.0] * 8, {"title": "Book"}), ("Book_1", [1.0] * 8, {"title": "Book"}),
+                               ("Book_extra", [1.0] * 8, {"title": "Book"})], namespace="physics")
+    stats = sync(_chunks("Force equals mass times acceleration."))
+    assert stats["deleted"] == 2
+    assert sorted(sync.index.deleted) == ["Book_0", "Book_1"]
+    assert "Book_extra" in _stored_ids(sync.index)
+
+
+def test_only_new_chunks_are_written_to_the_lexical_index(sync, monkeypatch):
+    sync(_chunks("Force equals mass times acceleration.", "Energy is conserved."))
+    added = []
+    monkeypatch.setattr(LexicalIndex, "add", lambda self, subject, title, chunks: added.extend(chunks))
+    sync(_chunks("A new opening line.", "Force equals mass times acceleration.", "Energy is conserved."))
+    assert [text for _, text in added] == ["A new opening line."]
@@ -0,0 +1,24 @@
+import logging
+import sys
+from types import SimpleNamespace
+
+from lib import tokens
+
+
+def test_unavailable_encoding_falls_back_to_the_estimate_once(monkeypatch, caplog):
+    calls = []
+
+    def offline(name):
+        calls.append(name)
+        raise ConnectionError("no network")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", SimpleNamespace(encoding_for_model=offline, get_encoding=offline))
+    tokens._encoding.cache_clear()
+    try:
+        with caplog.at_level(logging.WARNING):
+            assert tokens.count_tokens("a" * 40) == tokens.estimate_tokens("a" * 40)
+            assert tokens.count_tokens("b" * 8) == 2
+        assert len(calls) == 1
+        assert len([r for r in caplog.records if "tiktoken" in r.getMessage()]) == 1
+    finally:
+        tokens._encoding.cache_clear()
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from document_processing.manifest import chunk_hash, save_document
+from lib import topic_index
+from lib.question_pipeline import GenerationRequestError, plan_topics
+from models.schema_models import Subtopic, TopicExtractionResponse
+
+RESULTS = [{"title": "Book", "text": "Newton's laws describe motion."}]
+TOPICS = TopicExtractionResponse(main_topics=[Subtopic(topic="Motion", subtopics=["Newton's laws"])])
+
+
+class Chunks:
+    """Stands in for BookChunks, counting how often the book's chunks are fetched."""
+
+    def __init__(self, results=RESULTS):
+        self.results, self.fetches = results, 0
+
+    def get(self):
+        self.fetches += 1
+        return self.results
+
+    async def get_async(self):
+        return self.get()
+
+
+async def _refused_async(results):
+    return None
+
+
+async def _extracted_async(results):
+    return TOPICS
+
+
+@pytest.fixture
+def paths(tmp_path):
+    manifest = str(tmp_path / "manifest.sqlite3")
+    save_document("physics", "Book", [{"vector_id": "Book:0", "chunk_hash": chunk_hash(RESULTS[0]["text"]),
+                                       "chunk_index": 0, "page": 1, "char_start": 0, "char_end": 30}], manifest)
+    return {"path": str(tmp_path / "topics.sqlite3"), "manifest_path": manifest}
+
+
+@pytest.fixture
+def refusing_model(monkeypatch):
+    # `parse` returns None when the model refuses
+    monkeypatch.setattr(topic_index, "extract_all_topics", lambda results: None)
+    monkeypatch.setattr(topic_index, "extract_all_topics_async", _refused_async)
+
+
+@pytest.fixture
+def extracting_model(monkeypatch):
+    monkeypatch.setattr(topic_index, "extract_all_topics", lambda results: TOPICS)
+    monkeypatch.setattr(topic_index, "extract_all_topics_async", _extracted_async)
+
+
+def test_refused_extraction_is_not_stored(refusing_model, paths):
+    assert topic_index.get_topics("physics", "Book", Chunks(), **paths).main_topics == []
+    assert asyncio.run(topic_index.get_topics_async("physics", "Book", Chunks(), **paths)).main_topics == []
+    assert topic_index.load_topics("physics", "Book", topic_index.content_version(RESULTS), paths["path"]) is None
+    with pytest.raises(GenerationRequestError):
+        plan_topics(topic_index.get_topics("physics", "Book", Chunks(), **paths), 5)
+
+
+def test_stored_topics_are_found_without_fetching_chunks(extracting_model, paths):
+    first = Chunks()
+    assert topic_index.get_topics("physics", "Book", first, **paths) == TOPICS
+    assert first.fetches == 1
+
+    again, again_async = Chunks(), Chunks()
+    assert topic_index.get_topics("physics", "Book", again, **paths) == TOPICS
+    assert asyncio.run(topic_index.get_topics_async("physics", "Book", again_async, **paths)) == TOPICS
+    assert again.fetches == again_async.fetches == 0
+
+
+def test_changed_book_is_extracted_again(extracting_model, paths):
+    topic_index.get_topics("physics", "Book", Chunks(), **paths)
+    changed = [{"title": "Book", "text": "Energy is conserved."}]
+    save_document("physics", "Book", [{"vector_id": "Book:1", "chunk_hash": chunk_hash(changed[0]["text"]),
+                                       "chunk_index": 0, "page": 1, "char_start": 0, "char_end": 20}],
+                  paths["manifest_path"])
+    chunks = Chunks(changed)
+    topic_index.get_topics("physics", "Book", chunks, **paths)
+    assert chunks.fetches == 1
+
+
+def test_book_without_chunks_has_no_topics(extracting_model, paths):
+    assert topic_index.get_topics("physics", "Unknown", Chunks([]), **paths) is None
@@ -0,0 +1,52 @@
+"""Throttled or unavailable upstreams reach clients as 429/503 with Retry-After, on both apps."""
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.stubs import StubIndex, install_stub_backends
+from config.pinecone import set_index
+from db_queries.vector_store import GovernedIndex
+from lib.governor import Governor
+
+ANSWER = {"question": "What is Newton's first law?", "user_answer": "Objects keep moving.", "subject": "physics"}
+
+
+class ThrottledError(Exception):
+    status_code = 429
+    headers = {"retry-after": "7"}
+
+
+class ThrottledIndex(StubIndex):
+    def query(self, **kwargs):
+        raise ThrottledError("rate limited")
+
+
+def throttled_index():
+    return GovernedIndex(ThrottledIndex(), Governor("pinecone", 4, max_retries=0))
+
+
+def open_circuit_index():
+    governor = Governor("pinecone", 4)
+    for _ in range(governor.breaker.failures):
+        governor.breaker.record("failed")
+    return GovernedIndex(StubIndex(), governor)
+
+
+@pytest.fixture(params=["fastapi", "flask"])
+def client(request):
+    install_stub_backends(0.0, index_latency=0.0)
+    if request.param == "fastapi":
+        from app import app
+        return TestClient(app)
+    from flask_app import app
+    return app.test_client()
+
+
+@pytest.mark.parametrize("make_index, status", [(throttled_index, 429), (open_circuit_index, 503)])
+@pytest.mark.parametrize("path, payload", [("/answer/analyze", ANSWER), ("/answer/analyze/batch", {"items": [ANSWER]})])
+def test_index_errors_reach_client(client, make_index, status, path, payload):
+    index = make_index()
+    set_index(index)
+    response = client.post(path, json=payload)
+    assert response.status_code == status
+    expected = 7 if status == 429 else index.governor.breaker.reset
+    assert abs(int(response.headers["Retry-After"]) - expected) <= 1